@@ -1,5 +1,11 @@
 from __future__ import annotations
 
-from importlib.metadata import version
 
-__version__ = version("django_squash")
+def __getattr__(name):
+    # Resolved on first access, reading the package metadata is too slow for every process that loads the app
+    if name == "__version__":
+        from importlib.metadata import version  # noqa: PLC0415
+
+        return version("django_squash")
+    msg = f"module {__name__!r} has no attribute {name!r}"
+    raise AttributeError(msg)
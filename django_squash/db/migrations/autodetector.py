@@ -1,21 +1,92 @@
 import datetime
 import itertools
+import multiprocessing
 import os
 import sys
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.reduction import ForkingPickler
 
+import django
 from django.apps import apps
-from django.conf import settings
+from django.conf import SettingsReference, settings
 from django.db import migrations as dj_migrations
 from django.db.migrations.autodetector import MigrationAutodetector as MigrationAutodetectorBase
+from django.db.migrations.optimizer import MigrationOptimizer
+from django.db.migrations.state import ProjectState
+from django.db.migrations.utils import resolve_relation
 
 from django_squash.contrib import postgres
 from django_squash.db.migrations import utils
 
 RESERVED_MIGRATION_KEYWORDS = ("_deleted", "_dependencies_change", "_replaces_change", "_original_migration")
 
+# Attributes set by `_detect_changes()` only needed while the changes are being detected
+AUTODETECTION_INTERMEDIATES = (
+    "altered_constraints",
+    "altered_indexes",
+    "generated_operations",
+    "kept_model_keys",
+    "kept_proxy_keys",
+    "kept_unmanaged_keys",
+    "migrations",
+    "new_field_keys",
+    "new_model_keys",
+    "new_proxy_keys",
+    "new_unmanaged_keys",
+    "old_field_keys",
+    "old_model_keys",
+    "old_proxy_keys",
+    "old_unmanaged_keys",
+    "renamed_fields",
+    "renamed_index_together_values",
+    "renamed_models",
+    "renamed_models_rel",
+    "renamed_operations",
+    "through_users",
+)
+
+# Operations copied over from the original migrations, nothing is ever moved across them
+OPTIMIZATION_BARRIERS = (
+    dj_migrations.RunSQL,
+    dj_migrations.RunPython,
+    dj_migrations.SeparateDatabaseAndState,
+    postgres.PGCreateExtension,
+)
+
+
+class OriginalAttribute:
+    """
+    Attribute of the wrapped migration, read from the original one until it is assigned on the wrapper.
+    """
+
+    def __set_name__(self, owner, name):
+        self.name = name
+        self.default = getattr(dj_migrations.Migration, name)
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self.default
+        try:
+            return instance.__dict__[self.name]
+        except KeyError:
+            pass
+        original = instance.__dict__.get("_original_migration")
+        if original is None:
+            return self.default
+        return getattr(original, self.name)
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.name] = value
+
 
 class Migration(dj_migrations.Migration):
+    operations = OriginalAttribute()
+    dependencies = OriginalAttribute()
+    run_before = OriginalAttribute()
+    replaces = OriginalAttribute()
+    initial = OriginalAttribute()
+    atomic = OriginalAttribute()
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -44,6 +115,10 @@ class Migration(dj_migrations.Migration):
 
     @classmethod
     def from_migration(cls, migration):
+        """
+        Wrap `migration`, nothing is copied: the `OriginalAttribute`s not changed on the wrapper are read from the
+        original, anything else is not proxied.
+        """
         if cls in type(migration).mro():
             return migration
 
@@ -53,14 +128,244 @@ class Migration(dj_migrations.Migration):
                     'Cannot use keyword "%s" in Migration %s.%s' % (keyword, migration.app_label, migration.name)
                 )
 
-        new = cls(name=migration.name, app_label=migration.app_label)
-        new.__dict__.update(migration.__dict__)
+        new = cls.__new__(cls)
+        new.name = migration.name
+        new.app_label = migration.app_label
+        new._deleted = False
+        new._dependencies_change = False
+        new._replaces_change = False
         new._original_migration = migration
         return new
 
 
+class LeafNodes:
+    """
+    Picklable stand-in for the migration graph, `_build_migration_list` only needs to know the leaf nodes of each app.
+    """
+
+    def __init__(self, graph):
+        self.leaves = defaultdict(list)
+        for app_label, name in graph.leaf_nodes():
+            self.leaves[app_label].append((app_label, name))
+
+    def leaf_nodes(self, app=None):
+        return list(self.leaves.get(app, []))
+
+
+_WORKER_CONTEXT = None
+
+
+def _reduce_settings_reference(value):
+    return SettingsReference, (str(value), value.setting_name)
+
+
+def _init_worker(context):
+    global _WORKER_CONTEXT
+    if not apps.ready:  # pragma: no cover
+        # Only needed on platforms that spawn instead of fork
+        django.setup()
+    _WORKER_CONTEXT = context
+
+
+def _detect_component_changes(app_labels):
+    """
+    Run the autodetector only over the models of `app_labels` (and the apps that do not change at all).
+    """
+    from_state, to_state, settled_apps, questioner, leaf_nodes = _WORKER_CONTEXT
+    keep = set(app_labels) | settled_apps
+    autodetector = SquashMigrationAutodetector(
+        ProjectState(
+            models={key: model for key, model in from_state.models.items() if key[0] in keep},
+            real_apps=from_state.real_apps,
+        ),
+        ProjectState(
+            models={key: model for key, model in to_state.models.items() if key[0] in keep},
+            real_apps=to_state.real_apps,
+        ),
+        questioner,
+    )
+    changes = autodetector._detect_changes(graph=leaf_nodes)
+
+    # Migrations are instances of classes built on the fly, they cannot be pickled as they are.
+    return {
+        app_label: [
+            (migration.name, migration.dependencies, migration.operations, migration.initial)
+            for migration in migrations
+        ]
+        for app_label, migrations in changes.items()
+        if app_label in app_labels
+    }
+
+
 class SquashMigrationAutodetector(MigrationAutodetectorBase):
 
+    def related_apps(self, model_state):
+        """
+        Return the apps that `model_state` points to through relations or bases.
+        """
+        related = set()
+        for field in model_state.fields.values():
+            if getattr(field, "remote_field", None) is None:
+                continue
+            for model in (field.remote_field.model, getattr(field.remote_field, "through", None)):
+                if model is not None:
+                    related.add(resolve_relation(model, model_state.app_label, model_state.name_lower)[0])
+        for base in model_state.bases:
+            if isinstance(base, str):
+                related.add(resolve_relation(base, model_state.app_label)[0])
+            elif hasattr(base, "_meta") and not base._meta.abstract:
+                related.add(base._meta.app_label)
+        related.discard(model_state.app_label)
+        return related
+
+    def independent_app_groups(self):
+        """
+        Split the apps that change into groups that have no relations to each other.
+
+        Returns the groups and the "settled" apps: apps whose models are the same in both states and that do not point
+        to any app that changes. Settled apps never produce any operations, they are shared by every group.
+        """
+        from_models = defaultdict(dict)
+        to_models = defaultdict(dict)
+        for state, models in ((self.from_state, from_models), (self.to_state, to_models)):
+            for key, model_state in state.models.items():
+                models[key[0]][key] = model_state
+
+        related_apps = {
+            app_label: set().union(
+                *(
+                    self.related_apps(model_state)
+                    for model_state in itertools.chain(from_models[app_label].values(), to_models[app_label].values())
+                )
+            )
+            for app_label in from_models.keys() | to_models.keys()
+        }
+        changed_apps = {app_label for app_label in related_apps if from_models[app_label] != to_models[app_label]}
+        # Rendering a settled app that points to an app that changes needs that app, so it changes as well
+        dirty = True
+        while dirty:
+            dirty = False
+            for app_label, related in related_apps.items():
+                if app_label not in changed_apps and related & changed_apps:
+                    changed_apps.add(app_label)
+                    dirty = True
+
+        # Connected components (union-find) of the apps that change
+        parents = {app_label: app_label for app_label in changed_apps}
+
+        def find(app_label):
+            while parents[app_label] != app_label:
+                parents[app_label] = parents[parents[app_label]]
+                app_label = parents[app_label]
+            return app_label
+
+        for app_label in changed_apps:
+            for related_app in related_apps[app_label] & changed_apps:
+                parents[find(related_app)] = find(app_label)
+
+        groups = defaultdict(list)
+        for app_label in sorted(changed_apps):
+            groups[find(app_label)].append(app_label)
+        return list(groups.values()), set(related_apps) - changed_apps
+
+    def each_app_fields(self):
+        """
+        Restrict the field keys to one app at a time, with the questioner told which app it is asked about.
+
+        The questioner hooks are only given a model name, the same model name can be in more than one app. Fields are
+        only ever renamed or altered within their own app, restricting them doesn't change what is detected.
+        """
+        old_field_keys, new_field_keys = self.old_field_keys, self.new_field_keys
+        old_by_app, new_by_app = defaultdict(set), defaultdict(set)
+        for keys, by_app in ((old_field_keys, old_by_app), (new_field_keys, new_by_app)):
+            for key in keys:
+                by_app[key[0]].add(key)
+
+        try:
+            for app_label in sorted(old_by_app.keys() | new_by_app.keys()):
+                self.old_field_keys, self.new_field_keys = old_by_app[app_label], new_by_app[app_label]
+                self.questioner.app_label = app_label
+                yield app_label
+        finally:
+            self.old_field_keys, self.new_field_keys = old_field_keys, new_field_keys
+            self.questioner.app_label = None
+
+    def create_renamed_fields(self):
+        renamed_operations = []
+        for _app_label in self.each_app_fields():
+            super().create_renamed_fields()
+            renamed_operations.extend(self.renamed_operations)
+        self.renamed_operations = renamed_operations
+
+    def generate_added_fields(self):
+        for _app_label in self.each_app_fields():
+            super().generate_added_fields()
+
+    def generate_altered_fields(self):
+        for _app_label in self.each_app_fields():
+            super().generate_altered_fields()
+
+    def parallel_changes(self, graph, jobs):
+        """
+        Same as `changes()`, but the autodetection of each independent group of apps runs in its own process.
+        """
+        groups, settled_apps = [], set()
+        if jobs > 1:
+            groups, settled_apps = self.independent_app_groups()
+        if len(groups) <= 1:
+            return super().changes(graph, trim_to_apps=None, convert_apps=None, migration_name=None)
+
+        if "fork" in multiprocessing.get_all_start_methods():
+            mp_context = multiprocessing.get_context("fork")
+        else:  # pragma: no cover
+            mp_context = multiprocessing.get_context()
+
+        context = (self.from_state, self.to_state, settled_apps, self.questioner, LeafNodes(graph))
+        # Biggest groups first, so they don't end up being the last ones to start
+        groups = sorted(groups, key=len, reverse=True)
+        # Swappable relations (settings.AUTH_USER_MODEL) use a str subclass that can't be pickled by default. The
+        # reducer table is shared by the whole process, it is only changed while the pool is running.
+        reducers = ForkingPickler._extra_reducers
+        previous_reducer = reducers.get(SettingsReference)
+        ForkingPickler.register(SettingsReference, _reduce_settings_reference)
+        try:
+            with ProcessPoolExecutor(
+                max_workers=min(jobs, len(groups)), mp_context=mp_context, initializer=_init_worker, initargs=(context,)
+            ) as executor:
+                results = list(executor.map(_detect_component_changes, groups))
+        finally:
+            if previous_reducer is None:
+                reducers.pop(SettingsReference, None)
+            else:
+                reducers[SettingsReference] = previous_reducer
+
+        changes = {}
+        for result in results:
+            for app_label, migrations in result.items():
+                changes[app_label] = []
+                for name, dependencies, operations, initial in migrations:
+                    subclass = type("Migration", (dj_migrations.Migration,), {"operations": [], "dependencies": []})
+                    instance = subclass(name, app_label)
+                    instance.dependencies = dependencies
+                    instance.operations = operations
+                    instance.initial = initial
+                    changes[app_label].append(instance)
+
+        changes = dict(sorted(changes.items()))
+        return self.arrange_for_graph(changes, graph, migration_name=None)
+
+    def release_rendered_states(self):
+        """
+        Drop the rendered apps and the intermediate results of the autodetection, only the changes are needed after.
+
+        The model states (`from_state.models`, `to_state.models`) are kept, they are cheap compared to the rendered
+        models.
+        """
+        for state in (self.from_state, self.to_state):
+            state.__dict__.pop("apps", None)
+        for name in AUTODETECTION_INTERMEDIATES:
+            self.__dict__.pop(name, None)
+
     def add_non_elidables(self, loader, changes):
         replacing_migrations_by_app = {
             app: [
@@ -69,6 +374,10 @@ class SquashMigrationAutodetector(MigrationAutodetectorBase):
             ]
             for app, migrations in changes.items()
         }
+        utils.source_cache.prefetch(
+            getattr(sys.modules[migration.__module__], "__file__", None)
+            for migration in itertools.chain.from_iterable(replacing_migrations_by_app.values())
+        )
 
         for app in changes.keys():
             new_operations = []
@@ -104,13 +413,150 @@ class SquashMigrationAutodetector(MigrationAutodetectorBase):
             migration.operations += new_operations
             migration.extra_imports = new_imports
 
-    def replace_current_migrations(self, original, graph, changes):
+    def optimize_operations(self, changes):
+        """
+        Optimize the squashed migrations once the non-elidable operations are in place.
+
+        The operations between two barriers (RunSQL, RunPython, ...) are optimized on their own, the barriers stay
+        exactly where they are.
+        """
+        optimizer = MigrationOptimizer()
+        for app_label, migrations in changes.items():
+            for migration in migrations:
+                operations = []
+                segment = []
+                for operation in migration.operations:
+                    if isinstance(operation, OPTIMIZATION_BARRIERS):
+                        operations.extend(self.optimize_segment(optimizer, segment, app_label))
+                        operations.append(operation)
+                        segment = []
+                    else:
+                        segment.append(operation)
+                operations.extend(self.optimize_segment(optimizer, segment, app_label))
+                migration.operations = operations
+
+    def merge_sql_operations(self, changes):
+        """
+        Merge the consecutive RunSQL operations of every squashed migration into a single RunSQL.
+
+        The reverse SQL is merged in the reverse order. Only operations that run the same way are merged: same
+        `elidable` and `hints`, and the SQL given the same way (a script or a list of statements).
+        """
+        for migrations in changes.values():
+            for migration in migrations:
+                operations = []
+                for operation in migration.operations:
+                    previous = operations[-1] if operations else None
+                    if (
+                        type(previous) is dj_migrations.RunSQL
+                        and type(operation) is dj_migrations.RunSQL
+                        and self.can_merge_sql(previous, operation)
+                    ):
+                        operations[-1] = self.merge_sql(previous, operation)
+                    else:
+                        operations.append(operation)
+                migration.operations = operations
+
+    @staticmethod
+    def sql_kind(sql):
+        """
+        Return how RunSQL runs `sql`: irreversible (None), "noop", "list" (each item as is) or "script" (split in
+        statements by the database).
+        """
+        if sql is None:
+            return None
+        if sql == dj_migrations.RunSQL.noop:
+            return "noop"
+        if isinstance(sql, (list, tuple)):
+            return "list"
+        return "script"
+
+    def can_merge_sql(self, first, second):
+        if first.elidable != second.elidable or first.hints != second.hints:
+            return False
+        for sqls in ((first.sql, second.sql), (first.reverse_sql, second.reverse_sql)):
+            if len({self.sql_kind(sql) for sql in sqls} - {None, "noop"}) > 1:
+                return False
+        return True
+
+    def merge_sql(self, first, second):
+        """
+        Return the RunSQL running `first` and then `second`, the reverse SQL runs `second`'s first.
+        """
+        operation = dj_migrations.RunSQL(
+            sql=self.join_sql(first.sql, second.sql),
+            reverse_sql=self.join_sql(second.reverse_sql, first.reverse_sql),
+            state_operations=first.state_operations + second.state_operations,
+            hints=first.hints,
+            elidable=first.elidable,
+        )
+        if hasattr(first, "_original_migration"):
+            operation._original_migration = first._original_migration
+        return operation
+
+    def join_sql(self, first, second):
+        if first is None or second is None:
+            # Irreversible
+            return None
+        if self.sql_kind(first) == "noop":
+            return second
+        if self.sql_kind(second) == "noop":
+            return first
+        if self.sql_kind(first) == "list":
+            return [*first, *second]
+        # A trailing comment would swallow the ";" written on the same line
+        separator = "\n" if first.rstrip().endswith(";") else "\n;\n"
+        return first.rstrip() + separator + second
+
+    def optimize_segment(self, optimizer, operations, app_label):
+        """
+        Fold AddField, AddIndex, AddConstraint and AlterUniqueTogether into the CreateModel of their model.
         """
-        Adds 'replaces' to the squash migrations with all the current apps we have.
+        if len(operations) < 2:
+            return operations
+
+        # Takes care of AddField and AlterUniqueTogether (and more)
+        operations = optimizer.optimize(operations, app_label)
+
+        # Not every supported django version reduces indexes and constraints into CreateModel
+        result = []
+        for operation in operations:
+            if isinstance(operation, (dj_migrations.AddIndex, dj_migrations.AddConstraint)):
+                create_model = None
+                for index in range(len(result) - 1, -1, -1):
+                    other = result[index]
+                    if isinstance(other, dj_migrations.CreateModel) and other.name_lower == operation.model_name_lower:
+                        create_model = index
+                        break
+                    if other.references_model(operation.model_name, app_label):
+                        break
+
+                if create_model is not None:
+                    other = result[create_model]
+                    if isinstance(operation, dj_migrations.AddIndex):
+                        option_name, value = "indexes", operation.index
+                    else:
+                        option_name, value = "constraints", operation.constraint
+                    result[create_model] = dj_migrations.CreateModel(
+                        other.name,
+                        fields=other.fields,
+                        options={**other.options, option_name: [*other.options.get(option_name, []), value]},
+                        bases=other.bases,
+                        managers=other.managers,
+                    )
+                    continue
+            result.append(operation)
+
+        return result
+
+    def replace_current_migrations(self, original, graph, changes, kept=()):
+        """
+        Adds 'replaces' to the squash migrations with all the current apps we have, but the `kept` migrations.
         """
         migrations_by_app = defaultdict(list)
         for app, migration in original.graph.node_map:
-            migrations_by_app[app].append((app, migration))
+            if (app, migration) not in kept:
+                migrations_by_app[app].append((app, migration))
 
         for app, migrations in changes.items():
             for migration in migrations:
@@ -187,55 +633,215 @@ class SquashMigrationAutodetector(MigrationAutodetectorBase):
 
                 migration.dependencies = new_dependencies
 
-    def create_deleted_models_migrations(self, loader, changes):
-        migrations_by_label = defaultdict(list)
-        for (app, ident), _ in itertools.groupby(loader.disk_migrations.items(), lambda x: x[0]):
-            migrations_by_label[app].append(ident)
+    def pack_migrations(self, changes):
+        """
+        Merge the migrations of each app into as few migrations as possible.
+
+        Django splits an app in several migrations when it takes part in a cycle of foreign keys across apps. A
+        migration is merged into the previous one of the same app as long as it does not create a cycle (which can
+        only happen inside a strongly connected group of apps), then the cross app dependencies that are already
+        implied by another dependency are dropped.
+        """
+        merged_into = {}
+
+        def resolve(migration):
+            while id(migration) in merged_into:
+                migration = merged_into[id(migration)]
+            return migration
+
+        def dependencies(migration):
+            return [resolve(dependency) for dependency in migration.dependencies if isinstance(dependency, Migration)]
+
+        def reaches(pending, target):
+            seen = set()
+            pending = list(pending)
+            while pending:
+                dependency = pending.pop()
+                if dependency is target:
+                    return True
+                if id(dependency) in seen:
+                    continue
+                seen.add(id(dependency))
+                pending.extend(dependencies(dependency))
+            return False
 
-        for app_config in loader.project_state().apps.get_app_configs():
-            if app_config.models and app_config.label in migrations_by_label:
-                migrations_by_label.pop(app_config.label)
+        for app_label, migrations in changes.items():
+            packed = migrations[:1]
+            for migration in migrations[1:]:
+                previous = packed[-1]
+                # Merging is only possible when nothing else in between depends on the previous migration
+                others = [dependency for dependency in dependencies(migration) if dependency is not previous]
+                if reaches(others, previous):
+                    packed.append(migration)
+                    continue
+                previous.operations = previous.operations + migration.operations
+                previous.dependencies = previous.dependencies + migration.dependencies
+                merged_into[id(migration)] = previous
+            changes[app_label] = packed
+
+        for migrations in changes.values():
+            for migration in migrations:
+                new_dependencies = []
+                for dependency in migration.dependencies:
+                    if isinstance(dependency, Migration):
+                        dependency = resolve(dependency)
+                        if dependency is migration:
+                            continue
+                    if dependency not in new_dependencies:
+                        new_dependencies.append(dependency)
+                migration.dependencies = new_dependencies
+
+        for migrations in changes.values():
+            for migration in migrations:
+                direct = [dependency for dependency in migration.dependencies if isinstance(dependency, Migration)]
+                migration.dependencies = [
+                    dependency
+                    for dependency in migration.dependencies
+                    if not isinstance(dependency, Migration)
+                    or dependency.app_label == migration.app_label
+                    or not any(other is not dependency and reaches([other], dependency) for other in direct)
+                ]
+
+    def create_deleted_models_migrations(self, loader, changes, ignore_apps=(), kept=()):
+        """
+        Apps that still have migrations but no models anymore get an empty migration replacing all of them.
+        """
+        # The autodetector already knows the models of every app, no need to render any state again
+        apps_with_models = {app_label for app_label, _ in self.to_state.models}
 
-        for app_label, migrations in migrations_by_label.items():
+        for app_label, migrations in loader.disk_migrations_by_app.items():
+            if app_label in apps_with_models or app_label in ignore_apps:
+                continue
+            migrations = [migration for migration in migrations if migration not in kept]
+            if not any(migration in loader.graph.nodes for migration in migrations):
+                # Every migration is kept, what is left was already replaced by the previous squash
+                continue
             subclass = type("Migration", (Migration,), {"operations": [], "dependencies": []})
             instance = subclass("temp", app_label)
             instance.replaces = migrations
             changes[app_label] = [instance]
 
-    def squash(self, real_loader, squash_loader, ignore_apps, migration_name=None):
-        changes_ = self.delete_old_squashed(real_loader, ignore_apps)
+    def create_delta_migrations(self, loader, changes, delta_apps):
+        """
+        Apps with migrations since the previous squash but no changes in their models get an empty migration replacing
+        them, it keeps their non-elidable operations.
+        """
+        for app_label in sorted(delta_apps - changes.keys()):
+            subclass = type("Migration", (Migration,), {"operations": [], "dependencies": []})
+            instance = subclass("temp", app_label)
+            instance.dependencies = loader.squash_graph.leaf_nodes(app_label)
+            changes[app_label] = [instance]
+
+    def rewrite_kept_migrations(self, loader, changes, kept, migration_changes):
+        """
+        Point the dependencies of the `kept` migrations (left out of the squash) to the squashed migrations.
+
+        Dependencies on a replaced migration are rewritten to the last squashed migration of its app, the replaced
+        migrations are deleted by the next squash. `migration_changes` holds the migrations already rewritten by
+        `delete_old_squashed`, the ones changed here are added to it.
+        """
+        replaced_by = {}
+        for migrations in changes.values():
+            for migration in migrations:
+                for key in migration.replaces:
+                    replaced_by[key] = tuple(migrations[-1])
+        # The migrations replaced by the previous squash are reached through the migration replacing them
+        for key, migration in loader.replacements.items():
+            for target in migration.replaces:
+                replaced_by.setdefault(target, replaced_by.get(key, key))
+
+        rewritten = {
+            (migration.app_label, migration.name): migration
+            for migrations in migration_changes.values()
+            for migration in migrations
+        }
+        for key in sorted(kept):
+            original = loader.disk_migrations[key]
+            dependencies = [replaced_by.get(tuple(dependency), dependency) for dependency in original.dependencies]
+            if dependencies == list(original.dependencies):
+                continue
+            migration = rewritten.get(key) or Migration.from_migration(original)
+            migration._dependencies_change = True
+            migration.dependencies = dependencies
+            migration_changes[migration.app_label].add(migration)
 
-        graph = squash_loader.graph
-        changes = super().changes(graph, trim_to_apps=None, convert_apps=None, migration_name=None)
+    def squash(
+        self, loader, ignore_apps, migration_name=None, jobs=1, timer=None, merge_sql=False, kept=(), delta=False
+    ):
+        """
+        Generate the squashed migrations, `loader` holds both the real graph and the (empty) squash graph.
+
+        The `kept` migrations are left out of the squash. In a partial squash they are the last ones, `to_state` is
+        expected to be the state right before them. In a `delta` squash they are the first ones, the squash graph
+        holds them and each app with migrations after them gets a single migration replacing those.
+        """
+        timer = timer or utils.PhaseTimer()
+
+        delta_apps = set()
+        clean_apps = ignore_apps
+        if delta:
+            project_apps = loader.project_apps()
+            delta_apps = {
+                app_label
+                for app_label, name in loader.graph.nodes
+                if app_label in project_apps and app_label not in ignore_apps and (app_label, name) not in kept
+            }
+            # The previous squash is only cleaned up in the apps that get a new squashed migration
+            clean_apps = [*ignore_apps, *sorted(project_apps - delta_apps)]
+
+        with timer("delete_old_squashed"):
+            changes_ = self.delete_old_squashed(loader, clean_apps)
+
+        graph = loader.squash_graph
+        with timer("changes"):
+            changes = self.parallel_changes(graph, jobs)
+        self.release_rendered_states()
 
         for app in ignore_apps:
             changes.pop(app, None)
 
-        self.create_deleted_models_migrations(real_loader, changes)
-        self.convert_migration_references_to_objects(real_loader, changes, ignore_apps)
-        self.rename_migrations(real_loader, graph, changes, migration_name)
-        self.replace_current_migrations(real_loader, graph, changes)
-        self.add_non_elidables(real_loader, changes)
+        if delta:
+            with timer("create_delta_migrations"):
+                self.create_delta_migrations(loader, changes, delta_apps)
+        else:
+            with timer("create_deleted_models_migrations"):
+                self.create_deleted_models_migrations(loader, changes, ignore_apps, kept)
+        with timer("convert_migration_references_to_objects"):
+            self.convert_migration_references_to_objects(loader, changes, ignore_apps)
+        with timer("pack_migrations"):
+            self.pack_migrations(changes)
+        with timer("rename_migrations"):
+            self.rename_migrations(loader, graph, changes, migration_name)
+        with timer("replace_current_migrations"):
+            self.replace_current_migrations(loader, graph, changes, kept)
+        if kept:
+            with timer("rewrite_kept_migrations"):
+                self.rewrite_kept_migrations(loader, changes, kept, changes_)
+        with timer("add_non_elidables"):
+            self.add_non_elidables(loader, changes)
+        with timer("optimize_operations"):
+            self.optimize_operations(changes)
+        if merge_sql:
+            with timer("merge_sql_operations"):
+                self.merge_sql_operations(changes)
 
         for app, change in changes_.items():
-            changes[app].extend(change)
+            # Kept migrations of apps left whole are rewritten as well
+            changes.setdefault(app, []).extend(change)
 
         return changes
 
     def delete_old_squashed(self, loader, ignore_apps):
         changes = defaultdict(set)
         project_path = os.path.abspath(os.curdir)
-        project_apps = [
+        project_apps = {
             app.label for app in apps.get_app_configs() if utils.source_directory(app.module).startswith(project_path)
-        ]
+        }
 
-        real_migrations = [
-            Migration.from_migration(loader.disk_migrations[key]) for key in loader.graph.node_map.keys()
-        ]
         project_migrations = [
-            migration
-            for migration in real_migrations
-            if migration.app_label in project_apps and migration.app_label not in ignore_apps
+            Migration.from_migration(loader.disk_migrations[key])
+            for key in loader.graph.node_map
+            if key[0] in project_apps and key[0] not in ignore_apps
         ]
         replaced_migrations = [migration for migration in project_migrations if migration.replaces]
 
@@ -0,0 +1,205 @@
+import ast
+import textwrap
+import time
+from collections import defaultdict
+
+from django.db import migrations as dj_migrations
+
+from django_squash.db.migrations import utils
+
+# Queryset (and manager) methods that only read
+QUERYSET_METHODS = {
+    "all",
+    "annotate",
+    "defer",
+    "distinct",
+    "exclude",
+    "filter",
+    "iterator",
+    "only",
+    "order_by",
+    "prefetch_related",
+    "select_for_update",
+    "select_related",
+    "using",
+    "values",
+    "values_list",
+}
+# Queryset methods that only write the rows that already exist
+QUERYSET_WRITES = {"bulk_update", "update"}
+# Calls without side effects, allowed anywhere
+SAFE_FUNCTIONS = {
+    "Case",
+    "Coalesce",
+    "Concat",
+    "F",
+    "Lower",
+    "Q",
+    "Upper",
+    "Value",
+    "When",
+    "bool",
+    "dict",
+    "float",
+    "getattr",
+    "int",
+    "len",
+    "list",
+    "max",
+    "min",
+    "range",
+    "set",
+    "sorted",
+    "str",
+    "sum",
+    "tuple",
+}
+# Statements the analysis cannot follow
+UNSUPPORTED_STATEMENTS = (
+    ast.AsyncFunctionDef,
+    ast.ClassDef,
+    ast.Delete,
+    ast.FunctionDef,
+    ast.Global,
+    ast.Import,
+    ast.ImportFrom,
+    ast.Lambda,
+    ast.Nonlocal,
+    ast.Try,
+    ast.With,
+)
+
+
+class Candidate:
+    """
+    A non-elidable RunPython operation that does nothing on an empty database.
+    """
+
+    def __init__(self, migration, operation, writes):
+        self.migration = migration
+        self.operation = operation
+        self.writes = writes
+
+    @property
+    def name(self):
+        return getattr(self.operation.code, "__qualname__", repr(self.operation.code))
+
+
+def is_get_model(node, apps_name):
+    return (
+        isinstance(node, ast.Call)
+        and isinstance(node.func, ast.Attribute)
+        and node.func.attr == "get_model"
+        and isinstance(node.func.value, ast.Name)
+        and node.func.value.id == apps_name
+    )
+
+
+def is_queryset(node, models):
+    """
+    Whether `node` is a manager of one of the `models` (ie: `Model.objects`) or a read only queryset out of it.
+    """
+    while (
+        isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr in QUERYSET_METHODS
+    ):
+        node = node.func.value
+    return isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id in models
+
+
+def names(targets):
+    return {target.id for target in targets if isinstance(target, ast.Name)}
+
+
+def analyze_function(func):
+    """
+    Return the writes `func` does (ie: "update") when it only changes rows that already exist, None otherwise.
+
+    The function can only get models out of `apps`, read their querysets, iterate them, save the rows it iterates
+    and update or bulk update them. Anything else (creating rows, raw SQL, calling other functions, ...) could do
+    something on an empty database.
+    """
+    try:
+        source = textwrap.dedent(utils.source_cache.function_source(func))
+        node = ast.parse(source).body[0]
+    except (OSError, TypeError, SyntaxError):
+        return None
+    if not isinstance(node, ast.FunctionDef) or not node.args.args:
+        return None
+
+    apps_name = node.args.args[0].arg
+    models = set()
+    rows = set()
+    lists = set()
+    writes = set()
+    for child in ast.walk(node):
+        if child is not node and isinstance(child, UNSUPPORTED_STATEMENTS):
+            return None
+        if isinstance(child, ast.Assign) and is_get_model(child.value, apps_name):
+            models.update(names(child.targets))
+        elif isinstance(child, ast.Assign) and isinstance(child.value, ast.List) and not child.value.elts:
+            lists.update(names(child.targets))
+        elif isinstance(child, ast.For) and is_queryset(child.iter, models):
+            rows.update(names([child.target]))
+            writes.add("iterate")
+
+    for child in ast.walk(node):
+        if not isinstance(child, ast.Call) or is_get_model(child, apps_name):
+            continue
+        function = child.func
+        if isinstance(function, ast.Name) and function.id in SAFE_FUNCTIONS:
+            continue
+        if not isinstance(function, ast.Attribute):
+            return None
+        if function.attr in SAFE_FUNCTIONS:
+            # ie: models.F(...)
+            continue
+        if is_queryset(function.value, models) and function.attr in QUERYSET_METHODS | QUERYSET_WRITES:
+            if function.attr in QUERYSET_WRITES:
+                writes.add(function.attr)
+            continue
+        if isinstance(function.value, ast.Name):
+            if function.value.id in rows and function.attr == "save":
+                writes.add("save")
+                continue
+            if function.value.id in lists and function.attr == "append":
+                continue
+        return None
+
+    return ", ".join(sorted(writes)) or "noop"
+
+
+def find_candidates(loader, app_labels):
+    """
+    Return, by app, the non-elidable RunPython operations of the migrations of `app_labels` that can be elidable.
+
+    Only the migrations in the graph are looked at, the ones replaced by a squashed migration hold the same functions
+    as the squashed one.
+    """
+    migrations = [loader.disk_migrations[key] for key in sorted(loader.graph.nodes) if key[0] in app_labels]
+
+    candidates = defaultdict(list)
+    for migration in migrations:
+        for operation in migration.operations:
+            if not isinstance(operation, dj_migrations.RunPython) or operation.elidable:
+                continue
+            if operation.code is dj_migrations.RunPython.noop:
+                writes = "noop"
+            elif utils.is_code_in_site_packages(operation.code.__module__):
+                continue
+            else:
+                writes = analyze_function(operation.code)
+            if writes is not None:
+                candidates[migration.app_label].append(Candidate(migration, operation, writes))
+    return dict(candidates)
+
+
+def operation_cost(state, repeat=5):
+    """
+    Estimate the time migrate spends on a RunPython that does nothing: a copy of the (rendered) project state.
+    """
+    # migrate copies a rendered state, the models are rendered once before measuring
+    state.apps
+    start = time.perf_counter()
+    for _ in range(repeat):
+        state.clone()
+    return (time.perf_counter() - start) / repeat
@@ -0,0 +1,80 @@
+import contextlib
+import functools
+import threading
+
+from django.core.management.commands import migrate
+from django.db.migrations.executor import MigrationExecutor
+from django.db.migrations.loader import MigrationLoader
+from django.db.migrations.recorder import MigrationRecorder
+
+# Databases migrated at the same time wait for the first one to build the graph they share
+graphs_lock = threading.Lock()
+
+
+class SharedMigrationLoader(MigrationLoader):
+    """
+    Loader of one database built out of the migrations imported by `source`, nothing is read from disk again.
+
+    The graph only depends on the database through the replaced migrations it has applied, so databases that are on
+    the same side of every squashed migration share the same graph out of `graphs`.
+    """
+
+    def __init__(self, connection, source, graphs):
+        self.source = source
+        self.graphs = graphs
+        super().__init__(connection)
+
+    def load_disk(self):
+        self.disk_migrations = self.source.disk_migrations
+        self.migrated_apps = self.source.migrated_apps
+        self.unmigrated_apps = self.source.unmigrated_apps
+
+    def build_graph(self):
+        self.load_disk()
+        applied_migrations = MigrationRecorder(self.connection).applied_migrations()
+        replaced = {target for migration in self.source.replacements.values() for target in migration.replaces}
+        key = frozenset(replaced.intersection(applied_migrations))
+
+        with graphs_lock:
+            if key not in self.graphs:
+                super().build_graph()
+                self.graphs[key] = (self.graph, self.replacements)
+                return
+            self.graph, self.replacements = self.graphs[key]
+
+        # Same as MigrationLoader.build_graph, a replacing migration is applied when all its targets are
+        self.applied_migrations = applied_migrations
+        for replacing_key, migration in self.replacements.items():
+            if all(target in applied_migrations for target in migration.replaces):
+                self.applied_migrations[replacing_key] = migration
+            else:
+                self.applied_migrations.pop(replacing_key, None)
+
+
+class SharedMigrationExecutor(MigrationExecutor):
+    """
+    MigrationExecutor using a `SharedMigrationLoader`.
+    """
+
+    def __init__(self, connection, progress_callback=None, *, source, graphs):
+        # MigrationExecutor.__init__ would build a new loader, importing every migration again
+        self.connection = connection
+        self.loader = SharedMigrationLoader(connection, source, graphs)
+        self.recorder = MigrationRecorder(connection)
+        self.progress_callback = progress_callback
+
+
+@contextlib.contextmanager
+def shared_migrations(source=None):
+    """
+    Make the `migrate` command reuse the migrations (and graphs) of `source` for every database while active.
+    """
+    if source is None:
+        source = MigrationLoader(None)
+
+    original_executor = migrate.MigrationExecutor
+    migrate.MigrationExecutor = functools.partial(SharedMigrationExecutor, source=source, graphs={})
+    try:
+        yield source
+    finally:
+        migrate.MigrationExecutor = original_executor
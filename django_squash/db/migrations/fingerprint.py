@@ -0,0 +1,101 @@
+import hashlib
+import json
+import os
+import sys
+
+from django.db import migrations as dj_migrations
+from django.db.migrations import writer as dj_writer
+
+from django_squash.db.migrations import utils
+
+FINGERPRINT_VERSION = 1
+
+
+class FingerprintCache:
+    """
+    Persisted fingerprint of every app at the end of the last squash.
+
+    The fingerprint of an app is made out of the hash of each file inside its migrations module and the serialized
+    state of its models. If neither changed since the last squash, there is nothing new to squash in that app.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fingerprints = {}
+        # The autodetector alters the state it's given, the models are hashed once before it runs
+        self.state_hashes = {}
+
+        if os.path.isfile(path):
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == FINGERPRINT_VERSION:
+                self.fingerprints = data["apps"]
+
+    def save(self):
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump({"version": FINGERPRINT_VERSION, "apps": self.fingerprints}, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+    def unchanged_apps(self, loader, state, app_labels):
+        """
+        Return the apps from `app_labels` whose fingerprint matches the one from the last squash.
+
+        An app that depends on an app that changed is considered changed as well, its dependencies may be rewritten.
+        """
+        changed_apps = {
+            app_label
+            for app_label in app_labels
+            if self.fingerprints.get(app_label) != self.fingerprint(loader, state, app_label)
+        }
+
+        # Propagate the changes to the apps that depend on them, until nothing else changes.
+        dirty = True
+        while dirty:
+            dirty = False
+            for (app_label, _), node in loader.graph.node_map.items():
+                if app_label in changed_apps:
+                    continue
+                if any(parent_app != app_label and parent_app in changed_apps for parent_app, _ in node.parents):
+                    changed_apps.add(app_label)
+                    dirty = True
+
+        return [app_label for app_label in app_labels if app_label not in changed_apps]
+
+    def update(self, loader, state, app_labels):
+        for app_label in app_labels:
+            self.fingerprints[app_label] = self.fingerprint(loader, state, app_label)
+
+    def fingerprint(self, loader, state, app_label):
+        fingerprint = hashlib.sha256()
+
+        if app_label not in self.state_hashes:
+            self.state_hashes[app_label] = self.state_hash(state, app_label)
+        fingerprint.update(self.state_hashes[app_label].encode())
+
+        module_name, _ = loader.migrations_module(app_label)
+        module = sys.modules.get(module_name) if module_name else None
+        for path in getattr(module, "__path__", []):
+            for file_name in sorted(os.listdir(path)):
+                if not file_name.endswith(".py"):
+                    continue
+                fingerprint.update(file_name.encode())
+                fingerprint.update(utils.file_hash(os.path.join(path, file_name)).encode())
+
+        return fingerprint.hexdigest()
+
+    def state_hash(self, state, app_label):
+        state_hash = hashlib.sha256()
+        for (model_app_label, _), model_state in sorted(state.models.items()):
+            if model_app_label != app_label:
+                continue
+            operation = dj_migrations.CreateModel(
+                name=model_state.name,
+                fields=list(model_state.fields.items()),
+                options=model_state.options,
+                bases=model_state.bases,
+                managers=model_state.managers,
+            )
+            operation_string, _ = dj_writer.OperationWriter(operation).serialize()
+            state_hash.update(operation_string.encode())
+
+        return state_hash.hexdigest()
@@ -1,11 +1,9 @@
 import logging
-import os
-import tempfile
-from contextlib import ExitStack
+from collections import defaultdict
 
 from django.apps import apps
-from django.conf import settings
 from django.db.migrations.loader import MigrationLoader
+from django.db.migrations.state import ProjectState
 
 from django_squash.db.migrations import utils
 
@@ -13,33 +11,162 @@ logger = logging.getLogger(__name__)
 
 
 class SquashMigrationLoader(MigrationLoader):
+    """
+    Scans and imports the migrations from disk once and builds two graphs out of that single scan:
+
+    * ``graph``: the real migration graph, exactly what django's ``MigrationLoader`` would build.
+    * ``squash_graph``: the same graph where every app that belongs to the user (not in the site-packages) has no
+      migrations at all, this is the starting point the squashed migrations are generated from.
+    """
+
     def __init__(self, *args, **kwargs):
-        # keep a copy of the original migration modules to restore it later
-        original_migration_modules = settings.MIGRATION_MODULES
-        # make a copy of the migration modules so we can modify it
-        settings.MIGRATION_MODULES = settings.MIGRATION_MODULES.copy()
+        self.squash_graph = None
+        self.disk_migrations_by_app = {}
+        self._disk_loaded = False
+        super().__init__(*args, **kwargs)
+
+    def load_disk(self):
+        # The disk only needs to be scanned once, every other graph is derived from the same migrations
+        if self._disk_loaded:
+            return
+        super().load_disk()
+        self._disk_loaded = True
+
+        disk_migrations_by_app = defaultdict(list)
+        for app_label, migration_name in sorted(self.disk_migrations):
+            disk_migrations_by_app[app_label].append((app_label, migration_name))
+        self.disk_migrations_by_app = dict(disk_migrations_by_app)
+
+    def build_graph(self):
+        super().build_graph()
+        self.build_squash_graph()
+
+    def build_squash_graph(self, kept=()):
+        """
+        Build the ``squash_graph``, only the ``kept`` migrations of the user's apps are left in it (none by default).
+        """
+        project_apps = self.project_apps()
+
+        real = (
+            self.graph,
+            self.replacements,
+            self.applied_migrations,
+            self.disk_migrations,
+            self.migrated_apps,
+            self.unmigrated_apps,
+        )
+        try:
+            # Pretend the user's apps have an empty migrations module (or one with the kept migrations)
+            self.disk_migrations = {
+                key: migration
+                for key, migration in self.disk_migrations.items()
+                if key[0] not in project_apps or key in kept
+            }
+            self.migrated_apps = self.migrated_apps | project_apps
+            self.unmigrated_apps = self.unmigrated_apps - project_apps
+            super().build_graph()
+            self.squash_graph = self.graph
+            self.squash_unmigrated_apps = self.unmigrated_apps
+        finally:
+            (
+                self.graph,
+                self.replacements,
+                self.applied_migrations,
+                self.disk_migrations,
+                self.migrated_apps,
+                self.unmigrated_apps,
+            ) = real
+
+    def project_apps(self):
+        """
+        Return the labels of the apps that belong to the user, ignoring any apps inside the site-packages.
+        """
         site_packages_path = utils.site_packages_path()
+        project_apps = set()
+        for app_config in apps.get_app_configs():
+            # absolute path to the app
+            app_path = utils.source_directory(app_config.module)
+
+            if app_path.startswith(site_packages_path):
+                # ignore any apps in inside site-packages
+                logger.debug("Ignoring app %s inside site-packages: %s", app_config.label, app_path)
+                continue
+
+            project_apps.add(app_config.label)
+        return project_apps
+
+    def squash_project_state(self, nodes=None, at_end=True):
+        """
+        Return a ProjectState object representing the state of the ``squash_graph``.
+        """
+        return self.squash_graph.make_state(nodes=nodes, at_end=at_end, real_apps=self.squash_unmigrated_apps)
+
+    def plan(self):
+        """
+        Return every migration of the real ``graph``, in the order they are applied.
+        """
+        plan = {}
+        for leaf in self.graph.leaf_nodes():
+            plan.update(dict.fromkeys(self.graph.forwards_plan(leaf)))
+        return list(plan)
+
+    def kept_migrations(self, app_labels, keep_last=0, upto=None):
+        """
+        Return the migrations of ``app_labels`` that are left out of a partial squash.
+
+        Those are the last ``keep_last`` migrations of each app, or the ones after ``upto[app_label]`` when given, and
+        every migration that depends on one of them: the squashed migrations can only depend on squashed migrations.
+        """
+        upto = upto or {}
+        plan = self.plan()
+        kept = set()
+        for app_label in app_labels:
+            migrations = [key for key in plan if key[0] == app_label]
+            if app_label in upto:
+                squashed = set(self.graph.forwards_plan(upto[app_label]))
+                kept.update(key for key in migrations if key not in squashed)
+            elif keep_last:
+                kept.update(migrations[-keep_last:])
+
+        pending = list(kept)
+        while pending:
+            node = self.graph.node_map[pending.pop()]
+            for child in node.children:
+                if child.key[0] in app_labels and child.key not in kept:
+                    kept.add(child.key)
+                    pending.append(child.key)
+        return kept
+
+    def delta_base(self, app_labels):
+        """
+        Return the migrations a delta squash of ``app_labels`` starts from.
+
+        Those are the last squashed migrations of each app (the ones replacing others) and every migration they
+        depend on, only the migrations after them are squashed.
+        """
+        base = set()
+        for key in self.replacements:
+            if key[0] in app_labels and key in self.graph.nodes:
+                base.update(self.graph.forwards_plan(key))
+        return base
+
+    def partial_state(self, to_state, kept, app_labels):
+        """
+        Return ``to_state`` where the models of ``app_labels`` are the ones right before the ``kept`` migrations.
+
+        Every app of ``app_labels`` comes from the same cut of the graph, the squashed migrations only depend on each
+        other so they are a valid history on their own: a model renamed (or deleted) by an app that is fully squashed
+        is renamed in the relations of the partially squashed apps as well.
+        """
+        squashed = {key for key in self.graph.nodes if key[0] in app_labels and key not in kept}
+        # The last squashed migrations are enough, the state is built out of all their ancestors
+        nodes = [
+            key
+            for key in sorted(squashed)
+            if not any(child.key in squashed for child in self.graph.node_map[key].children)
+        ]
+        state = self.graph.make_state(nodes=nodes, at_end=True, real_apps=self.unmigrated_apps)
 
-        with ExitStack() as stack:
-            # Find each app that belongs to the user and are not in the site-packages. Create a fake temporary
-            # directory inside each app that will tell django we don't have any migrations at all.
-            for app_config in apps.get_app_configs():
-                # absolute path to the app
-                app_path = utils.source_directory(app_config.module)
-
-                if app_path.startswith(site_packages_path):
-                    # ignore any apps in inside site-packages
-                    logger.debug("Ignoring app %s inside site-packages: %s", app_config.label, app_path)
-                    continue
-
-                temp_dir = stack.enter_context(tempfile.TemporaryDirectory(prefix="migrations_", dir=app_path))
-                # Need to make this directory a proper python module otherwise django will refuse to recognize it
-                open(os.path.join(temp_dir, "__init__.py"), "a").close()
-                settings.MIGRATION_MODULES[app_config.label] = "%s.%s" % (
-                    app_config.module.__name__,
-                    os.path.basename(temp_dir),
-                )
-
-            super().__init__(*args, **kwargs)
-
-        settings.MIGRATION_MODULES = original_migration_modules
+        models = {key: model for key, model in to_state.models.items() if key[0] not in app_labels}
+        models.update({key: model for key, model in state.models.items() if key[0] in app_labels})
+        return ProjectState(models=models, real_apps=to_state.real_apps)
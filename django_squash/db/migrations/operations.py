@@ -0,0 +1,162 @@
+import copy
+
+from django.apps import apps as global_apps
+from django.db import migrations as dj_migrations
+from django.db.migrations.operations.base import Operation
+
+
+def database_version(connection):
+    """
+    Version of the database server behind `connection`, as stored in the snapshots.
+    """
+    return ".".join(str(part) for part in connection.get_database_version())
+
+
+def model_tables(models):
+    """
+    Return the tables of `models` (auto created many to many tables included), unmanaged and proxy models have none.
+    """
+    tables = set()
+    for model in models:
+        if not model._meta.managed or model._meta.proxy:
+            continue
+        tables.add(model._meta.db_table)
+        for field in model._meta.local_many_to_many:
+            through = field.remote_field.through
+            if through._meta.auto_created:
+                tables.add(through._meta.db_table)
+    return tables
+
+
+def installed_tables(app_label):
+    """
+    Return the tables of the current models of `app_label`, none if the app is not installed anymore.
+    """
+    try:
+        app_config = global_apps.get_app_config(app_label)
+    except LookupError:
+        return set()
+    return model_tables(app_config.get_models())
+
+
+class SchemaSnapshot(Operation):
+    """
+    Run the SQL snapshot of `operations` when none of their tables exist yet, run `operations` otherwise.
+
+    `snapshots` holds, for each database vendor, the SQL its schema editor generated for `operations` when the
+    migrations were squashed, `versions` the version of the database server it came from. On an empty database of the
+    same vendor and version, executing it replaces running (and rendering the models for) every single operation.
+    """
+
+    def __init__(self, operations, snapshots, tables, versions=None):
+        self.operations = operations
+        self.snapshots = snapshots
+        self.tables = tables
+        self.versions = versions or {}
+
+    def deconstruct(self):
+        kwargs = {
+            "operations": self.operations,
+            "snapshots": self.snapshots,
+            "tables": self.tables,
+            "versions": self.versions,
+        }
+        return (self.__class__.__qualname__, [], kwargs)
+
+    @property
+    def reversible(self):
+        return all(operation.reversible for operation in self.operations)
+
+    def state_forwards(self, app_label, state):
+        for operation in self.operations:
+            operation.state_forwards(app_label, state)
+
+    def use_snapshot(self, app_label, schema_editor, from_state, to_state):
+        """
+        Whether the snapshot SQL can be run instead of the operations.
+
+        The SQL has to come from the same vendor and server version, create the same tables the operations would create
+        with the current settings, and the database can't hold any table of the app other than the ones created by the
+        previous operations (a database half migrated by the replaced migrations).
+        """
+        connection = schema_editor.connection
+        if connection.vendor not in self.snapshots or schema_editor.collect_sql:
+            return False
+        if self.versions.get(connection.vendor) != database_version(connection):
+            return False
+        if not self.allow_migrate(app_label, connection.alias, to_state):
+            return False
+
+        models = [model for model in to_state.apps.get_models() if model._meta.app_label == app_label]
+        previous = model_tables(model for model in models if (app_label, model._meta.model_name) in from_state.models)
+        created = model_tables(model for model in models if (app_label, model._meta.model_name) not in from_state.models)
+        if created != set(self.tables):
+            return False
+        unexpected = (created | installed_tables(app_label)) - previous
+        return not unexpected.intersection(connection.introspection.table_names())
+
+    def allow_migrate(self, app_label, connection_alias, state):
+        """
+        Whether the router allows every model of the operations on `connection_alias`, the operations are run otherwise
+        (each one skips the models it is not allowed to migrate).
+        """
+        for operation in self.operations:
+            model_name = getattr(operation, "model_name", None) or getattr(operation, "name", None)
+            try:
+                model = state.apps.get_model(app_label, model_name)
+            except (LookupError, TypeError, ValueError):
+                return False
+            if not operation.allow_migrate_model(connection_alias, model):
+                return False
+        return True
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if self.use_snapshot(app_label, schema_editor, from_state, to_state):
+            for statement in self.snapshots[schema_editor.connection.vendor]:
+                schema_editor.execute(statement, params=None)
+            return
+
+        for operation in self.operations:
+            to_state = from_state.clone()
+            operation.state_forwards(app_label, to_state)
+            operation.database_forwards(app_label, schema_editor, from_state, to_state)
+            from_state = to_state
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        to_states = {}
+        for operation in self.operations:
+            to_states[operation] = to_state
+            to_state = to_state.clone()
+            operation.state_forwards(app_label, to_state)
+
+        for operation in reversed(self.operations):
+            from_state = to_state
+            to_state = to_states[operation]
+            operation.database_backwards(app_label, schema_editor, from_state, to_state)
+
+    def describe(self):
+        return "Schema snapshot (%s) of %i operations" % (", ".join(sorted(self.snapshots)), len(self.operations))
+
+
+class SnapshotMigration(dj_migrations.Migration):
+    """
+    Migration holding `SchemaSnapshot` operations.
+
+    Everything reading the operations (`migrate --fake-initial`, the autodetector, `squashmigrations`, ...) sees them
+    unwrapped, only applying the migration runs the snapshots.
+    """
+
+    def __init__(self, name, app_label):
+        super().__init__(name, app_label)
+        self.snapshot_operations = self.operations
+        self.operations = [
+            unwrapped
+            for operation in self.snapshot_operations
+            for unwrapped in (operation.operations if isinstance(operation, SchemaSnapshot) else [operation])
+        ]
+
+    def apply(self, project_state, schema_editor, collect_sql=False):
+        # A copy, the migration is shared by every database migrated at the same time
+        migration = copy.copy(self)
+        migration.operations = self.snapshot_operations
+        return super(SnapshotMigration, migration).apply(project_state, schema_editor, collect_sql)
@@ -1,7 +1,76 @@
+from django.core.management.base import CommandError
+from django.db import migrations as dj_migrations
 from django.db.migrations.questioner import NonInteractiveMigrationQuestioner as NonInteractiveMigrationQuestionerBase
+from django.db.models.fields import NOT_PROVIDED
+from django.utils import timezone
 
 
 class NonInteractiveMigrationQuestioner(NonInteractiveMigrationQuestionerBase):
     def ask_initial(self, *args, **kwargs):
         # Ensures that the 0001_initial will always be generated
         return True
+
+
+class DeltaMigrationQuestioner(NonInteractiveMigrationQuestioner):
+    """
+    Answers the questions of a delta squash out of the migrations it replaces.
+
+    Autodetecting from the previous squashed state asks what the replaced migrations already answered: the models and
+    fields they rename (instead of removing and adding them again, losing the data) and the one-off defaults of the
+    non-nullable fields they add.
+    """
+
+    def __init__(self, migrations, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # The hooks are only given a model name, the autodetector sets the app they are asked about
+        self.app_label = None
+        self.renamed_models = set()
+        self.renamed_fields = set()
+        self.field_defaults = {}
+        for migration in migrations:
+            app_label = migration.app_label
+            for operation in migration.operations:
+                if isinstance(operation, dj_migrations.RenameModel):
+                    self.renamed_models.add((app_label, operation.old_name_lower, operation.new_name_lower))
+                elif isinstance(operation, dj_migrations.RenameField):
+                    self.renamed_fields.add(
+                        (app_label, operation.model_name_lower, operation.old_name_lower, operation.new_name_lower)
+                    )
+                elif isinstance(operation, (dj_migrations.AddField, dj_migrations.AlterField)):
+                    if operation.field.has_default():
+                        key = (app_label, operation.model_name_lower, operation.name_lower)
+                        self.field_defaults[key] = operation.field.default
+
+        # Renamed more than once (a -> b -> c) is asked as a single rename (a -> c)
+        for renames in (self.renamed_models, self.renamed_fields):
+            dirty = True
+            while dirty:
+                chained = {
+                    (*first[:-1], second[-1])
+                    for first in renames
+                    for second in renames
+                    if first[:-2] == second[:-2] and first[-1] == second[-2] and first[-2] != second[-1]
+                }
+                dirty = not chained <= renames
+                renames |= chained
+
+    def ask_rename(self, model_name, old_name, new_name, field_instance):
+        return (self.app_label, model_name.lower(), old_name.lower(), new_name.lower()) in self.renamed_fields
+
+    def ask_rename_model(self, old_model_state, new_model_state):
+        return (new_model_state.app_label, old_model_state.name_lower, new_model_state.name_lower) in self.renamed_models
+
+    def ask_not_null_addition(self, field_name, model_name):
+        try:
+            return self.field_defaults[self.app_label, model_name.lower(), field_name.lower()]
+        except KeyError:
+            raise CommandError(
+                "Cannot add the non-nullable field '%s' on model '%s.%s', none of the squashed migrations gives it a "
+                "default." % (field_name, self.app_label, model_name)
+            ) from None
+
+    def ask_not_null_alteration(self, field_name, model_name):
+        return self.field_defaults.get((self.app_label, model_name.lower(), field_name.lower()), NOT_PROVIDED)
+
+    def ask_auto_now_add_addition(self, field_name, model_name):
+        return self.field_defaults.get((self.app_label, model_name.lower(), field_name.lower()), timezone.now)
@@ -0,0 +1,96 @@
+import contextlib
+import importlib
+import sys
+import time
+from collections import defaultdict
+
+from django.apps import apps
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.migrations.executor import MigrationExecutor
+from django.db.migrations.loader import MigrationLoader
+from django.db.utils import load_backend
+
+
+class GraphMeasure:
+    """
+    Numbers of applying a whole migration graph to an empty database.
+    """
+
+    def __init__(self):
+        self.loader_time = 0
+        self.migrations = defaultdict(int)
+        self.operations = defaultdict(int)
+        self.migrate_time = defaultdict(float)
+
+    @property
+    def total_migrate_time(self):
+        return sum(self.migrate_time.values())
+
+
+@contextlib.contextmanager
+def in_memory_database():
+    """
+    Replace the default database with a throwaway in-memory SQLite database.
+
+    The default alias is replaced (and not added next to it) so RunPython code that does not use
+    `schema_editor.connection.alias` doesn't end up writing into the real database.
+    """
+    settings_dict = connections.configure_settings(
+        {DEFAULT_DB_ALIAS: {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"}}
+    )[DEFAULT_DB_ALIAS]
+    connection = load_backend(settings_dict["ENGINE"]).DatabaseWrapper(settings_dict, DEFAULT_DB_ALIAS)
+
+    original_connection = connections[DEFAULT_DB_ALIAS]
+    connections[DEFAULT_DB_ALIAS] = connection
+    try:
+        yield connection
+    finally:
+        connection.close()
+        connections[DEFAULT_DB_ALIAS] = original_connection
+
+
+def forget_migration_modules():
+    """
+    Drop the imported migration modules, so the files rewritten by the squash are imported again.
+    """
+    module_names = set()
+    for app_config in apps.get_app_configs():
+        module_name, _ = MigrationLoader.migrations_module(app_config.label)
+        if module_name:
+            module_names.add(module_name + ".")
+
+    for name in list(sys.modules):
+        if name.startswith(tuple(module_names)):
+            del sys.modules[name]
+    importlib.invalidate_caches()
+
+
+def measure_graph():
+    """
+    Apply the migrations currently on disk to an empty in-memory database and measure it.
+    """
+    measure = GraphMeasure()
+    started = {}
+
+    def progress_callback(action, migration=None, fake=False):
+        del fake
+        if action == "apply_start":
+            started[migration.app_label, migration.name] = time.perf_counter()
+        elif action == "apply_success":
+            elapsed = time.perf_counter() - started.pop((migration.app_label, migration.name))
+            measure.migrate_time[migration.app_label] += elapsed
+
+    with in_memory_database() as connection:
+        start = time.perf_counter()
+        executor = MigrationExecutor(connection, progress_callback)
+        measure.loader_time = time.perf_counter() - start
+
+        targets = executor.loader.graph.leaf_nodes()
+        plan = executor.migration_plan(targets)
+        for migration, _ in plan:
+            measure.migrations[migration.app_label] += 1
+            measure.operations[migration.app_label] += len(migration.operations)
+
+        executor.migrate(targets, plan=plan)
+
+    return measure
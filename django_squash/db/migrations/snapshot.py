@@ -0,0 +1,123 @@
+from django.core.management.base import CommandError
+from django.db import connections
+from django.db import migrations as dj_migrations
+
+from django_squash.db.migrations.autodetector import OPTIMIZATION_BARRIERS
+from django_squash.db.migrations.operations import SchemaSnapshot, database_version, model_tables
+
+
+def add_schema_snapshots(state, migrations, aliases):
+    """
+    Wrap the schema operations of the squashed `migrations` in a `SchemaSnapshot` holding the SQL of every database.
+
+    `state` is the state the squashed migrations start from. Operations that cannot be snapshotted (RunSQL,
+    RunPython, ...) are left as they are and split the snapshots.
+    """
+    migrations = sorted_migrations(migrations)
+    states = {alias: state.clone() for alias in aliases}
+    # Databases of the same vendor share the snapshot, it has to be the same SQL and server version for all of them
+    vendor_aliases = {}
+    versions = {}
+
+    for migration in migrations:
+        app_label = migration.app_label
+        segments = split_segments(migration.operations)
+
+        snapshots = [{} for _ in segments]
+        tables = [set() for _ in segments]
+        for alias in aliases:
+            connection = connections[alias]
+            state = states[alias]
+            for index, (start, end) in enumerate(segments):
+                if start is None:
+                    # Barrier, only its effect on the state matters
+                    migration.operations[end].state_forwards(app_label, state)
+                    continue
+
+                with connection.schema_editor(collect_sql=True, atomic=False) as schema_editor:
+                    for operation in migration.operations[start:end]:
+                        new_state = state.clone()
+                        operation.state_forwards(app_label, new_state)
+                        operation.database_forwards(app_label, schema_editor, state, new_state)
+                        state = new_state
+                sql = snapshots[index].setdefault(connection.vendor, schema_editor.collected_sql)
+                vendor_alias = vendor_aliases.setdefault(connection.vendor, alias)
+                version = versions.setdefault(connection.vendor, database_version(connection))
+                if sql != schema_editor.collected_sql or version != database_version(connection):
+                    raise CommandError(
+                        "The databases %s and %s generate a different schema or run a different version of the same "
+                        "vendor (%s), only one of them can be given to --schema-snapshot."
+                        % (vendor_alias, alias, connection.vendor)
+                    )
+                tables[index] = created_tables(app_label, migration.operations[start:end], state)
+            states[alias] = state
+
+        operations = []
+        for index, (start, end) in enumerate(segments):
+            if start is None:
+                operations.append(migration.operations[end])
+            elif tables[index]:
+                operations.append(
+                    SchemaSnapshot(
+                        operations=migration.operations[start:end],
+                        snapshots=snapshots[index],
+                        tables=sorted(tables[index]),
+                        versions={vendor: versions[vendor] for vendor in snapshots[index]},
+                    )
+                )
+            else:
+                operations.extend(migration.operations[start:end])
+        migration.operations = operations
+
+
+def sorted_migrations(migrations):
+    """
+    Return `migrations` sorted so every migration comes after the ones (from `migrations`) it depends on.
+    """
+    migrations = list(migrations)
+    known = {id(migration) for migration in migrations}
+    seen = set()
+    result = []
+
+    def visit(migration):
+        if id(migration) in seen:
+            return
+        seen.add(id(migration))
+        for dependency in migration.dependencies:
+            if id(dependency) in known:
+                visit(dependency)
+        result.append(migration)
+
+    for migration in migrations:
+        visit(migration)
+    return result
+
+
+def split_segments(operations):
+    """
+    Return the (start, end) slices of the operations that can be snapshotted, barriers are returned as (None, index).
+    """
+    segments = []
+    start = None
+    for index, operation in enumerate(operations):
+        if isinstance(operation, OPTIMIZATION_BARRIERS):
+            if start is not None:
+                segments.append((start, index))
+                start = None
+            segments.append((None, index))
+        elif start is None:
+            start = index
+    if start is not None:
+        segments.append((start, len(operations)))
+    return segments
+
+
+def created_tables(app_label, operations, state):
+    """
+    Return the tables created by the CreateModel `operations` (auto created many to many tables included).
+    """
+    return model_tables(
+        state.apps.get_model(app_label, operation.name)
+        for operation in operations
+        if isinstance(operation, dj_migrations.CreateModel)
+    )
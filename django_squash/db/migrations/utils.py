@@ -1,14 +1,22 @@
 import ast
+import contextlib
 import functools
 import hashlib
 import importlib
 import inspect
+import io
 import itertools
 import os
 import re
+import sys
 import sysconfig
+import tempfile
+import textwrap
+import time
+import tokenize
 import types
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 from django.db import migrations
 from django.utils.module_loading import import_string
@@ -44,11 +52,225 @@ def file_hash(file_path):
     return file_hash.hexdigest()
 
 
+def replace_files(files, deleted_files=()):
+    """
+    Write every (path, content) of `files` and remove `deleted_files`, either all of them or none.
+
+    Contents go to temporary files next to their destination first, they are only moved into place (`os.replace`) once
+    every one of them was written successfully. The files being replaced or removed are moved aside to backups, on any
+    error the backups are moved back before re-raising. Each move is atomic, the set is not: a process killed while
+    moving the files leaves the backups (hidden ".<name>.*.bak" files) behind.
+    """
+    # mkstemp() creates files only readable by the owner, use the same permissions a regular open() would
+    umask = os.umask(0)
+    os.umask(umask)
+
+    temp_paths = []
+    try:
+        for path, content in files:
+            fd, temp_path = tempfile.mkstemp(prefix=".%s." % os.path.basename(path), dir=os.path.dirname(path))
+            temp_paths.append((temp_path, path))
+            with os.fdopen(fd, "w", encoding="utf-8") as fh:
+                fh.write(content)
+            mode = os.stat(path).st_mode if os.path.exists(path) else 0o666 & ~umask
+            os.chmod(temp_path, mode & 0o7777)
+    except BaseException:
+        for temp_path, _ in temp_paths:
+            os.remove(temp_path)
+        raise
+
+    def backup(path):
+        fd, backup_path = tempfile.mkstemp(
+            prefix=".%s." % os.path.basename(path), suffix=".bak", dir=os.path.dirname(path)
+        )
+        os.close(fd)
+        try:
+            os.replace(path, backup_path)
+        except BaseException:
+            os.remove(backup_path)
+            raise
+        return backup_path
+
+    # (backup, path) of every path changed so far, the backup is None for new files
+    moved = []
+    try:
+        for temp_path, path in temp_paths:
+            moved.append((backup(path) if os.path.exists(path) else None, path))
+            os.replace(temp_path, path)
+        for path in deleted_files:
+            moved.append((backup(path), path))
+    except BaseException:
+        for backup_path, path in reversed(moved):
+            if backup_path is not None:
+                os.replace(backup_path, path)
+            elif os.path.exists(path):
+                os.remove(path)
+        for temp_path, _ in temp_paths:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        raise
+
+    for backup_path, _ in moved:
+        if backup_path is not None:
+            os.remove(backup_path)
+
+
+class ModuleIndex:
+    """
+    Origin of the modules looked up during a run: the file they come from and the directory of their source.
+
+    Lookups (`find_spec`, `inspect.getsourcefile`) happen once per module, `clear()` is called at the start of every
+    squash so modules moved in between runs are not missed.
+    """
+
+    def __init__(self):
+        self.origins = {}
+        self.directories = {}
+
+    def clear(self):
+        self.origins.clear()
+        self.directories.clear()
+
+    def origin(self, module_name):
+        """
+        Return the file the module is loaded from, None if it cannot be found.
+        """
+        try:
+            return self.origins[module_name]
+        except KeyError:
+            pass
+
+        origin = getattr(sys.modules.get(module_name), "__file__", None)
+        if origin is None:
+            try:
+                spec = importlib.util.find_spec(module_name)
+            except ImportError:
+                spec = None
+            origin = spec.origin if spec is not None else None
+
+        self.origins[module_name] = origin
+        return origin
+
+    def is_installed(self, module_name):
+        """
+        Whether the module lives in the site-packages (installed) rather than in the project.
+        """
+        origin = self.origin(module_name)
+        return origin is not None and origin.startswith(site_packages_path())
+
+    def source_directory(self, module):
+        try:
+            return self.directories[module.__name__]
+        except KeyError:
+            pass
+
+        directory = self.directories[module.__name__] = os.path.dirname(os.path.abspath(inspect.getsourcefile(module)))
+        return directory
+
+
+module_index = ModuleIndex()
+
+
+class SourceCache:
+    """
+    Source text and parsed AST of the files read during a run, keyed by path and mtime.
+
+    The same migration files are read by several helpers (imports, copied functions, attribute replacements), they are
+    read and parsed only once as long as they are not modified.
+    """
+
+    PREFETCH_WORKERS = 8
+
+    def __init__(self):
+        self.sources = {}
+        self.trees = {}
+        self.lines = {}
+
+    def clear(self):
+        self.sources.clear()
+        self.trees.clear()
+        self.lines.clear()
+
+    def source(self, path):
+        mtime = os.stat(path).st_mtime_ns
+        cached = self.sources.get(path)
+        if cached is None or cached[0] != mtime:
+            # tokenize.open() honours the encoding declared in the file, same as the import system
+            with tokenize.open(path) as f:
+                cached = self.sources[path] = (mtime, f.read())
+        return cached[1]
+
+    def tree(self, path):
+        source = self.source(path)
+        cached = self.trees.get(path)
+        if cached is None or cached[0] is not source:
+            cached = self.trees[path] = (source, ast.parse(source, path))
+        return cached[1]
+
+    def function_source(self, func):
+        """
+        Same as `inspect.getsource(func)`, reading the file from the cache.
+        """
+        path = func.__code__.co_filename
+        if not os.path.isfile(path):
+            return inspect.getsource(func)
+        source = self.source(path)
+        cached = self.lines.get(path)
+        if cached is None or cached[0] is not source:
+            cached = self.lines[path] = (source, io.StringIO(source).readlines())
+        return "".join(inspect.getblock(cached[1][func.__code__.co_firstlineno - 1 :]))
+
+    def prefetch(self, paths):
+        """
+        Read `paths` ahead of time in a (bounded) pool of threads, then parse them.
+
+        Only the reads happen in the threads, `ast.parse()` is not thread-safe on every supported python version.
+        """
+        paths = [path for path in dict.fromkeys(paths) if path]
+        if len(paths) > 1:
+            with ThreadPoolExecutor(max_workers=min(self.PREFETCH_WORKERS, len(paths))) as executor:
+                list(executor.map(self._prefetch, paths))
+
+        for path in paths:
+            if path in self.sources:
+                self._prefetch(path, parse=True)
+
+    def _prefetch(self, path, parse=False):
+        # Unreadable files are left for whoever needs them to raise
+        try:
+            if parse:
+                self.tree(path)
+            else:
+                self.source(path)
+        except (OSError, SyntaxError, ValueError):
+            pass
+
+
+source_cache = SourceCache()
+
+
 def source_directory(module):
     """
     Return the absolute path of a module
     """
-    return os.path.dirname(os.path.abspath(inspect.getsourcefile(module)))
+    return module_index.source_directory(module)
+
+
+class PhaseTimer:
+    """
+    Collects the wall-clock and CPU time spent in each phase of a run.
+    """
+
+    def __init__(self):
+        self.phases = []
+
+    @contextlib.contextmanager
+    def __call__(self, name):
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - wall, time.process_time() - cpu))
 
 
 class UniqueVariableName:
@@ -112,10 +334,7 @@ def get_imports(module):
     """
     Return an generator with all the imports to a particular py file as string
     """
-    source = inspect.getsource(module)
-    path = inspect.getsourcefile(module)
-
-    root = ast.parse(source, path)
+    root = source_cache.tree(inspect.getsourcefile(module))
     for node in ast.iter_child_nodes(root):
         if isinstance(node, ast.Import):
             for n in node.names:
@@ -129,6 +348,58 @@ def get_imports(module):
             continue
 
 
+def used_names(source):
+    """
+    Return the names read by the code in `source`, None if it cannot be parsed.
+    """
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        return None
+    return {node.id for node in ast.walk(tree) if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load)}
+
+
+def imported_names(imports):
+    """
+    Return the names bound by the `imports` (as strings).
+    """
+    names = set()
+    for import_string in imports:
+        for node in ast.parse(import_string).body:
+            if isinstance(node, (ast.Import, ast.ImportFrom)):
+                names.update(alias.asname or alias.name.partition(".")[0] for alias in node.names)
+    return names
+
+
+def prune_imports(imports, names):
+    """
+    Return the `imports` (as strings) stripped of everything that does not bind one of `names`.
+    """
+    pruned = []
+    for import_string in imports:
+        try:
+            (node,) = ast.parse(import_string).body
+        except (SyntaxError, ValueError):
+            pruned.append(import_string)
+            continue
+
+        if isinstance(node, ast.ImportFrom) and any(alias.name == "*" for alias in node.names):
+            pruned.append(import_string)
+            continue
+
+        aliases = [alias for alias in node.names if (alias.asname or alias.name.partition(".")[0]) in names]
+        if not aliases:
+            continue
+        aliases_string = ", ".join(
+            alias.name if alias.asname is None else f"{alias.name} as {alias.asname}" for alias in aliases
+        )
+        if isinstance(node, ast.ImportFrom):
+            pruned.append(f"from {'.' * node.level}{node.module or ''} import {aliases_string}")
+        else:
+            pruned.append(f"import {aliases_string}")
+    return pruned
+
+
 def normalize_function_name(name):
     _, _, function_name = name.rpartition(".")
     if function_name[0].isdigit():
@@ -147,33 +418,26 @@ def copy_func(f, name):
     func.__source__ = re.sub(
         pattern=rf"(def\s+){normalize_function_name(f.__qualname__)}",
         repl=rf"\1{name}",
-        string=inspect.getsource(f),
+        string=source_cache.function_source(f),
         count=1,
     )
     return func
 
 
-def find_brackets(line, p_count, b_count):
-    for char in line:
-        if char == "(":
-            p_count += 1
-        elif char == ")":
-            p_count -= 1
-        elif char == "[":
-            b_count += 1
-        elif char == "]":
-            b_count -= 1
-    return p_count, b_count
+def function_fingerprint(func):
+    """
+    Hash of the code of `func` ignoring its name, formatting and comments, functions with the same fingerprint can be
+    copied once.
+    """
+    source = textwrap.dedent(source_cache.function_source(func))
+    node = ast.parse(source).body[0]
+    node.name = ""
+    return hashlib.sha256(ast.dump(node).encode()).hexdigest()
 
 
 def is_code_in_site_packages(module_name):
     # Find the module in the site-packages directory
-    site_packages_path_ = site_packages_path()
-    try:
-        loader = importlib.util.find_spec(module_name)
-    except ImportError:
-        return False
-    return loader.origin.startswith(site_packages_path_)
+    return module_index.is_installed(module_name)
 
 
 @functools.lru_cache(maxsize=1)
@@ -182,44 +446,45 @@ def site_packages_path():
     return sysconfig.get_path("purelib")
 
 
-def replace_migration_attribute(source, attr, value):
-    tree = ast.parse(source)
+def replace_migration_attributes(source, values, tree=None):
+    """
+    Replace the attributes of the Migration class (ie: `dependencies`, `replaces`) with the ones in `values`.
+
+    All the attributes are replaced in a single pass, the statements are located using the AST (start and end lines)
+    so brackets inside strings and comments don't matter. Returns None if the source is not a migration.
+    """
+    if tree is None:
+        tree = ast.parse(source)
     # Skip this file if it is not a migration.
-    migration_node = None
     for node in tree.body:
         if isinstance(node, ast.ClassDef) and node.name == "Migration":
             migration_node = node
             break
     else:
-        return
+        return None
 
-    # Find the `attr` variable.
-    comment_out_nodes = {}
+    # Find the statements assigning the attributes, by their first line
+    statements = {}
     for node in migration_node.body:
-        if isinstance(node, ast.Assign) and node.targets[0].id == attr:
-            comment_out_nodes[node.lineno] = (
-                node.targets[0].col_offset,
-                node.targets[0].id,
-            )
-
-    # Skip this migration if it does not contain the `attr` we're looking for
-    if not comment_out_nodes:
-        return
-
-    # Remove the lines that form the multi-line "replaces" statement.
-    p_count = 0
-    b_count = 0
+        if isinstance(node, ast.Assign) and len(node.targets) == 1:
+            target = node.targets[0]
+        elif isinstance(node, ast.AnnAssign) and node.value is not None:
+            target = node.target
+        else:
+            continue
+        if isinstance(target, ast.Name) and target.id in values:
+            statements[node.lineno] = (node.end_lineno, node.col_offset, target.id)
+
     output = []
-    for lineno, line in enumerate(source.splitlines()):
-        if lineno + 1 in comment_out_nodes.keys():
-            output.append(" " * comment_out_nodes[lineno + 1][0] + attr + " = " + str(value))
-            p_count = 0
-            b_count = 0
-            p_count, b_count = find_brackets(line, p_count, b_count)
-        elif p_count != 0 or b_count != 0:
-            p_count, b_count = find_brackets(line, p_count, b_count)
+    lines = source.splitlines()
+    lineno = 1
+    while lineno <= len(lines):
+        if lineno in statements:
+            end_lineno, col_offset, attr = statements[lineno]
+            output.append(" " * col_offset + attr + " = " + str(values[attr]))
+            lineno = end_lineno + 1
         else:
-            output.append(line)
+            output.append(lines[lineno - 1])
+            lineno += 1
 
-    # Overwrite the existing migration file to update it.
     return "\n".join(output) + "\n"
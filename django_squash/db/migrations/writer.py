@@ -1,3 +1,4 @@
+import functools
 import inspect
 import os
 import re
@@ -10,7 +11,7 @@ from django.db.migrations import writer as dj_writer
 from django.utils.timezone import now
 
 from django_squash.contrib import postgres
-from django_squash.db.migrations import operators, utils
+from django_squash.db.migrations import operations, operators, utils
 
 SUPPORTED_DJANGO_WRITER = (
     "39645482d4eb04b9dd21478dc4bdfeea02393913dd2161bf272f4896e8b3b343",  # 5.0
@@ -19,11 +20,20 @@ SUPPORTED_DJANGO_WRITER = (
 )
 
 
+@functools.lru_cache(maxsize=None)
+def django_migration_hash(path, mtime):
+    """
+    Hash of the django migrations writer file, cached as long as the file is not modified.
+    """
+    del mtime
+    return utils.file_hash(path)
+
+
 def check_django_migration_hash():
     """
     Check if the django migrations writer file has changed and may not be compatible with django-squash.
     """
-    current_django_migration_hash = utils.file_hash(dj_writer.__file__)
+    current_django_migration_hash = django_migration_hash(dj_writer.__file__, os.stat(dj_writer.__file__).st_mtime)
     if current_django_migration_hash not in SUPPORTED_DJANGO_WRITER:
         messsage = textwrap.dedent(
             f"""\
@@ -37,9 +47,6 @@ def check_django_migration_hash():
         warnings.warn(messsage, Warning)
 
 
-check_django_migration_hash()
-
-
 class OperationWriter(dj_writer.OperationWriter):
     def serialize(self):
         if isinstance(self.operation, postgres.PGCreateExtension):
@@ -148,7 +155,7 @@ class MigrationWriter(ReplacementMigrationWriter):
     template_class = """\
 %(migration_header)s%(imports)s%(functions)s%(variables)s
 
-class Migration(migrations.Migration):
+class Migration(%(migration_class)s):
 %(replaces_str)s%(initial_str)s
     dependencies = [
 %(dependencies)s\
@@ -165,7 +172,9 @@ class Migration(migrations.Migration):
         if hasattr(self.migration, "is_migration_level") and self.migration.is_migration_level:
             return self.replace_in_migration()
 
-        variables = []
+        # Copied functions and SQL variables by content, the same body is only written once
+        functions = {}
+        variables = {}
         custom_naming_function = utils.get_custom_rename_function()
         unique_names = utils.UniqueVariableName(
             {"app": self.migration.app_label}, naming_function=custom_naming_function
@@ -190,94 +199,108 @@ class Migration(migrations.Migration):
             if isinstance(operation, dj_migrations.RunPython):
                 # Bind the deconstruct() to the instance to get the elidable
                 operation.deconstruct = deconstruct.__get__(operation, operation.__class__)
-                if not utils.is_code_in_site_packages(operation.code.__module__):
-                    code_name = utils.normalize_function_name(unique_names.function(operation.code))
-                    operation.code = utils.copy_func(operation.code, code_name)
-                    operation.code.__in_migration_file__ = True
+                operation.code = self.copy_function(operation.code, unique_names, functions)
                 if operation.reverse_code:
-                    if not utils.is_code_in_site_packages(operation.reverse_code.__module__):
-                        reversed_code_name = utils.normalize_function_name(
-                            unique_names.function(operation.reverse_code)
-                        )
-                        operation.reverse_code = utils.copy_func(operation.reverse_code, reversed_code_name)
-                        operation.reverse_code.__in_migration_file__ = True
+                    operation.reverse_code = self.copy_function(operation.reverse_code, unique_names, functions)
             elif isinstance(operation, dj_migrations.RunSQL):
                 # Bind the deconstruct() to the instance to get the elidable
                 operation.deconstruct = deconstruct.__get__(operation, operation.__class__)
 
-                variable_name = unique_names("SQL", force_number=True)
-                variables.append(self.template_variable % (variable_name, repr(operation.sql)))
-                operation.sql = operators.Variable(variable_name, operation.sql)
+                operation.sql = self.sql_variable(operation.sql, "SQL", unique_names, variables)
                 if operation.reverse_sql:
-                    reverse_variable_name = "%s_ROLLBACK" % variable_name
-                    variables.append(self.template_variable % (reverse_variable_name, repr(operation.reverse_sql)))
-                    operation.reverse_sql = operators.Variable(reverse_variable_name, operation.reverse_sql)
+                    operation.reverse_sql = self.sql_variable(
+                        operation.reverse_sql, "%s_ROLLBACK" % operation.sql.name, unique_names, variables
+                    )
 
         return super().as_string()
 
+    @staticmethod
+    def copy_function(func, unique_names, functions):
+        """
+        Return the copy of `func` that goes into the migration file, reusing the copy of a function with the same code.
+        """
+        if utils.is_code_in_site_packages(func.__module__):
+            return func
+
+        try:
+            fingerprint = utils.function_fingerprint(func)
+        except SyntaxError:
+            # ie: lambdas, their source is the line they are in
+            fingerprint = func
+        if fingerprint not in functions:
+            name = utils.normalize_function_name(unique_names.function(func))
+            functions[fingerprint] = utils.copy_func(func, name)
+            functions[fingerprint].__in_migration_file__ = True
+        return functions[fingerprint]
+
+    @staticmethod
+    def sql_variable(sql, name, unique_names, variables):
+        """
+        Return the variable holding `sql` in the migration file, reusing the variable of the same SQL.
+        """
+        key = repr(sql)
+        if key not in variables:
+            variables[key] = operators.Variable(unique_names(name, force_number=name == "SQL"), sql)
+        return variables[key]
+
     def replace_in_migration(self):
         if self.migration._deleted:
-            os.remove(self.path)
+            # The file is removed by whoever writes the migrations
             return
 
-        changed = False
-        with open(self.path) as f:
-            source = f.read()
-
+        values = {}
         if self.migration._dependencies_change:
-            source = utils.replace_migration_attribute(source, "dependencies", self.migration.dependencies)
-            changed = True
+            values["dependencies"] = self.migration.dependencies
         if self.migration._replaces_change:
-            source = utils.replace_migration_attribute(source, "replaces", self.migration.replaces)
-            changed = True
-        if not changed:
+            values["replaces"] = self.migration.replaces
+        if not values:
             raise NotImplementedError()  # pragma: no cover
 
-        return source
+        return utils.replace_migration_attributes(
+            utils.source_cache.source(self.path), values, utils.source_cache.tree(self.path)
+        )
 
     def get_kwargs(self):
         kwargs = super().get_kwargs()
-        functions_references = []
+        # Operations share the functions and variables with the same content, each one is written once
+        written = set()
         functions = []
         variables = []
         for operation in self.migration.operations:
             if isinstance(operation, dj_migrations.RunPython):
-                if hasattr(operation.code, "__original__"):
-                    if operation.code.__original__ in functions_references:
+                for code in (operation.code, operation.reverse_code):
+                    if not code or code in written or utils.is_code_in_site_packages(code.__module__):
                         continue
-                    functions_references.append(operation.code.__original__)
-                else:
-                    if operation.code in functions_references:
-                        continue
-                    functions_references.append(operation.code)
-
-                if not utils.is_code_in_site_packages(operation.code.__module__):
-                    functions.append(textwrap.dedent(operation.code.__source__))
-                if operation.reverse_code:
-                    if hasattr(operation.reverse_code, "__original__"):
-                        if operation.reverse_code.__original__ in functions_references:
-                            continue
-                        functions_references.append(operation.reverse_code.__original__)
-                    else:
-                        if operation.reverse_code in functions_references:
-                            continue
-                        functions_references.append(operation.reverse_code)
-                    if not utils.is_code_in_site_packages(operation.reverse_code.__module__):
-                        functions.append(textwrap.dedent(operation.reverse_code.__source__))
+                    written.add(code)
+                    functions.append(textwrap.dedent(code.__source__))
             elif isinstance(operation, dj_migrations.RunSQL):
-                variables.append(self.template_variable % (operation.sql.name, repr(operation.sql.value)))
-                if operation.reverse_sql:
-                    variables.append(
-                        self.template_variable % (operation.reverse_sql.name, repr(operation.reverse_sql.value))
-                    )
+                for sql in (operation.sql, operation.reverse_sql):
+                    if not sql or sql.name in written:
+                        continue
+                    written.add(sql.name)
+                    variables.append(self.template_variable % (sql.name, repr(sql.value)))
             elif isinstance(operation, postgres.PGCreateExtension):
                 if not utils.is_code_in_site_packages(operation.__class__.__module__):
                     functions.append(textwrap.dedent(inspect.getsource(operation.__class__)))
 
+        if any(isinstance(operation, operations.SchemaSnapshot) for operation in self.migration.operations):
+            # Imported along with the SchemaSnapshot operations
+            kwargs["migration_class"] = "django_squash.db.migrations.operations.SnapshotMigration"
+        else:
+            kwargs["migration_class"] = "migrations.Migration"
         kwargs["functions"] = ("\n\n" if functions else "") + "\n\n".join(functions)
         kwargs["variables"] = ("\n\n" if variables else "") + "\n\n".join(variables)
 
-        imports = (x for x in set(kwargs["imports"].split("\n") + getattr(self.migration, "extra_imports", [])) if x)
+        extra_imports = getattr(self.migration, "extra_imports", [])
+        if extra_imports:
+            # Only keep the imports copied over from the replaced migrations that are still used
+            names = utils.used_names(self.template_class % {**kwargs, "migration_header": "", "imports": ""})
+            if names is not None:
+                # Names already imported by the operations themselves don't need to be imported twice
+                names -= utils.imported_names(x for x in kwargs["imports"].split("\n") if x.startswith("from "))
+                extra_imports = utils.prune_imports(set(extra_imports), names)
+
+        imports = (x for x in set(kwargs["imports"].split("\n") + extra_imports) if x)
         sorted_imports = sorted(imports, key=lambda i: (i.split()[0] == "from", i.split()))
         kwargs["imports"] = "\n".join(sorted_imports) + "\n" if imports else ""
 
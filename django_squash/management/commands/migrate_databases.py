@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import io
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.migrations.recorder import MigrationRecorder
+
+from django_squash.db.migrations.executor import shared_migrations
+
+
+class Command(BaseCommand):
+    """Migrate several databases at once, sharing the migrations imported (and graphs built) between them."""
+
+    help = (
+        "Apply the migrations to several databases at once. The migrations are imported, and their graph built, once "
+        "for every database."
+    )
+
+    def add_arguments(self, parser):
+        """Databases to migrate and how many at the same time."""
+        parser.add_argument(
+            "databases",
+            nargs="*",
+            metavar="DATABASE",
+            help="Aliases of the databases to migrate. (default: every database)",
+        )
+        parser.add_argument(
+            "--jobs",
+            "-j",
+            type=int,
+            default=4,
+            help="Number of databases migrated at the same time. (default: %(default)s)",
+        )
+
+    def handle(self, **kwargs):
+        """Migrate the databases in a pool of threads, reporting each one as it finishes."""
+        self.verbosity = kwargs.get("verbosity")
+        aliases = kwargs["databases"] or list(connections)
+        bad_aliases = [alias for alias in aliases if alias not in connections]
+        if bad_aliases:
+            msg = f"The following databases are not valid: {', '.join(bad_aliases)}"
+            raise CommandError(msg)
+        if kwargs["jobs"] < 1:
+            msg = "--jobs must be at least 1."
+            raise CommandError(msg)
+
+        start = time.perf_counter()
+        timings = {}
+        failures = {}
+        # Loaded here, the workers only build (or reuse) the graph of their database
+        with shared_migrations(), ThreadPoolExecutor(max_workers=min(kwargs["jobs"], len(aliases))) as executor:
+            futures = {executor.submit(self.migrate, alias): alias for alias in aliases}
+            for done, future in enumerate(as_completed(futures), start=1):
+                alias = futures[future]
+                progress = f"[{done}/{len(aliases)}]"
+                try:
+                    applied, elapsed, output = future.result()
+                except Exception as e:  # noqa: BLE001
+                    failures[alias] = e
+                    self.stderr.write(f"  {progress} {alias}: {self.style.ERROR(f'FAILED {e}')}\n")
+                    continue
+
+                timings[alias] = elapsed
+                if self.verbosity > 0:
+                    self.stdout.write(f"  {progress} {alias}: {applied} migrations applied in {elapsed:.3f}s\n")
+                if self.verbosity > 1:
+                    self.stdout.write(output)
+
+        if self.verbosity > 0 and timings:
+            slowest = max(timings, key=timings.get)
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Migrated {len(timings)} databases in {time.perf_counter() - start:.3f}s "
+                    f"(slowest: {slowest} in {timings[slowest]:.3f}s)\n"
+                )
+            )
+
+        if failures:
+            msg = f"Migrating the following databases failed: {', '.join(sorted(failures))}"
+            raise CommandError(msg)
+
+    def migrate(self, alias):
+        """Migrate the database `alias`, returns the number of migrations applied, the time it took and the output."""
+        output = io.StringIO()
+        start = time.perf_counter()
+        try:
+            recorder = MigrationRecorder(connections[alias])
+            applied_before = recorder.applied_migrations().keys()
+            # The output is kept apart for every database, it would be interleaved otherwise
+            call_command(
+                "migrate",
+                database=alias,
+                interactive=False,
+                skip_checks=True,
+                verbosity=max(self.verbosity - 1, 0),
+                no_color=True,
+                stdout=output,
+            )
+            applied = len(recorder.applied_migrations().keys() - applied_before)
+        finally:
+            # Every thread has its own connections, they are not reused once the database is migrated
+            connections[alias].close()
+        return applied, time.perf_counter() - start, output.getvalue()
@@ -3,15 +3,12 @@ import os
 
 from django.apps import apps
 from django.core.management.base import BaseCommand, CommandError, no_translations
-from django.db.migrations.loader import MigrationLoader
-from django.db.migrations.state import ProjectState
+from django.db import connections
 
 from django_squash import settings as app_settings
-from django_squash.db.migrations import serializer
-from django_squash.db.migrations.autodetector import SquashMigrationAutodetector
-from django_squash.db.migrations.loader import SquashMigrationLoader
-from django_squash.db.migrations.questioner import NonInteractiveMigrationQuestioner
-from django_squash.db.migrations.writer import MigrationWriter
+
+# Everything else is imported when the command runs, `manage.py help` and friends should not pay for the squash
+# machinery (autodetector, loader, writer, ...) on every startup.
 
 
 class Command(BaseCommand):
@@ -36,12 +33,112 @@ class Command(BaseCommand):
             help="Sets the name of the new squashed migration. Also accepted are the standard datetime parse "
             'variables such as "%%Y%%m%%d". (default: "%(default)s" -> "xxxx_%(default)s")',
         )
+        parser.add_argument(
+            "--fingerprint-file",
+            default=str(app_settings.DJANGO_SQUASH_FINGERPRINT_FILE),
+            help="Incremental squash: skip the apps that did not change since the last squash, the fingerprint of "
+            "every app is persisted in this file. (default: %(default)r -> disabled)",
+        )
+        parser.add_argument(
+            "--jobs",
+            type=int,
+            default=1,
+            help="Number of processes used to autodetect the changes of independent groups of apps and to render "
+            "the migration files. (default: %(default)s)",
+        )
+        parser.add_argument(
+            "--report",
+            action="store_true",
+            help="Apply the current and the squashed migrations to in-memory SQLite databases and report the "
+            "difference in migrations, operations, loader and migrate time.",
+        )
+        parser.add_argument(
+            "--schema-snapshot",
+            nargs="+",
+            default=[],
+            metavar="DATABASE",
+            help="Also store in the squashed migrations the SQL that creates their schema, for the vendor of each "
+            "given database. On an empty database that SQL is executed instead of the operations.",
+        )
+        parser.add_argument(
+            "--merge-sql",
+            action="store_true",
+            help="Merge the consecutive RunSQL operations kept in the squashed migrations into a single RunSQL, "
+            "fewer operations (and project state copies) for migrate to go through.",
+        )
+        parser.add_argument(
+            "--keep-last",
+            type=int,
+            default=0,
+            metavar="N",
+            help="Partial squash: leave the last N migrations of every app out of the squash, their dependencies "
+            "are rewritten to point to the squashed migrations. (default: %(default)s -> squash everything)",
+        )
+        parser.add_argument(
+            "--upto",
+            nargs="+",
+            default=[],
+            metavar="APP_LABEL.MIGRATION_NAME",
+            help="Partial squash: only squash the migrations of the app up to (and including) the given one, takes "
+            "precedence over --keep-last for that app.",
+        )
+        parser.add_argument(
+            "--delta",
+            action="store_true",
+            help="Delta squash: keep the previous squashed migrations as they are and only squash the migrations "
+            "after them, into a single new migration per app.",
+        )
+        parser.add_argument(
+            "--elidable-candidates",
+            action="store_true",
+            help="Only report the non-elidable RunPython operations that do nothing on an empty database (they only "
+            "update the rows that already exist), candidates to be marked elidable=True. Nothing is squashed.",
+        )
+        parser.add_argument(
+            "--profile",
+            action="store_true",
+            help="Print the wall-clock and CPU time spent in each phase of the squash.",
+        )
+        parser.add_argument(
+            "--profile-output",
+            help="Write a cProfile (pstats) dump of the whole run to this file.",
+        )
 
     @no_translations
     def handle(self, **kwargs):
+        import cProfile
+
+        from django_squash.db.migrations import utils
+
         self.verbosity = 1
         self.include_header = False
         self.dry_run = kwargs["dry_run"]
+        self.timer = utils.PhaseTimer()
+
+        profiler = cProfile.Profile() if kwargs["profile_output"] else None
+        if profiler is not None:
+            profiler.enable()
+        try:
+            self.squash(**kwargs)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(kwargs["profile_output"])
+            if kwargs["profile"]:
+                self.write_profile()
+
+    def squash(self, **kwargs):
+        from django.db.migrations.state import ProjectState
+
+        from django_squash.db.migrations import report, utils, writer
+        from django_squash.db.migrations.autodetector import SquashMigrationAutodetector
+        from django_squash.db.migrations.fingerprint import FingerprintCache
+        from django_squash.db.migrations.loader import SquashMigrationLoader
+        from django_squash.db.migrations.questioner import NonInteractiveMigrationQuestioner
+
+        writer.check_django_migration_hash()
+        utils.module_index.clear()
+        utils.source_cache.clear()
 
         ignore_apps = []
         bad_apps = []
@@ -74,23 +171,94 @@ class Command(BaseCommand):
         if bad_apps:
             raise CommandError("The following apps are not valid: %s" % (", ".join(bad_apps)))
 
+        if kwargs["report"] and self.dry_run:
+            raise CommandError("--report needs to write the squashed migrations, it cannot be used with --dry-run.")
+
+        if kwargs["schema_snapshot"]:
+            if self.dry_run:
+                raise CommandError(
+                    "--schema-snapshot needs to write the squashed migrations, it cannot be used with --dry-run."
+                )
+            bad_aliases = [alias for alias in kwargs["schema_snapshot"] if alias not in connections]
+            if bad_aliases:
+                raise CommandError("The following databases are not valid: %s" % ", ".join(bad_aliases))
+
+        if kwargs["keep_last"] < 0:
+            raise CommandError("--keep-last cannot be negative.")
+        partial = kwargs["keep_last"] or kwargs["upto"]
+        if partial and kwargs["fingerprint_file"]:
+            raise CommandError("--keep-last and --upto cannot be used with an incremental squash (--fingerprint-file).")
+        if kwargs["delta"]:
+            if partial:
+                raise CommandError("--delta cannot be used with --keep-last or --upto.")
+            if kwargs["fingerprint_file"]:
+                raise CommandError("--delta cannot be used with an incremental squash (--fingerprint-file).")
+            if kwargs["schema_snapshot"]:
+                raise CommandError("--schema-snapshot only applies to a full squash, it cannot be used with --delta.")
+
         questioner = NonInteractiveMigrationQuestioner(specified_apps=None, dry_run=False)
 
-        loader = MigrationLoader(None, ignore_no_migrations=True)
-        squash_loader = SquashMigrationLoader(None, ignore_no_migrations=True)
+        # Scans the disk once, builds both the real and the squash graphs
+        with self.timer("loader"):
+            loader = SquashMigrationLoader(None, ignore_no_migrations=True)
+
+        if kwargs["elidable_candidates"]:
+            self.write_elidable_candidates(
+                loader,
+                sorted(app for app in loader.project_apps() & loader.migrated_apps if app not in ignore_apps),
+            )
+            return
+        with self.timer("ProjectState.from_apps"):
+            to_state = ProjectState.from_apps(apps)
+
+        kept = set()
+        if partial:
+            with self.timer("partial_state"):
+                kept, to_state = self.partial_squash(loader, to_state, ignore_apps, kwargs["keep_last"], kwargs["upto"])
+        elif kwargs["delta"]:
+            from django_squash.db.migrations.questioner import DeltaMigrationQuestioner
+
+            with self.timer("delta_state"):
+                app_labels = {app for app in loader.project_apps() & loader.migrated_apps if app not in ignore_apps}
+                kept = loader.delta_base(app_labels)
+                # The squashed migrations start from the state of the previous ones
+                loader.build_squash_graph(kept)
+                questioner = DeltaMigrationQuestioner(
+                    [loader.disk_migrations[key] for key in loader.plan() if key[0] in app_labels and key not in kept],
+                    specified_apps=None,
+                    dry_run=False,
+                )
+
+        fingerprints = None
+        if kwargs["fingerprint_file"]:
+            fingerprints = FingerprintCache(kwargs["fingerprint_file"])
+            fingerprint_apps = sorted(
+                app_label
+                for app_label in loader.project_apps() & loader.migrated_apps
+                if app_label not in ignore_apps
+            )
+            with self.timer("fingerprints"):
+                unchanged_apps = fingerprints.unchanged_apps(loader, to_state, fingerprint_apps)
+            if unchanged_apps and self.verbosity >= 1:
+                self.stdout.write("Skipping unchanged apps: %s\n" % ", ".join(unchanged_apps))
+            ignore_apps.extend(unchanged_apps)
 
         # Set up autodetector
         autodetector = SquashMigrationAutodetector(
-            squash_loader.project_state(),
-            ProjectState.from_apps(apps),
+            loader.squash_project_state(),
+            to_state,
             questioner,
         )
 
         squashed_changes = autodetector.squash(
-            real_loader=loader,
-            squash_loader=squash_loader,
+            loader=loader,
             ignore_apps=ignore_apps,
             migration_name=kwargs["squashed_name"],
+            jobs=kwargs["jobs"],
+            timer=self.timer,
+            merge_sql=kwargs["merge_sql"],
+            kept=kept,
+            delta=kwargs["delta"],
         )
 
         replacing_migrations = 0
@@ -100,20 +268,156 @@ class Command(BaseCommand):
         if not replacing_migrations:
             raise CommandError("There are no migrations to squash.")
 
-        self.write_migration_files(squashed_changes)
+        if kwargs["schema_snapshot"]:
+            from django_squash.db.migrations.snapshot import add_schema_snapshots
 
-    @serializer.patch_serializer_registry
-    def write_migration_files(self, changes):
+            with self.timer("schema_snapshot"):
+                add_schema_snapshots(
+                    loader.squash_project_state(),
+                    [
+                        migration
+                        for migration in itertools.chain.from_iterable(squashed_changes.values())
+                        if not migration.is_migration_level and migration.operations
+                    ],
+                    kwargs["schema_snapshot"],
+                )
+
+        if kwargs["report"]:
+            with self.timer("report"):
+                # Both measurements import the migrations from scratch, otherwise only the "after" pays for it
+                report.forget_migration_modules()
+                before = report.measure_graph()
+
+        with self.timer("write_migration_files"):
+            self.write_migration_files(squashed_changes, jobs=kwargs["jobs"])
+
+        if kwargs["report"]:
+            with self.timer("report"):
+                report.forget_migration_modules()
+                after = report.measure_graph()
+            self.write_report(before, after)
+
+        if fingerprints is not None and not self.dry_run:
+            fingerprints.update(loader, to_state, fingerprint_apps)
+            fingerprints.save()
+
+    def partial_squash(self, loader, to_state, ignore_apps, keep_last, upto):
+        """
+        Return the migrations left out of the squash and the state the squashed migrations lead to.
+
+        The apps with every migration left out are added to `ignore_apps`.
+        """
+        upto_migrations = {}
+        bad_migrations = []
+        for name in upto:
+            app_label, _, migration_name = name.partition(".")
+            if (app_label, migration_name) not in loader.graph.nodes:
+                bad_migrations.append(name)
+            elif app_label in ignore_apps:
+                raise CommandError("The following app cannot be ignored and squashed up to a migration: %s" % app_label)
+            else:
+                upto_migrations[app_label] = (app_label, migration_name)
+        if bad_migrations:
+            raise CommandError("The following migrations are not valid: %s" % ", ".join(bad_migrations))
+
+        app_labels = sorted(app for app in loader.project_apps() & loader.migrated_apps if app not in ignore_apps)
+        kept = loader.kept_migrations(app_labels, keep_last, upto_migrations)
+
+        kept_apps = [
+            app_label
+            for app_label in app_labels
+            if all(key in kept for key in loader.graph.nodes if key[0] == app_label)
+        ]
+        if kept_apps and self.verbosity >= 1:
+            self.stdout.write("Keeping every migration of: %s\n" % ", ".join(kept_apps))
+        ignore_apps.extend(kept_apps)
+
+        return kept, loader.partial_state(to_state, kept, app_labels)
+
+    def write_elidable_candidates(self, loader, app_labels):
+        from django_squash.db.migrations import elidable
+
+        with self.timer("elidable_candidates"):
+            candidates = elidable.find_candidates(loader, app_labels)
+            cost = elidable.operation_cost(loader.project_state()) if candidates else 0
+
+        if not candidates:
+            self.stdout.write("No elidable candidates found.\n")
+            return
+
+        self.stdout.write(self.style.MIGRATE_HEADING("Elidable candidates:") + "\n")
+        for app_label, app_candidates in sorted(candidates.items()):
+            self.stdout.write(
+                "  %s: %i operations, ~%.3fs per migrate\n"
+                % (self.style.MIGRATE_LABEL(app_label), len(app_candidates), len(app_candidates) * cost)
+            )
+            for candidate in app_candidates:
+                self.stdout.write("    %s: %s (%s)\n" % (candidate.migration.name, candidate.name, candidate.writes))
+        total = sum(len(app_candidates) for app_candidates in candidates.values())
+        self.stdout.write(
+            "Total: %i operations, ~%.3fs per migrate (~%.4fs per operation, the state copy migrate makes)\n"
+            % (total, total * cost, cost)
+        )
+
+    def write_report(self, before, after):
+        self.stdout.write(self.style.MIGRATE_HEADING("Report (current -> squashed):") + "\n")
+        row = "  %-30s %16s %16s %22s\n"
+        self.stdout.write(row % ("App", "Migrations", "Operations", "Migrate (s)"))
+        app_labels = sorted(before.migrations.keys() | after.migrations.keys())
+        for app_label in app_labels:
+            self.stdout.write(
+                row
+                % (
+                    app_label,
+                    "%i -> %i" % (before.migrations[app_label], after.migrations[app_label]),
+                    "%i -> %i" % (before.operations[app_label], after.operations[app_label]),
+                    "%.3f -> %.3f" % (before.migrate_time[app_label], after.migrate_time[app_label]),
+                )
+            )
+        self.stdout.write(
+            row
+            % (
+                "Total",
+                "%i -> %i" % (sum(before.migrations.values()), sum(after.migrations.values())),
+                "%i -> %i" % (sum(before.operations.values()), sum(after.operations.values())),
+                "%.3f -> %.3f" % (before.total_migrate_time, after.total_migrate_time),
+            )
+        )
+        self.stdout.write("  MigrationLoader build time: %.3fs -> %.3fs\n" % (before.loader_time, after.loader_time))
+
+    def write_profile(self):
+        self.stdout.write(self.style.MIGRATE_HEADING("Profile:") + "\n")
+        self.stdout.write("  %-45s %10s %10s\n" % ("Phase", "Wall (s)", "CPU (s)"))
+        total_wall = total_cpu = 0
+        for name, wall, cpu in self.timer.phases:
+            total_wall += wall
+            total_cpu += cpu
+            self.stdout.write("  %-45s %10.3f %10.3f\n" % (name, wall, cpu))
+        self.stdout.write("  %-45s %10.3f %10.3f\n" % ("Total", total_wall, total_cpu))
+
+    def write_migration_files(self, changes, jobs=1):
         """
         Take a changes dict and write them out as migration files.
+
+        Every file is rendered before anything is written, then written to a temporary file and moved into place, an
+        interrupted run leaves the migrations untouched.
         """
-        directory_created = {}
+        from django_squash.db.migrations import serializer
+
+        serializer.patch_serializer_registry(self._write_migration_files)(changes, jobs)
+
+    def _write_migration_files(self, changes, jobs):
+        from django_squash.db.migrations import utils
+        from django_squash.db.migrations.writer import MigrationWriter
+
+        writers = []
         for app_label, app_migrations in changes.items():
             if self.verbosity >= 1:
                 self.stdout.write(self.style.MIGRATE_HEADING("Migrations for '%s':" % app_label) + "\n")
             for migration in app_migrations:
                 # Describe the migration
                 writer = MigrationWriter(migration, self.include_header)
+                writers.append(writer)
                 if self.verbosity >= 1:
                     # Display a relative path if it's below the current working
                     # directory, or an absolute path otherwise.
@@ -130,27 +434,73 @@ class Command(BaseCommand):
                     else:
                         for operation in migration.operations:
                             self.stdout.write("    - %s\n" % operation.describe())
-                if not self.dry_run:
-                    # Write the migrations file to the disk.
-                    migrations_directory = os.path.dirname(writer.path)
-                    if not directory_created.get(app_label):
-                        os.makedirs(migrations_directory, exist_ok=True)
-                        init_path = os.path.join(migrations_directory, "__init__.py")
-                        if not os.path.isfile(init_path):
-                            open(init_path, "w").close()
-                        # We just do this once per app
-                        directory_created[app_label] = True
-                    migration_string = writer.as_string()
+
+        if self.dry_run:
+            if self.verbosity == 3:
+                # Alternatively, makemigrations --dry-run --verbosity 3
+                # will output the migrations to stdout rather than saving
+                # the file to the disk.
+                for writer, migration_string in zip(writers, render_migrations(writers, jobs)):
                     if migration_string is None:
-                        # File was deleted
                         continue
-                    with open(writer.path, "w", encoding="utf-8") as fh:
-                        fh.write(migration_string)
-                elif self.verbosity == 3:
-                    # Alternatively, makemigrations --dry-run --verbosity 3
-                    # will output the migrations to stdout rather than saving
-                    # the file to the disk.
                     self.stdout.write(
                         self.style.MIGRATE_HEADING("Full migrations file '%s':" % writer.filename) + "\n"
                     )
-                    self.stdout.write("%s\n" % writer.as_string())
+                    self.stdout.write("%s\n" % migration_string)
+            return
+
+        migration_strings = render_migrations(writers, jobs)
+
+        files = []
+        deleted_files = []
+        for writer, migration_string in zip(writers, migration_strings):
+            if getattr(writer.migration, "_deleted", False):
+                deleted_files.append(writer.path)
+            elif migration_string is None:
+                # Not a migration its attributes can be replaced in (no top level "class Migration"), left as it is
+                continue
+            else:
+                files.append((writer.path, migration_string))
+
+        directories = {os.path.dirname(path) for path, _ in files}
+        for migrations_directory in sorted(directories):
+            os.makedirs(migrations_directory, exist_ok=True)
+            init_path = os.path.join(migrations_directory, "__init__.py")
+            if not os.path.isfile(init_path):
+                open(init_path, "w").close()
+
+        utils.replace_files(files, deleted_files)
+
+
+_WRITERS = None
+
+
+def _init_writer_worker(writers):
+    global _WRITERS
+    _WRITERS = writers
+
+
+def _render_migration(index):
+    return _WRITERS[index].as_string()
+
+
+def render_migrations(writers, jobs):
+    """
+    Return the contents of every migration file, rendered in a pool of processes when `jobs` > 1.
+
+    Workers are forked so they inherit the migrations as they are, where forking is not available they are rendered
+    one after the other.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    if jobs <= 1 or len(writers) <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+        return [writer.as_string() for writer in writers]
+
+    with ProcessPoolExecutor(
+        max_workers=min(jobs, len(writers)),
+        mp_context=multiprocessing.get_context("fork"),
+        initializer=_init_writer_worker,
+        initargs=(writers,),
+    ) as executor:
+        return list(executor.map(_render_migration, range(len(writers))))
@@ -10,3 +10,9 @@ DJANGO_SQUASH_MIGRATION_NAME = lazy(
 DJANGO_SQUASH_CUSTOM_RENAME_FUNCTION = lazy(
     lambda: getattr(global_settings, "DJANGO_SQUASH_CUSTOM_RENAME_FUNCTION", None) or "", str
 )()
+DJANGO_SQUASH_FINGERPRINT_FILE = lazy(
+    lambda: getattr(global_settings, "DJANGO_SQUASH_FINGERPRINT_FILE", None) or "", str
+)()
+DJANGO_SQUASH_TEMPLATE_DATABASE_DIR = lazy(
+    lambda: getattr(global_settings, "DJANGO_SQUASH_TEMPLATE_DATABASE_DIR", None) or "", str
+)()
@@ -0,0 +1,29 @@
+"""
+pytest-django plugin creating the test databases out of templates.
+
+Enable it with ``-p django_squash.test.pytest_plugin`` or ``pytest_plugins = ["django_squash.test.pytest_plugin"]``.
+"""
+
+from __future__ import annotations
+
+from django.conf import settings
+import pytest
+
+from django_squash import settings as app_settings
+from django_squash.test.template import template_databases
+
+
+@pytest.fixture(scope="session", autouse=True)
+def django_squash_template_databases(request):
+    """Keep the template databases active for the whole session, `django_db_setup` may be requested by any test."""
+    if not settings.configured:
+        yield
+        return
+
+    directory = str(app_settings.DJANGO_SQUASH_TEMPLATE_DATABASE_DIR)
+    cache = getattr(request.config, "cache", None)
+    if not directory and cache is not None:
+        directory = str(cache.mkdir("django_squash"))
+
+    with template_databases(directory=directory):
+        yield
@@ -0,0 +1,29 @@
+"""Django test runner creating the test databases out of templates."""
+
+from __future__ import annotations
+
+from django.test.runner import DiscoverRunner
+
+from django_squash.test.template import template_databases
+
+
+class TemplateDatabaseMixin:
+    """
+    Test runner mixin: the test databases are cloned from a template when the migrations did not change.
+
+    The template is created (and `migrate` run) the first time the migrations are seen.
+    """
+
+    def setup_databases(self, **kwargs):
+        """Create the test databases out of the templates."""
+        with template_databases():
+            return super().setup_databases(**kwargs)
+
+    def teardown_databases(self, old_config, **kwargs):
+        """Destroy the test databases and the templates left over by previous migrations."""
+        with template_databases():
+            super().teardown_databases(old_config, **kwargs)
+
+
+class TemplateDatabaseRunner(TemplateDatabaseMixin, DiscoverRunner):
+    """`DiscoverRunner` with `TemplateDatabaseMixin`, to be used as the `TEST_RUNNER` setting."""
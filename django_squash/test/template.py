@@ -0,0 +1,253 @@
+"""Test databases created out of template databases, kept as long as the migrations don't change."""
+
+from __future__ import annotations
+
+import contextlib
+import functools
+import hashlib
+import importlib.util
+import inspect
+import os
+from pathlib import Path
+import re
+import sqlite3
+import tempfile
+
+import django
+from django.apps import apps
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.db.migrations.loader import MigrationLoader
+
+from django_squash import settings as app_settings
+from django_squash.db.migrations import utils
+
+
+def template_directory():
+    """
+    Return the directory where the SQLite templates are kept.
+
+    The default one is in the temporary directory shared by every project on the machine, each project (directory and
+    settings module) gets its own subdirectory so they don't replace each other's templates.
+    """
+    if app_settings.DJANGO_SQUASH_TEMPLATE_DATABASE_DIR:
+        return str(app_settings.DJANGO_SQUASH_TEMPLATE_DATABASE_DIR)
+    project = f"{Path.cwd().resolve()}:{settings.SETTINGS_MODULE}"
+    return str(
+        Path(tempfile.gettempdir()) / "django_squash_templates" / hashlib.sha256(project.encode()).hexdigest()[:16]
+    )
+
+
+def migrations_hash(connection):
+    """
+    Hash everything `migrate` builds the test database from.
+
+    That is the migration files of every app and the models of the apps without migrations.
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{django.__version__}:{connection.vendor}".encode())
+
+    for app_config in sorted(apps.get_app_configs(), key=lambda app_config: app_config.label):
+        digest.update(app_config.label.encode())
+        paths = []
+        module_name, _ = MigrationLoader.migrations_module(app_config.label)
+        try:
+            spec = importlib.util.find_spec(module_name) if module_name else None
+        except ImportError:
+            spec = None
+        for directory in getattr(spec, "submodule_search_locations", None) or []:
+            paths.extend(sorted(Path(directory).glob("*.py")))
+        if not paths and app_config.models_module is not None:
+            # Synced from the models (run_syncdb)
+            paths.append(Path(app_config.models_module.__file__))
+
+        for path in paths:
+            digest.update(path.name.encode())
+            digest.update(utils.file_hash(str(path)).encode())
+
+    return digest.hexdigest()
+
+
+class SQLiteTemplate:
+    """The template is a file in `directory`, copied into the test database with the SQLite backup API."""
+
+    def __init__(self, connection, key, directory):
+        """Template of `connection` for the migrations hashed to `key`."""
+        self.connection = connection
+        self.directory = Path(directory)
+        self.path = self.directory / f"{connection.alias}-{key[:16]}.sqlite3"
+
+    def exists(self):
+        """Whether the template was saved already."""
+        return self.path.is_file()
+
+    def test_database_exists(self):
+        """Whether the test database is already there, from a previous run with `keepdb`."""
+        creation = self.connection.creation
+        test_database_name = creation._get_test_db_name()  # noqa: SLF001
+        return not creation.is_in_memory_db(test_database_name) and Path(test_database_name).is_file()
+
+    @contextlib.contextmanager
+    def restore(self):
+        """Copy the template into the test database created while the context is active."""
+        creation = self.connection.creation
+        create_test_db = creation._create_test_db  # noqa: SLF001
+
+        def _create_test_db(*args, **kwargs):
+            test_database_name = create_test_db(*args, **kwargs)
+            self.connection.close()
+            self.connection.settings_dict["NAME"] = test_database_name
+            self.connection.ensure_connection()
+            with contextlib.closing(sqlite3.connect(self.path)) as source:
+                source.backup(self.connection.connection)
+            return test_database_name
+
+        # The template is copied right after the test database is created, `migrate` then finds nothing to apply
+        creation._create_test_db = _create_test_db  # noqa: SLF001
+        try:
+            yield
+        finally:
+            del creation._create_test_db  # noqa: SLF001
+
+    def save(self):
+        """Save the test database as the template, replacing the templates of previous migrations."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.connection.ensure_connection()
+        temporary_path = self.path.with_name(f"{self.path.name}.{os.getpid()}")
+        with contextlib.closing(sqlite3.connect(temporary_path)) as target:
+            self.connection.connection.backup(target)
+        # Other processes may be reading the previous templates, they keep their file open
+        pattern = re.compile(rf"{re.escape(self.connection.alias)}-[0-9a-f]{{16}}\.sqlite3")
+        for path in self.directory.iterdir():
+            if pattern.fullmatch(path.name):
+                path.unlink()
+        temporary_path.replace(self.path)
+
+    def drop_stale(self):
+        """Nothing to do, `save()` already removed the templates of previous migrations."""
+
+
+class PostgreSQLTemplate:
+    """A database on the same server, test databases are created out of it with `CREATE DATABASE ... TEMPLATE`."""
+
+    def __init__(self, connection, key):
+        """Template of `connection` for the migrations hashed to `key`."""
+        self.connection = connection
+        test_database_name = connection.creation._get_test_db_name()  # noqa: SLF001
+        # Database names are limited to 63 characters
+        self.prefix = f"{test_database_name[:42]}_tpl_"
+        self.name = f"{self.prefix}{key[:16]}"
+
+    def database_exists(self, name):
+        """Whether the database `name` is on the server."""
+        creation = self.connection.creation
+        with creation._nodb_cursor() as cursor:  # noqa: SLF001
+            return creation._database_exists(cursor, name)  # noqa: SLF001
+
+    def exists(self):
+        """Whether the template was saved already."""
+        return self.database_exists(self.name)
+
+    def test_database_exists(self):
+        """Whether the test database is already there, from a previous run with `keepdb`."""
+        return self.database_exists(self.connection.creation._get_test_db_name())  # noqa: SLF001
+
+    @contextlib.contextmanager
+    def restore(self):
+        """Create the test database out of the template while the context is active."""
+        test_settings = self.connection.settings_dict["TEST"]
+        template = test_settings.get("TEMPLATE")
+        test_settings["TEMPLATE"] = self.name
+        try:
+            yield
+        finally:
+            test_settings["TEMPLATE"] = template
+
+    def save(self):
+        """Save the test database as the template."""
+        # CREATE DATABASE ... TEMPLATE needs every connection to the test database closed
+        self.connection.close()
+        if hasattr(self.connection, "close_pool"):
+            self.connection.close_pool()
+        quote_name = self.connection.ops.quote_name
+        with self.connection.creation._nodb_cursor() as cursor, contextlib.suppress(DatabaseError):  # noqa: SLF001
+            # Another process may have created it first
+            source_name = self.connection.settings_dict["NAME"]
+            cursor.execute(f"CREATE DATABASE {quote_name(self.name)} WITH TEMPLATE {quote_name(source_name)}")
+        self.connection.ensure_connection()
+
+    def drop_stale(self):
+        """Drop the templates of previous migrations, the current one is what the next run is created from."""
+        quote_name = self.connection.ops.quote_name
+        with self.connection.creation._nodb_cursor() as cursor:  # noqa: SLF001
+            cursor.execute(
+                "SELECT datname FROM pg_catalog.pg_database WHERE starts_with(datname, %s) AND datname <> %s",
+                [self.prefix, self.name],
+            )
+            for (name,) in cursor.fetchall():
+                # Another process may still be creating its test database out of it
+                with contextlib.suppress(DatabaseError):
+                    cursor.execute(f"DROP DATABASE IF EXISTS {quote_name(name)}")
+
+
+def get_template(connection, directory):
+    """Return the template of `connection`'s test database, None when the backend has no template support."""
+    if connection.settings_dict["TEST"].get("MIGRATE") is False:
+        return None
+    if connection.vendor == "sqlite":
+        return SQLiteTemplate(connection, migrations_hash(connection), directory)
+    if connection.vendor == "postgresql":
+        return PostgreSQLTemplate(connection, migrations_hash(connection))
+    return None
+
+
+def create_test_db(connection, create_test_db, directory, *args, **kwargs):
+    """
+    Create the test database out of the template matching the current migrations.
+
+    Without a template, the test database is created (running `migrate`) and saved as the template. A test database
+    kept by `keepdb` is left as it is, `migrate` only applies what it is missing.
+    """
+    keepdb = inspect.signature(create_test_db).bind(*args, **kwargs).arguments.get("keepdb", False)
+    template = get_template(connection, directory)
+    if template is None or (keepdb and template.test_database_exists()):
+        return create_test_db(*args, **kwargs)
+
+    if template.exists():
+        with template.restore():
+            return create_test_db(*args, **kwargs)
+
+    test_database_name = create_test_db(*args, **kwargs)
+    template.save()
+    return test_database_name
+
+
+def destroy_test_db(connection, destroy_test_db, directory, *args, **kwargs):
+    """Destroy the test database, and the templates left over by previous migrations."""
+    suffix = inspect.signature(destroy_test_db).bind(*args, **kwargs).arguments.get("suffix")
+    destroy_test_db(*args, **kwargs)
+    # Clones of the test database (parallel test runs) have no template of their own
+    if suffix is None:
+        template = get_template(connection, directory)
+        if template is not None:
+            template.drop_stale()
+
+
+@contextlib.contextmanager
+def template_databases(aliases=None, directory=None):
+    """Create (and destroy) the test databases of `aliases`, every database by default, while the context is active."""
+    directory = directory or template_directory()
+    creations = [connections[alias].creation for alias in (aliases or connections)]
+    for creation in creations:
+        creation.create_test_db = functools.partial(
+            create_test_db, creation.connection, creation.create_test_db, directory
+        )
+        creation.destroy_test_db = functools.partial(
+            destroy_test_db, creation.connection, creation.destroy_test_db, directory
+        )
+    try:
+        yield
+    finally:
+        for creation in creations:
+            del creation.create_test_db
+            del creation.destroy_test_db
@@ -0,0 +1,53 @@
+from django.db import migrations, models
+
+
+def update_ages(apps, schema_editor):
+    Person = apps.get_model("app", "Person")
+    Person.objects.using(schema_editor.connection.alias).filter(age=0).update(age=models.F("age") + 1)
+
+
+def rename_people(apps, schema_editor):
+    Person = apps.get_model("app", "Person")
+    people = []
+    for person in Person.objects.filter(name="").iterator():
+        person.name = "unknown"
+        people.append(person)
+    Person.objects.bulk_update(people, ["name"])
+
+
+def save_people(apps, schema_editor):
+    Person = apps.get_model("app", "Person")
+    for person in Person.objects.all():
+        person.age = len(person.name)
+        person.save(update_fields=["age"])
+
+
+def create_admin(apps, schema_editor):
+    Person = apps.get_model("app", "Person")
+    Person.objects.create(name="admin")
+
+
+def raw_sql(apps, schema_editor):
+    schema_editor.execute("UPDATE app_person SET age = 1")
+
+
+def do_nothing(apps, schema_editor):
+    """Nothing to do"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.RunPython(update_ages, migrations.RunPython.noop),
+        migrations.RunPython(rename_people),
+        migrations.RunPython(save_people),
+        migrations.RunPython(create_admin),
+        migrations.RunPython(raw_sql),
+        migrations.RunPython(do_nothing),
+        migrations.RunPython(migrations.RunPython.noop),
+        migrations.RunPython(update_ages, elidable=True),
+    ]
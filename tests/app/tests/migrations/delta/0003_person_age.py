@@ -0,0 +1,17 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0002_squashed"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="person",
+            name="age",
+            field=models.IntegerField(default=18),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0003_person_age"),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name="person",
+            old_name="name",
+            new_name="full_name",
+        ),
+    ]
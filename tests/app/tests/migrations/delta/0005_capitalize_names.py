@@ -0,0 +1,19 @@
+from django.db import migrations
+
+
+def capitalize_names(apps, schema_editor):
+    Person = apps.get_model("app", "Person")
+    for person in Person.objects.all():
+        person.full_name = person.full_name.capitalize()
+        person.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0004_rename_name_person_full_name"),
+    ]
+
+    operations = [
+        migrations.RunPython(capitalize_names, migrations.RunPython.noop),
+    ]
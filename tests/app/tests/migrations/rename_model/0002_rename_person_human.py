@@ -0,0 +1,16 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0001_initial"),
+        ("app2", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.RenameModel(
+            old_name="Person",
+            new_name="Human",
+        ),
+    ]
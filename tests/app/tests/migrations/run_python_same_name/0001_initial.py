@@ -0,0 +1,22 @@
+from django.db import migrations
+
+
+def same_name(apps, schema_editor):
+    # first body
+    return 1
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = []
+
+    def other_name(apps, schema_editor):
+        # same body, another name
+        return 1
+
+    operations = [
+        migrations.RunPython(same_name),
+        migrations.RunPython(other_name),
+    ]
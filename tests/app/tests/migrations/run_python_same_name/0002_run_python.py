@@ -0,0 +1,17 @@
+from django.db import migrations
+
+
+def same_name(apps, schema_editor):
+    # second body
+    return 2
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.RunPython(same_name, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+from django.db import migrations
+
+
+def forwards(apps, schema_editor):
+    # helper copied into every migration
+    return
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.RunSQL("select 1", "select 2"),
+        migrations.RunPython(forwards, migrations.RunPython.noop),
+    ]
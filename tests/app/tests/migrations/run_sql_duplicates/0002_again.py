@@ -0,0 +1,18 @@
+from django.db import migrations
+
+
+def forwards(apps, schema_editor):
+    return
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.RunSQL("select 1", "select 3"),
+        migrations.RunSQL("select 2"),
+        migrations.RunPython(forwards, migrations.RunPython.noop),
+    ]
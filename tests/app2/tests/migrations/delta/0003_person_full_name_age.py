@@ -0,0 +1,27 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app2", "0002_squashed"),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name="person",
+            name="name",
+        ),
+        migrations.AddField(
+            model_name="person",
+            name="full_name",
+            field=models.CharField(default="", max_length=10),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="person",
+            name="age",
+            field=models.IntegerField(default=30),
+            preserve_default=False,
+        ),
+    ]
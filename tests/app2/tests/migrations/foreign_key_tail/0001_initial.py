@@ -0,0 +1,39 @@
+# Generated by Django 2.0 on 2019-05-18 15:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ("app", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Address",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "person",
+                    models.ForeignKey(on_delete=models.deletion.CASCADE, to="app.Person"),
+                ),
+                ("address1", models.CharField(max_length=100)),
+                ("address2", models.CharField(max_length=100)),
+                ("city", models.CharField(max_length=50)),
+                ("postal_code", models.CharField(max_length=50)),
+                ("province", models.CharField(max_length=50)),
+                ("country", models.CharField(max_length=50)),
+            ],
+        ),
+    ]
@@ -0,0 +1,17 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app2", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="address",
+            name="notes",
+            field=models.TextField(default=""),
+            preserve_default=False,
+        ),
+    ]
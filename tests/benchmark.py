@@ -0,0 +1,222 @@
+"""
+Synthetic large-project generator used to benchmark the squash pipeline.
+
+The generated project is a plain django project on disk (settings + N apps, each with its models and M migrations),
+the benchmarks run it in a subprocess so every measurement starts from a cold process.
+"""
+
+from __future__ import annotations
+
+import dataclasses
+import json
+import os
+from pathlib import Path
+import random
+import subprocess
+import sys
+import textwrap
+
+SETTINGS_TEMPLATE = """\
+SECRET_KEY = "benchmark"
+DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+USE_TZ = True
+INSTALLED_APPS = [
+    "django.contrib.auth",
+    "django.contrib.contenttypes",
+    "django_squash",
+%(apps)s
+]
+DATABASES = {
+    "default": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": ":memory:",
+    },
+}
+"""
+
+RUNNER = """\
+import json
+import resource
+import sys
+import time
+
+import django
+
+django.setup()
+
+from django.core.management import call_command
+
+start = time.perf_counter()
+call_command("squash_migrations", *sys.argv[1:], verbosity=0, no_color=True)
+wall = time.perf_counter() - start
+
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+if sys.platform == "darwin":
+    peak //= 1024
+print(json.dumps({"wall": wall, "peak_memory_kb": peak}))
+"""
+
+
+@dataclasses.dataclass(frozen=True)
+class ProjectSize:
+    """Shape of the synthetic project."""
+
+    apps: int
+    migrations: int
+    models: int
+    # Share of the migrations that carry a non-elidable RunPython or RunSQL operation
+    special_ratio: float = 0.2
+    cross_app_fks: bool = True
+    swappable: bool = True
+    seed: int = 0
+
+    def __str__(self):
+        """Used as the test id."""
+        return f"{self.apps}apps-{self.migrations}migrations-{self.models}models"
+
+
+def app_label(index):
+    return f"bench_app_{index:03}"
+
+
+def generate_project(root, size):
+    """Write a synthetic django project into `root`. Returns the list of generated app labels."""
+    root = Path(root)
+    rnd = random.Random(size.seed)
+    labels = [app_label(i) for i in range(size.apps)]
+
+    with (root / "bench_settings.py").open("w") as f:
+        f.write(SETTINGS_TEMPLATE % {"apps": "\n".join(f'    "{label}",' for label in labels)})
+    with (root / "bench_runner.py").open("w") as f:
+        f.write(RUNNER)
+
+    for index, label in enumerate(labels):
+        # Fields added by each migration, per model
+        added_fields = {model: [] for model in range(size.models)}
+        migrations = []
+        for number in range(1, size.migrations + 1):
+            name = f"{number:04}_initial" if number == 1 else f"{number:04}_step_{number}"
+            operations = []
+            imports = {"from django.db import migrations, models"}
+            dependencies = [f'("{label}", "{migrations[-1][0]}")'] if migrations else []
+            functions = []
+
+            if number == 1:
+                for model in range(size.models):
+                    fields = [
+                        (
+                            '("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, '
+                            'verbose_name="ID"))'
+                        ),
+                        '("name", models.CharField(max_length=100))',
+                    ]
+                    if model == 0 and size.cross_app_fks and index > 0:
+                        parent = labels[index - 1]
+                        fields.append(f'("parent", models.ForeignKey(on_delete=models.CASCADE, to="{parent}.model0"))')
+                        dependencies.append(f'("{parent}", "0001_initial")')
+                    if model == 1 and size.swappable:
+                        fields.append(
+                            '("owner", models.ForeignKey(on_delete=models.CASCADE, to=settings.AUTH_USER_MODEL))'
+                        )
+                        imports.add("from django.conf import settings")
+                        dependencies.append("migrations.swappable_dependency(settings.AUTH_USER_MODEL)")
+                    operations.append(f'migrations.CreateModel(name="Model{model}", fields=[{", ".join(fields)}])')
+            else:
+                model = number % size.models
+                field_name = f"field_{number}"
+                added_fields[model].append(field_name)
+                operations.append(
+                    f'migrations.AddField(model_name="model{model}", name="{field_name}", '
+                    "field=models.IntegerField(default=0))"
+                )
+
+            if number > 1 and rnd.random() < size.special_ratio:
+                if rnd.random() < 0.5:
+                    function_name = f"forwards_{number}"
+                    functions.append(
+                        textwrap.dedent(
+                            f"""\
+                            def {function_name}(apps, schema_editor):
+                                Model = apps.get_model("{label}", "Model{number % size.models}")
+                                Model.objects.update(field_{number}=1)
+                            """
+                        )
+                    )
+                    operations.append(f"migrations.RunPython({function_name}, migrations.RunPython.noop)")
+                else:
+                    operations.append(f'migrations.RunSQL("SELECT {number}", migrations.RunSQL.noop)')
+
+            migrations.append((name, imports, dependencies, functions, operations))
+
+        write_app(root, label, index, labels, size, added_fields, migrations)
+
+    return labels
+
+
+def write_app(root, label, index, labels, size, added_fields, migrations):
+    app_dir = root / label
+    migrations_dir = app_dir / "migrations"
+    migrations_dir.mkdir(parents=True)
+    (app_dir / "__init__.py").touch()
+    (migrations_dir / "__init__.py").touch()
+
+    models_source = ["from django.conf import settings", "from django.db import models", ""]
+    for model in range(size.models):
+        models_source.append("")
+        models_source.append(f"class Model{model}(models.Model):")
+        models_source.append("    name = models.CharField(max_length=100)")
+        if model == 0 and size.cross_app_fks and index > 0:
+            models_source.append(
+                f'    parent = models.ForeignKey("{labels[index - 1]}.Model0", on_delete=models.CASCADE)'
+            )
+        if model == 1 and size.swappable:
+            models_source.append("    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)")
+        models_source.extend(f"    {field} = models.IntegerField(default=0)" for field in added_fields[model])
+        models_source.append("")
+    (app_dir / "models.py").write_text("\n".join(models_source))
+
+    for name, imports, dependencies, functions, operations in migrations:
+        source = "\n".join(sorted(imports)) + "\n\n\n"
+        source += "\n\n".join(functions) + ("\n\n" if functions else "")
+        source += "class Migration(migrations.Migration):\n"
+        source += f"    dependencies = [{', '.join(dependencies)}]\n"
+        source += "    operations = [\n"
+        source += "".join(f"        {operation},\n" for operation in operations)
+        source += "    ]\n"
+        (migrations_dir / f"{name}.py").write_text(source)
+
+
+def run_squash(root, *args):
+    """Run `squash_migrations` in the generated project in a fresh process, returns the wall time and peak memory."""
+    env = {
+        **os.environ,
+        "DJANGO_SETTINGS_MODULE": "bench_settings",
+        "PYTHONPATH": os.pathsep.join([str(root), os.environ.get("PYTHONPATH", "")]),
+    }
+    result = subprocess.run(
+        [sys.executable, "bench_runner.py", *args],
+        cwd=root,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def import_times(*modules):
+    """Import `modules` in a fresh process, returns the import time (seconds) of each django_squash module."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "; ".join(f"import {module}" for module in modules)],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        _, _, columns = line.partition("import time:")
+        _, cumulative, name = (column.strip() for column in columns.split("|"))
+        if name.startswith("django_squash"):
+            times[name] = int(cumulative) / 1_000_000
+    return times
@@ -18,6 +18,8 @@ import pytest
 from django_squash.db.migrations.utils import get_custom_rename_function
 from tests import utils
 
+pytest_plugins = ["pytester"]
+
 
 class MigrationPath(Path):
     """A subclass of Path that provides a method to list migration files."""
@@ -88,6 +90,10 @@ def _migration_app_dir(marker_name, request, settings):
     yield MigrationPath(target_module_path)
 
 
+def pytest_addoption(parser):
+    parser.addoption("--benchmark", action="store_true", default=False, help="Run the benchmarks.")
+
+
 def pytest_collection_modifyitems(config, items):
     """
     Prevents issues from being ignored.
@@ -95,13 +101,15 @@ def pytest_collection_modifyitems(config, items):
     Meta test to ensure we define `@pytest.mark.temporary_migration_module` and use `migration_app_dir` in the
     function arguments/signature.
     """
-    del config
+    run_benchmarks = config.getoption("--benchmark")
     required_function_argument_by_markers = {
         "temporary_migration_module": "migration_app_dir",
         "temporary_migration_module2": "migration_app2_dir",
     }
     for test_function in items:
         markers = {m.name: m for m in test_function.iter_markers()}
+        if "benchmark" in markers and not run_benchmarks:
+            test_function.add_marker(pytest.mark.skip(reason="Benchmarks only run with --benchmark"))
         markers_found = required_function_argument_by_markers.keys() & markers.keys()
         if not markers_found:
             continue
@@ -0,0 +1,53 @@
+"""
+Benchmarks of the squash pipeline over synthetic projects of increasing size.
+
+Only run with ``pytest --benchmark``, the numbers are printed (``-s``) so complexity regressions in the autodetector,
+writer and utils show up.
+"""
+
+from __future__ import annotations
+
+import os
+import tempfile
+
+import pytest
+
+from tests import benchmark
+
+SIZES = (
+    benchmark.ProjectSize(apps=5, migrations=10, models=3),
+    benchmark.ProjectSize(apps=20, migrations=25, models=5),
+    benchmark.ProjectSize(apps=50, migrations=40, models=8),
+)
+
+
+@pytest.mark.benchmark
+@pytest.mark.no_cover
+@pytest.mark.parametrize("size", SIZES, ids=str)
+def test_benchmark_squash_migrations(size):
+    pytest.importorskip("resource")
+
+    with tempfile.TemporaryDirectory() as root:
+        labels = benchmark.generate_project(root, size)
+        result = benchmark.run_squash(root)
+
+        for label in labels:
+            files = os.listdir(os.path.join(root, label, "migrations"))
+            assert f"{size.migrations + 1:04}_squashed.py" in files
+
+    print(  # noqa: T201
+        f"\n{size}: {size.apps * size.migrations} migrations squashed in {result['wall']:.3f}s, "
+        f"peak memory {result['peak_memory_kb'] / 1024:.1f}MB"
+    )
+
+
+@pytest.mark.benchmark
+@pytest.mark.no_cover
+def test_benchmark_import_time():
+    """The app is in INSTALLED_APPS of every process, loading it and the command must stay cheap."""
+    times = benchmark.import_times("django_squash.apps", "django_squash.management.commands.squash_migrations")
+
+    assert not [name for name in times if name.startswith("django_squash.db")]
+    print(  # noqa: T201
+        "\n" + "\n".join(f"{name}: {seconds * 1000:.1f}ms" for name, seconds in sorted(times.items()))
+    )
@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import itertools
+import os
+import unittest.mock
+
+from django.apps import apps
+from django.db.migrations.loader import MigrationLoader
+import pytest
+
+from django_squash.db.migrations.loader import SquashMigrationLoader
+
+
+@pytest.mark.temporary_migration_module(module="app.tests.migrations.simple", app_label="app")
+def test_squash_loader_scans_disk_once(migration_app_dir):
+    del migration_app_dir
+
+    with unittest.mock.patch.object(
+        MigrationLoader, "load_disk", autospec=True, side_effect=MigrationLoader.load_disk
+    ) as load_disk:
+        loader = SquashMigrationLoader(None, ignore_no_migrations=True)
+    assert load_disk.call_count == 1
+
+    # The real graph is the same one django would build
+    real_loader = MigrationLoader(None, ignore_no_migrations=True)
+    assert set(loader.graph.nodes) == set(real_loader.graph.nodes)
+    assert loader.disk_migrations.keys() == real_loader.disk_migrations.keys()
+    assert ("app", "0003_auto_20190518_1524") in loader.graph.nodes
+    assert loader.disk_migrations_by_app["app"] == [
+        ("app", "0001_initial"),
+        ("app", "0002_person_age"),
+        ("app", "0003_auto_20190518_1524"),
+    ]
+    assert sorted(itertools.chain.from_iterable(loader.disk_migrations_by_app.values())) == sorted(
+        loader.disk_migrations
+    )
+
+    # The squash graph pretends the project apps have no migrations at all
+    assert not [key for key in loader.squash_graph.nodes if key[0] in loader.project_apps()]
+    assert "app" in loader.project_apps()
+    assert "app" not in loader.squash_project_state().apps.app_configs
+
+
+@pytest.mark.temporary_migration_module(module="app.tests.migrations.simple", app_label="app")
+def test_squash_loader_does_not_write_to_disk(migration_app_dir, settings, monkeypatch):
+    """The squash graph is built in memory, nothing is written inside the app packages (read-only images)."""
+    del migration_app_dir
+
+    def fail(*args, **kwargs):
+        del args, kwargs
+        raise AssertionError("The loader must not create temporary directories")
+
+    monkeypatch.setattr("tempfile.mkdtemp", fail)
+    original_migration_modules = settings.MIGRATION_MODULES.copy()
+    app_paths = {app_config.path: sorted(os.listdir(app_config.path)) for app_config in apps.get_app_configs()}
+
+    loader = SquashMigrationLoader(None, ignore_no_migrations=True)
+
+    assert loader.squash_graph is not None
+    assert original_migration_modules == settings.MIGRATION_MODULES
+    assert {path: sorted(os.listdir(path)) for path in app_paths} == app_paths
@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import contextlib
+import io
+import re
+import unittest.mock
+
+from django.core.management import CommandError, call_command
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.migrations.loader import MigrationLoader
+from django.db.migrations.recorder import MigrationRecorder
+import pytest
+
+from django_squash.db.migrations.executor import SharedMigrationLoader
+
+TENANTS = ("tenant_1", "tenant_2", "tenant_3")
+
+
+@pytest.fixture
+def tenant_databases(tmp_path, monkeypatch, django_db_blocker):
+    for alias in TENANTS:
+        settings_dict = {"ENGINE": "django.db.backends.sqlite3", "NAME": str(tmp_path / f"{alias}.sqlite3")}
+        settings_dict = connections.configure_settings({DEFAULT_DB_ALIAS: settings_dict})[DEFAULT_DB_ALIAS]
+        monkeypatch.setitem(connections.settings, alias, settings_dict)
+
+    with django_db_blocker.unblock():
+        yield TENANTS
+
+    for alias in TENANTS:
+        connections[alias].close()
+        del connections[alias]
+
+
+@pytest.mark.temporary_migration_module(module="app.tests.migrations.simple", app_label="app")
+def test_migrate_databases(migration_app_dir, tenant_databases):
+    del migration_app_dir
+
+    stdout = io.StringIO()
+    with contextlib.ExitStack() as stack:
+        load_disk = stack.enter_context(
+            unittest.mock.patch.object(
+                MigrationLoader, "load_disk", autospec=True, side_effect=MigrationLoader.load_disk
+            )
+        )
+        build_graph = stack.enter_context(
+            unittest.mock.patch.object(
+                SharedMigrationLoader, "build_graph", autospec=True, side_effect=SharedMigrationLoader.build_graph
+            )
+        )
+        base_build_graph = stack.enter_context(
+            unittest.mock.patch.object(
+                MigrationLoader, "build_graph", autospec=True, side_effect=MigrationLoader.build_graph
+            )
+        )
+        call_command("migrate_databases", *tenant_databases, "--jobs", "2", stdout=stdout, no_color=True)
+
+    # The migrations are imported once, and all the databases (empty) share the same graph
+    assert load_disk.call_count == 1
+    assert build_graph.call_count == len(tenant_databases)
+    assert base_build_graph.call_count == 2
+
+    output = stdout.getvalue()
+    for alias in tenant_databases:
+        assert re.search(rf"^  \[\d/3\] {alias}: \d+ migrations applied in \d+\.\d{{3}}s$", output, re.MULTILINE)
+        assert ("app", "0003_auto_20190518_1524") in MigrationRecorder(connections[alias]).applied_migrations()
+        assert "app_person" in connections[alias].introspection.table_names()
+    assert re.search(
+        r"^Migrated 3 databases in \d+\.\d{3}s \(slowest: tenant_\d in \d+\.\d{3}s\)$", output, re.MULTILINE
+    )
+
+    stdout = io.StringIO()
+    call_command("migrate_databases", *tenant_databases, stdout=stdout, no_color=True)
+    assert stdout.getvalue().count(": 0 migrations applied in ") == 3
+
+
+def test_migrate_databases_errors(tenant_databases):
+    with pytest.raises(CommandError) as error:
+        call_command("migrate_databases", "tenant_1", "missing")
+    assert str(error.value) == "The following databases are not valid: missing"
+
+    with pytest.raises(CommandError) as error:
+        call_command("migrate_databases", *tenant_databases, "--jobs", "0")
+    assert str(error.value) == "--jobs must be at least 1."
+
+    stderr = io.StringIO()
+    with (
+        unittest.mock.patch("django.db.migrations.executor.MigrationExecutor.migrate", side_effect=ValueError("boom")),
+        pytest.raises(CommandError) as error,
+    ):
+        call_command("migrate_databases", *tenant_databases, stdout=io.StringIO(), stderr=stderr, no_color=True)
+    assert str(error.value) == "Migrating the following databases failed: tenant_1, tenant_2, tenant_3"
+    assert stderr.getvalue().count(": FAILED boom") == 3
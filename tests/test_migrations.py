@@ -1,17 +1,29 @@
+import json
+import os
+import pstats
+import re
 import textwrap
 import unittest.mock
 
 import pytest
 from django.contrib.postgres.indexes import GinIndex
 from django.core.management import CommandError
-from django.db import models
+from django.db import DEFAULT_DB_ALIAS, connections, models
+from django.db.migrations.executor import MigrationExecutor
 from django.db.migrations.recorder import MigrationRecorder
+from django.db.migrations.state import ProjectState
+from django.test import override_settings
+
+from django_squash.db.migrations import report
+from django_squash.db.migrations.loader import SquashMigrationLoader
+from django_squash.db.migrations.operations import SchemaSnapshot, database_version
 
 DjangoMigrationModel = MigrationRecorder.Migration
 
 
 @pytest.mark.temporary_migration_module(module="app.tests.migrations.elidable", app_label="app")
-def test_squashing_elidable_migration_simple(migration_app_dir, call_squash_migrations):
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_squashing_elidable_migration_simple(migration_app_dir, call_squash_migrations, jobs):
     class Person(models.Model):
         name = models.CharField(max_length=10)
         dob = models.DateField()
@@ -19,11 +31,10 @@ def test_squashing_elidable_migration_simple(migration_app_dir, call_squash_migr
         class Meta:
             app_label = "app"
 
-    call_squash_migrations()
+    call_squash_migrations("--jobs", jobs)
 
     expected = textwrap.dedent(
         """\
-        import datetime
         import itertools
         from django.db import migrations
         from django.db import migrations, models
@@ -249,6 +260,387 @@ def test_squashing_migration_simple_ignore(migration_app_dir, migration_app2_dir
     assert app2_squash.Migration.dependencies == [("app", "0003_auto_20190518_1524")]
 
 
+@pytest.mark.temporary_migration_module(module="app.tests.migrations.simple", app_label="app")
+@pytest.mark.temporary_migration_module2(module="app2.tests.migrations.foreign_key", app_label="app2", join=True)
+def test_squashing_migration_keep_last(migration_app_dir, migration_app2_dir, call_squash_migrations):
+    """
+    The last migration of each app is left out of the squash, "app2" only has one so it is not squashed at all.
+    """
+
+    class Person(models.Model):
+        name = models.CharField(max_length=10)
+        dob = models.DateField()
+
+        class Meta:
+            app_label = "app"
+
+    class Address(models.Model):
+        person = models.ForeignKey("app.Person", on_delete=models.deletion.CASCADE)
+        address1 = models.CharField(max_length=100)
+        address2 = models.CharField(max_length=100)
+        city = models.CharField(max_length=50)
+        postal_code = models.CharField(max_length=50)
+        province = models.CharField(max_length=50)
+        country = models.CharField(max_length=50)
+
+        class Meta:
+            app_label = "app2"
+
+    call_squash_migrations("--keep-last", "1")
+
+    files_in_app = migration_app_dir.migration_files()
+    assert files_in_app == [
+        "0001_initial.py",
+        "0002_person_age.py",
+        "0003_auto_20190518_1524.py",
+        "0004_squashed.py",
+        "__init__.py",
+    ]
+    assert migration_app2_dir.migration_files() == ["0001_initial.py", "__init__.py"]
+
+    app_squash = migration_app_dir.migration_load("0004_squashed.py")
+    assert app_squash.Migration.replaces == [("app", "0001_initial"), ("app", "0002_person_age")]
+    expected = textwrap.dedent(
+        """\
+        from django.db import migrations, models
+
+
+        class Migration(migrations.Migration):
+
+            replaces = [("app", "0001_initial"), ("app", "0002_person_age")]
+
+            initial = True
+
+            dependencies = []
+
+            operations = [
+                migrations.CreateModel(
+                    name="Person",
+                    fields=[
+                        ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                        ("name", models.CharField(max_length=10)),
+                        ("age", models.IntegerField()),
+                    ],
+                ),
+            ]
+        """
+    )
+    assert migration_app_dir.migration_read("0004_squashed.py", "") == expected
+
+    # The kept migrations depend on the squashed migration instead of the ones it replaces
+    app_kept = migration_app_dir.migration_load("0003_auto_20190518_1524.py")
+    assert app_kept.Migration.dependencies == [("app", "0004_squashed")]
+    app2_kept = migration_app2_dir.migration_load("0001_initial.py")
+    assert app2_kept.Migration.dependencies == [("app", "0004_squashed")]
+
+    loader = SquashMigrationLoader(None)
+    assert loader.graph.leaf_nodes("app") == [("app", "0003_auto_20190518_1524")]
+    assert loader.graph.forwards_plan(("app2", "0001_initial")) == [
+        ("app", "0004_squashed"),
+        ("app2", "0001_initial"),
+    ]
+
+    # Next squash, the replaced migrations are deleted and the kept ones still depend on the squashed migration
+    report.forget_migration_modules()
+    call_squash_migrations("--keep-last", "1")
+    assert migration_app_dir.migration_files() == [
+        "0003_auto_20190518_1524.py",
+        "0004_squashed.py",
+        "0005_squashed.py",
+        "__init__.py",
+    ]
+    app_kept = migration_app_dir.migration_load("0003_auto_20190518_1524.py")
+    assert app_kept.Migration.dependencies == [("app", "0005_squashed")]
+    app2_kept = migration_app2_dir.migration_load("0001_initial.py")
+    assert app2_kept.Migration.dependencies == [("app", "0005_squashed")]
+    assert migration_app_dir.migration_load("0005_squashed.py").Migration.replaces == [("app", "0004_squashed")]
+
+
+@pytest.mark.temporary_migration_module(module="app.tests.migrations.simple", app_label="app")
+@pytest.mark.temporary_migration_module2(module="app2.tests.migrations.foreign_key", app_label="app2", join=True)
+def test_squashing_migration_upto(migration_app_dir, migration_app2_dir, call_squash_migrations):
+    """
+    Only "app" is squashed up to a migration, "app2" does not depend on the migrations after it and is fully squashed.
+    """
+
+    class Person(models.Model):
+        name = models.CharField(max_length=10)
+        dob = models.DateField()
+
+        class Meta:
+            app_label = "app"
+
+    class Address(models.Model):
+        person = models.ForeignKey("app.Person", on_delete=models.deletion.CASCADE)
+        address1 = models.CharField(max_length=100)
+        address2 = models.CharField(max_length=100)
+        city = models.CharField(max_length=50)
+        postal_code = models.CharField(max_length=50)
+        province = models.CharField(max_length=50)
+        country = models.CharField(max_length=50)
+
+        class Meta:
+            app_label = "app2"
+
+    call_squash_migrations("--upto", "app.0001_initial")
+
+    assert "0004_squashed.py" in migration_app_dir.migration_files()
+    assert "0002_squashed.py" in migration_app2_dir.migration_files()
+
+    app_squash = migration_app_dir.migration_load("0004_squashed.py")
+    assert app_squash.Migration.replaces == [("app", "0001_initial")]
+    assert [operation.describe() for operation in app_squash.Migration.operations] == ["Create model Person"]
+
+    app_kept = migration_app_dir.migration_load("0002_person_age.py")
+    assert app_kept.Migration.dependencies == [("app", "0004_squashed")]
+    # Not a dependency on a replaced migration, nothing to rewrite
+    assert migration_app_dir.migration_load("0003_auto_20190518_1524.py").Migration.dependencies == [
+        ("app", "0002_person_age")
+    ]
+
+    app2_squash = migration_app2_dir.migration_load("0002_squashed.py")
+    assert app2_squash.Migration.replaces == [("app2", "0001_initial")]
+    assert app2_squash.Migration.dependencies == [("app", "0004_squashed")]
+
+
+@pytest.mark.temporary_migration_module(module="app.tests.migrations.rename_model", app_label="app")
+@pytest.mark.temporary_migration_module2(module="app2.tests.migrations.foreign_key_tail", app_label="app2", join=True)
+def test_squashing_migration_upto_related_change(migration_app_dir, migration_app2_dir, call_squash_migrations):
+    """
+    "app" is fully squashed and renames the model "app2" points to after the cut, the squashed "app2" migration points
+    to the renamed model.
+    """
+
+    class Human(models.Model):
+        name = models.CharField(max_length=10)
+
+        class Meta:
+            app_label = "app"
+
+    class Address(models.Model):
+        person = models.ForeignKey("app.Human", on_delete=models.deletion.CASCADE)
+        address1 = models.CharField(max_length=100)
+        address2 = models.CharField(max_length=100)
+        city = models.CharField(max_length=50)
+        postal_code = models.CharField(max_length=50)
+        province = models.CharField(max_length=50)
+        country = models.CharField(max_length=50)
+        notes = models.TextField()
+
+        class Meta:
+            app_label = "app2"
+
+    call_squash_migrations("--upto", "app2.0001_initial")
+
+    app_squash = migration_app_dir.migration_load("0003_squashed.py")
+    assert app_squash.Migration.replaces == [("app", "0001_initial"), ("app", "0002_rename_person_human")]
+    assert [operation.describe() for operation in app_squash.Migration.operations] == ["Create model Human"]
+
+    app2_squash = migration_app2_dir.migration_load("0003_squashed.py")
+    assert app2_squash.Migration.replaces == [("app2", "0001_initial")]
+    assert app2_squash.Migration.dependencies == [("app", "0003_squashed")]
+    (create_address,) = app2_squash.Migration.operations
+    assert dict(create_address.fields)["person"].remote_field.model == "app.human"
+    assert "notes" not in dict(create_address.fields)
+
+    app2_kept = migration_app2_dir.migration_load("0002_address_notes.py")
+    assert app2_kept.Migration.dependencies == [("app2", "0003_squashed")]
+
+
+@pytest.mark.temporary_migration_module(module="app.tests.migrations.simple", app_label="app")
+def test_squashing_migration_partial_errors(migration_app_dir, call_squash_migrations):
+    del migration_app_dir
+
+    with pytest.raises(CommandError) as error:
+        call_squash_migrations("--keep-last", "-1")
+    assert str(error.value) == "--keep-last cannot be negative."
+
+    with pytest.raises(CommandError) as error:
+        call_squash_migrations("--keep-last", "1", "--fingerprint-file", "fingerprints.json")
+    assert str(error.value) == "--keep-last and --upto cannot be used with an incremental squash (--fingerprint-file)."
+
+    with pytest.raises(CommandError) as error:
+        call_squash_migrations("--upto", "app.0001_initial", "app.9999_missing", "missing")
+    assert str(error.value) == "The following migrations are not valid: app.9999_missing, missing"
+
+    with pytest.raises(CommandError) as error:
+        call_squash_migrations("--upto", "app.0001_initial", "--ignore-app", "app")
+    assert str(error.value) == "The following app cannot be ignored and squashed up to a migration: app"
+
+
+@pytest.mark.temporary_migration_module(module="app.tests.migrations.delta", app_label="app")
+@pytest.mark.temporary_migration_module2(module="app2.tests.migrations.foreign_key", app_label="app2", join=True)
+def test_squashing_migration_delta(migration_app_dir, migration_app2_dir, call_squash_migrations):
+    """
+    "app" keeps its previous squashed migration, only the migrations after it are squashed. "app2" was never squashed,
+    all of it is.
+    """
+
+    class Person(models.Model):
+        full_name = models.CharField(max_length=10)
+        age = models.IntegerField()
+
+        class Meta:
+            app_label = "app"
+
+    class Address(models.Model):
+        person = models.ForeignKey("app.Person", on_delete=models.deletion.CASCADE)
+        address1 = models.CharField(max_length=100)
+        address2 = models.CharField(max_length=100)
+        city = models.CharField(max_length=50)
+        postal_code = models.CharField(max_length=50)
+        province = models.CharField(max_length=50)
+        country = models.CharField(max_length=50)
+
+        class Meta:
+            app_label = "app2"
+
+    call_squash_migrations("--delta")
+
+    assert migration_app_dir.migration_files() == [
+        "0002_squashed.py",
+        "0003_person_age.py",
+        "0004_rename_name_person_full_name.py",
+        "0005_capitalize_names.py",
+        "0006_squashed.py",
+        "__init__.py",
+    ]
+    assert migration_app2_dir.migration_files() == ["0001_initial.py", "0002_squashed.py", "__init__.py"]
+
+    # The previous squashed migration is kept, its replaced migrations are gone
+    app_base = migration_app_dir.migration_load("0002_squashed.py")
+    assert app_base.Migration.replaces == []
+    assert [operation.describe() for operation in app_base.Migration.operations] == ["Create model Person"]
+
+    # The rename and the one-off default come from the replaced migrations
+    expected = textwrap.dedent(
+        """\
+        from django.db import migrations
+        from django.db import migrations, models
+
+
+        def capitalize_names(apps, schema_editor):
+            Person = apps.get_model("app", "Person")
+            for person in Person.objects.all():
+                person.full_name = person.full_name.capitalize()
+                person.save()
+
+
+        class Migration(migrations.Migration):
+
+            replaces = [("app", "0003_person_age"), ("app", "0004_rename_name_person_full_name"), ("app", "0005_capitalize_names")]
+
+            dependencies = [
+                ("app", "0002_squashed"),
+            ]
+
+            operations = [
+                migrations.RenameField(
+                    model_name="person",
+                    old_name="name",
+                    new_name="full_name",
+                ),
+                migrations.AddField(
+                    model_name="person",
+                    name="age",
+                    field=models.IntegerField(default=18),
+                    preserve_default=False,
+                ),
+                migrations.RunPython(
+                    code=capitalize_names,
+                    reverse_code=migrations.RunPython.noop,
+                    elidable=False,
+                ),
+            ]
+        """  # noqa: E501
+    )
+    assert migration_app_dir.migration_read("0006_squashed.py", "") == expected
+
+    app2_squash = migration_app2_dir.migration_load("0002_squashed.py")
+    assert app2_squash.Migration.replaces == [("app2", "0001_initial")]
+    assert app2_squash.Migration.dependencies == [("app", "0006_squashed")]
+
+    # Nothing new to squash
+    report.forget_migration_modules()
+    with pytest.raises(CommandError) as error:
+        call_squash_migrations("--delta")
+    assert str(error.value) == "There are no migrations to squash."
+
+
+@pytest.mark.temporary_migration_module(module="app.tests.migrations.delta", app_label="app")
+@pytest.mark.temporary_migration_module2(module="app2.tests.migrations.delta", app_label="app2", join=True)
+def test_squashing_migration_delta_same_model_name(migration_app_dir, migration_app2_dir, call_squash_migrations):
+    """
+    Both apps have a "person" model that ends up with the same fields, only "app" renamed its field and each app gave
+    a different one-off default.
+    """
+
+    class Person(models.Model):
+        full_name = models.CharField(max_length=10)
+        age = models.IntegerField()
+
+        class Meta:
+            app_label = "app"
+
+    class Person(models.Model):
+        full_name = models.CharField(max_length=10)
+        age = models.IntegerField()
+
+        class Meta:
+            app_label = "app2"
+
+    call_squash_migrations("--delta")
+
+    app_squash = migration_app_dir.migration_load("0006_squashed.py")
+    assert [operation.describe() for operation in app_squash.Migration.operations] == [
+        "Rename field name on person to full_name",
+        "Add field age to person",
+        "Raw Python operation",
+    ]
+    assert app_squash.Migration.operations[1].field.default == 18
+
+    app2_squash = migration_app2_dir.migration_load("0004_squashed.py")
+    assert [operation.describe() for operation in app2_squash.Migration.operations] == [
+        "Remove field name from person",
+        "Add field age to person",
+        "Add field full_name to person",
+    ]
+    assert app2_squash.Migration.operations[1].field.default == 30
+    assert app2_squash.Migration.operations[2].field.default == ""
+
+
+@pytest.mark.temporary_migration_module(module="app.tests.migrations.delta", app_label="app")
+def test_squashing_migration_delta_errors(migration_app_dir, call_squash_migrations):
+    del migration_app_dir
+
+    with pytest.raises(CommandError) as error:
+        call_squash_migrations("--delta", "--keep-last", "1")
+    assert str(error.value) == "--delta cannot be used with --keep-last or --upto."
+
+    with pytest.raises(CommandError) as error:
+        call_squash_migrations("--delta", "--fingerprint-file", "fingerprints.json")
+    assert str(error.value) == "--delta cannot be used with an incremental squash (--fingerprint-file)."
+
+    with pytest.raises(CommandError) as error:
+        call_squash_migrations("--delta", "--schema-snapshot", "default")
+    assert str(error.value) == "--schema-snapshot only applies to a full squash, it cannot be used with --delta."
+
+    class Person(models.Model):
+        full_name = models.CharField(max_length=10)
+        age = models.IntegerField()
+        height = models.IntegerField()
+
+        class Meta:
+            app_label = "app"
+
+    with pytest.raises(CommandError) as error:
+        call_squash_migrations("--delta")
+    assert str(error.value) == (
+        "Cannot add the non-nullable field 'height' on model 'app.person', none of the squashed migrations gives it a "
+        "default."
+    )
+
+
 @pytest.mark.temporary_migration_module(module="app.tests.migrations.empty", app_label="app")
 def test_squashing_migration_empty(migration_app_dir, call_squash_migrations):
     del migration_app_dir
@@ -382,7 +774,8 @@ def test_simple_delete_squashing_migrations_noop(migration_app_dir, call_squash_
 
 
 @pytest.mark.temporary_migration_module(module="app.tests.migrations.delete_replaced", app_label="app")
-def test_simple_delete_squashing_migrations(migration_app_dir, call_squash_migrations):
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_simple_delete_squashing_migrations(migration_app_dir, call_squash_migrations, jobs):
     class Person(models.Model):
         name = models.CharField(max_length=10)
         dob = models.DateField()
@@ -397,7 +790,7 @@ def test_simple_delete_squashing_migrations(migration_app_dir, call_squash_migra
         ("app", "0003_add_dob"),
     ]
 
-    call_squash_migrations()
+    call_squash_migrations("--jobs", jobs)
 
     files_in_app = migration_app_dir.migration_files()
     old_app_squash = migration_app_dir.migration_load("0004_squashed.py")
@@ -410,12 +803,42 @@ def test_simple_delete_squashing_migrations(migration_app_dir, call_squash_migra
     assert files_in_app == ["0004_squashed.py", "0005_squashed.py", "__init__.py"]
 
 
+@pytest.mark.temporary_migration_module(module="app.tests.migrations.delete_replaced", app_label="app")
+def test_simple_delete_squashing_migrations_unusual_layout(migration_app_dir, call_squash_migrations):
+    """
+    A migration without a top level "class Migration" can't have its attributes replaced, it is left as it is.
+    """
+
+    class Person(models.Model):
+        name = models.CharField(max_length=10)
+        dob = models.DateField()
+
+        class Meta:
+            app_label = "app"
+
+    source = (migration_app_dir / "0004_squashed.py").read_text()
+    source = source.replace("class Migration(migrations.Migration):", "if True:\n\n  class Migration(migrations.Migration):")
+    source = source.replace("\n    ", "\n      ")
+    (migration_app_dir / "0004_squashed.py").write_text(source)
+
+    call_squash_migrations()
+
+    assert migration_app_dir.migration_files() == ["0004_squashed.py", "0005_squashed.py", "__init__.py"]
+    assert (migration_app_dir / "0004_squashed.py").read_text() == source
+
+
 @pytest.mark.temporary_migration_module(module="app3.tests.migrations.moved", app_label="app3")
-def test_empty_models_migrations(migration_app_dir, call_squash_migrations):
+def test_empty_models_migrations(migration_app_dir, call_squash_migrations, monkeypatch):
     """
     If apps are moved but migrations remain, a fake migration must be made that does nothing and replaces the
     existing migrations, that way django doesn't throw errors when trying to do the same work again.
     """
+
+    def project_state(*args, **kwargs):
+        del args, kwargs
+        raise AssertionError("The state of the autodetector is enough to know which apps have models")
+
+    monkeypatch.setattr(SquashMigrationLoader, "project_state", project_state)
     call_squash_migrations()
     files_in_app = migration_app_dir.migration_files()
     assert "0004_squashed.py" in files_in_app
@@ -436,10 +859,32 @@ def test_empty_models_migrations(migration_app_dir, call_squash_migrations):
     ]
 
 
-@pytest.mark.temporary_migration_module(module="app.tests.migrations.incorrect_name", app_label="app")
-def test_squashing_migration_incorrect_name(migration_app_dir, call_squash_migrations):
+@pytest.mark.temporary_migration_module(module="app3.tests.migrations.moved", app_label="app3")
+def test_empty_models_migrations_fingerprint_file(migration_app_dir, call_squash_migrations, tmp_path):
     """
-    If the app has incorrect migration numbers like: `app/migrations/initial.py` instead of `0001_initial.py`
+    An app without models skipped by the incremental squash doesn't get another migration replacing its migrations.
+    """
+    fingerprint_file = str(tmp_path / "fingerprints.json")
+    call_squash_migrations("--fingerprint-file", fingerprint_file)
+    assert migration_app_dir.migration_files() == [
+        "0001_initial.py",
+        "0002_person_age.py",
+        "0003_moved.py",
+        "0004_squashed.py",
+        "__init__.py",
+    ]
+
+    report.forget_migration_modules()
+    with pytest.raises(CommandError) as error:
+        call_squash_migrations("--fingerprint-file", fingerprint_file)
+    assert str(error.value) == "There are no migrations to squash."
+    assert "0005_squashed.py" not in migration_app_dir.migration_files()
+
+
+@pytest.mark.temporary_migration_module(module="app.tests.migrations.incorrect_name", app_label="app")
+def test_squashing_migration_incorrect_name(migration_app_dir, call_squash_migrations):
+    """
+    If the app has incorrect migration numbers like: `app/migrations/initial.py` instead of `0001_initial.py`
     it should not fail. Same goes for bad formats all around.
     """
 
@@ -479,11 +924,10 @@ def test_run_python_same_name_migrations(migration_app_dir, call_squash_migratio
     ]
     assert files_in_app == expected_files
 
+    # All the functions have the same code (comments aside), it's only copied once
     expected = textwrap.dedent(
         """\
         from django.db import migrations
-        from django.db.migrations import RunPython
-        from django.db.migrations.operations.special import RunPython
 
 
         def same_name(apps, schema_editor):
@@ -491,16 +935,6 @@ def test_run_python_same_name_migrations(migration_app_dir, call_squash_migratio
             return
 
 
-        def same_name_2(apps, schema_editor):
-            # original function 2
-            return
-
-
-        def same_name_3(apps, schema_editor):
-            # other function
-            return
-
-
         class Migration(migrations.Migration):
 
             replaces = [("app", "0001_initial"), ("app", "0002_run_python")]
@@ -519,13 +953,13 @@ def test_run_python_same_name_migrations(migration_app_dir, call_squash_migratio
                     elidable=False,
                 ),
                 migrations.RunPython(
-                    code=same_name_2,
+                    code=same_name,
                     reverse_code=same_name,
                     elidable=False,
                 ),
                 migrations.RunPython(
                     code=same_name,
-                    reverse_code=same_name_2,
+                    reverse_code=same_name,
                     elidable=False,
                 ),
                 migrations.RunPython(
@@ -533,7 +967,165 @@ def test_run_python_same_name_migrations(migration_app_dir, call_squash_migratio
                     elidable=False,
                 ),
                 migrations.RunPython(
-                    code=same_name_3,
+                    code=same_name,
+                    elidable=False,
+                ),
+            ]
+        """  # noqa
+    )
+    assert migration_app_dir.migration_read("0003_squashed.py", "") == expected
+
+
+@pytest.mark.temporary_migration_module(module="app.tests.migrations.run_python_same_name", app_label="app")
+def test_run_python_same_name_different_code_migrations(migration_app_dir, call_squash_migrations):
+    call_squash_migrations()
+
+    # Same name but different code, both are kept under unique names. Same code under another name is copied once.
+    expected = textwrap.dedent(
+        """\
+        from django.db import migrations
+
+
+        def same_name(apps, schema_editor):
+            # first body
+            return 1
+
+
+        def same_name_2(apps, schema_editor):
+            # second body
+            return 2
+
+
+        class Migration(migrations.Migration):
+
+            replaces = [("app", "0001_initial"), ("app", "0002_run_python")]
+
+            dependencies = []
+
+            operations = [
+                migrations.RunPython(
+                    code=same_name,
+                    elidable=False,
+                ),
+                migrations.RunPython(
+                    code=same_name,
+                    elidable=False,
+                ),
+                migrations.RunPython(
+                    code=same_name_2,
+                    reverse_code=migrations.RunPython.noop,
+                    elidable=False,
+                ),
+            ]
+        """  # noqa
+    )
+    assert migration_app_dir.migration_read("0003_squashed.py", "") == expected
+
+
+@pytest.mark.temporary_migration_module(module="app.tests.migrations.run_sql_duplicates", app_label="app")
+def test_run_sql_duplicates_migrations(migration_app_dir, call_squash_migrations):
+    call_squash_migrations()
+
+    expected = textwrap.dedent(
+        """\
+        from django.db import migrations
+
+
+        def forwards(apps, schema_editor):
+            # helper copied into every migration
+            return
+
+
+        SQL_1 = "select 1"
+
+        SQL_1_ROLLBACK = "select 2"
+
+        SQL_1_ROLLBACK_2 = "select 3"
+
+
+        class Migration(migrations.Migration):
+
+            replaces = [("app", "0001_initial"), ("app", "0002_again")]
+
+            dependencies = []
+
+            operations = [
+                migrations.RunSQL(
+                    sql=SQL_1,
+                    reverse_sql=SQL_1_ROLLBACK,
+                    elidable=False,
+                ),
+                migrations.RunPython(
+                    code=forwards,
+                    reverse_code=migrations.RunPython.noop,
+                    elidable=False,
+                ),
+                migrations.RunSQL(
+                    sql=SQL_1,
+                    reverse_sql=SQL_1_ROLLBACK_2,
+                    elidable=False,
+                ),
+                migrations.RunSQL(
+                    sql=SQL_1_ROLLBACK,
+                    elidable=False,
+                ),
+                migrations.RunPython(
+                    code=forwards,
+                    reverse_code=migrations.RunPython.noop,
+                    elidable=False,
+                ),
+            ]
+        """  # noqa
+    )
+    assert migration_app_dir.migration_read("0003_squashed.py", "") == expected
+
+
+@pytest.mark.temporary_migration_module(module="app.tests.migrations.run_sql_duplicates", app_label="app")
+def test_run_sql_merge_sql_migrations(migration_app_dir, call_squash_migrations):
+    call_squash_migrations("--merge-sql")
+
+    # "select 2" is irreversible, so are both RunSQL merged together
+    expected = textwrap.dedent(
+        """\
+        from django.db import migrations
+
+
+        def forwards(apps, schema_editor):
+            # helper copied into every migration
+            return
+
+
+        SQL_1 = "select 1"
+
+        SQL_1_ROLLBACK = "select 2"
+
+        SQL_2 = "select 1\\n;\\nselect 2"
+
+
+        class Migration(migrations.Migration):
+
+            replaces = [("app", "0001_initial"), ("app", "0002_again")]
+
+            dependencies = []
+
+            operations = [
+                migrations.RunSQL(
+                    sql=SQL_1,
+                    reverse_sql=SQL_1_ROLLBACK,
+                    elidable=False,
+                ),
+                migrations.RunPython(
+                    code=forwards,
+                    reverse_code=migrations.RunPython.noop,
+                    elidable=False,
+                ),
+                migrations.RunSQL(
+                    sql=SQL_2,
+                    elidable=False,
+                ),
+                migrations.RunPython(
+                    code=forwards,
+                    reverse_code=migrations.RunPython.noop,
                     elidable=False,
                 ),
             ]
@@ -563,7 +1155,6 @@ def test_swappable_dependency_migrations(migration_app_dir, settings, call_squas
 
     expected = textwrap.dedent(
         """\
-        import datetime
         from django.conf import settings
         from django.db import migrations, models
 
@@ -615,8 +1206,6 @@ def test_squashing_migration_pg_indexes(migration_app_dir, call_squash_migration
         """\
         import django.contrib.postgres.indexes
         import django.contrib.postgres.operations
-        from django.contrib.postgres.operations import BtreeGinExtension
-        from django.db import migrations
         from django.db import migrations, models
 
 
@@ -666,7 +1255,6 @@ def test_squashing_migration_pg_indexes_custom(migration_app_dir, call_squash_mi
         """\
         import django.contrib.postgres.indexes
         from django.contrib.postgres.operations import BtreeGinExtension
-        from django.db import migrations
         from django.db import migrations, models
 
 
@@ -701,3 +1289,384 @@ def test_squashing_migration_pg_indexes_custom(migration_app_dir, call_squash_mi
     # NOTE: different django versions handle index differently, since the Index part is actually not
     #       being tested, it doesn't matter that is not checked
     assert migration_app_dir.migration_read("0003_squashed.py", "").startswith(expected)
+
+
+@pytest.mark.temporary_migration_module(module="app.tests.migrations.simple", app_label="app")
+@pytest.mark.temporary_migration_module2(module="app2.tests.migrations.foreign_key", app_label="app2")
+def test_squashing_migration_fingerprint_file(migration_app_dir, migration_app2_dir, call_squash_migrations, tmp_path):
+    """
+    Apps that did not change since the last squash are skipped when a fingerprint file is used.
+    """
+
+    class Person(models.Model):
+        name = models.CharField(max_length=10)
+        dob = models.DateField()
+
+        class Meta:
+            app_label = "app"
+
+    class Address(models.Model):
+        person = models.ForeignKey("app.Person", on_delete=models.deletion.CASCADE)
+        address1 = models.CharField(max_length=100)
+        address2 = models.CharField(max_length=100)
+        city = models.CharField(max_length=50)
+        postal_code = models.CharField(max_length=50)
+        province = models.CharField(max_length=50)
+        country = models.CharField(max_length=50)
+
+        class Meta:
+            app_label = "app2"
+
+    fingerprint_file = str(tmp_path / "fingerprints.json")
+    call_squash_migrations("--fingerprint-file", fingerprint_file)
+
+    assert "0004_squashed.py" in migration_app_dir.migration_files()
+    assert "0002_squashed.py" in migration_app2_dir.migration_files()
+    with open(fingerprint_file) as f:
+        assert {"app", "app2", "app3"} <= set(json.load(f)["apps"])
+
+    # Nothing changed, every app is skipped
+    with pytest.raises(CommandError) as error:
+        call_squash_migrations("--fingerprint-file", fingerprint_file)
+    assert str(error.value) == "There are no migrations to squash."
+    assert "0005_squashed.py" not in migration_app_dir.migration_files()
+
+    # "app2" gets a new migration, "app" remains untouched
+    (migration_app2_dir / "0003_address_extra.py").write_text(
+        textwrap.dedent(
+            """\
+            from django.db import migrations
+
+
+            class Migration(migrations.Migration):
+                dependencies = [("app2", "0002_squashed")]
+                operations = []
+            """
+        )
+    )
+    call_squash_migrations("--fingerprint-file", fingerprint_file)
+
+    assert "0005_squashed.py" not in migration_app_dir.migration_files()
+    assert "0004_squashed.py" in migration_app2_dir.migration_files()
+    app2_squash = migration_app2_dir.migration_load("0004_squashed.py")
+    assert app2_squash.Migration.replaces == [("app2", "0002_squashed"), ("app2", "0003_address_extra")]
+    assert app2_squash.Migration.dependencies == [("app", "0004_squashed")]
+
+
+@pytest.mark.temporary_migration_module(module="app.tests.migrations.simple", app_label="app")
+def test_squashing_migration_profile(migration_app_dir, call_squash_migrations, capsys, tmp_path):
+    class Person(models.Model):
+        name = models.CharField(max_length=10)
+        dob = models.DateField()
+
+        class Meta:
+            app_label = "app"
+
+    profile_output = tmp_path / "squash.prof"
+    call_squash_migrations("--profile", "--profile-output", str(profile_output))
+
+    assert "0004_squashed.py" in migration_app_dir.migration_files()
+    output = capsys.readouterr().out
+    for phase in (
+        "loader",
+        "ProjectState.from_apps",
+        "changes",
+        "delete_old_squashed",
+        "add_non_elidables",
+        "convert_migration_references_to_objects",
+        "write_migration_files",
+        "Total",
+    ):
+        assert re.search(r"^  %s +\d+\.\d{3} +\d+\.\d{3}$" % re.escape(phase), output, re.MULTILINE)
+
+    stats = pstats.Stats(str(profile_output))
+    assert any(function_name == "write_migration_files" for _, _, function_name in stats.stats)
+
+
+@pytest.mark.temporary_migration_module(module="app.tests.migrations.delete_replaced", app_label="app")
+def test_simple_delete_squashing_migrations_interrupted(migration_app_dir, call_squash_migrations, monkeypatch):
+    """
+    A failure while writing the files leaves the migrations untouched.
+    """
+
+    class Person(models.Model):
+        name = models.CharField(max_length=10)
+        dob = models.DateField()
+
+        class Meta:
+            app_label = "app"
+
+    original_files = {name: (migration_app_dir / name).read_text() for name in migration_app_dir.migration_files()}
+
+    original_fdopen = os.fdopen
+    calls = []
+
+    def fdopen(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 2:
+            raise OSError("No space left on device")
+        return original_fdopen(*args, **kwargs)
+
+    monkeypatch.setattr("django_squash.db.migrations.utils.os.fdopen", fdopen)
+    with pytest.raises(OSError, match="No space left on device"):
+        call_squash_migrations()
+
+    assert {name: (migration_app_dir / name).read_text() for name in migration_app_dir.migration_files()} == (
+        original_files
+    )
+    assert set(os.listdir(migration_app_dir)) - {"__pycache__"} == set(original_files)
+
+
+@pytest.mark.temporary_migration_module(module="app.tests.migrations.simple", app_label="app")
+def test_squashing_migration_report(migration_app_dir, call_squash_migrations, capsys, django_db_blocker):
+    forget_migration_modules = report.forget_migration_modules
+    measure_graph = report.measure_graph
+
+    class Person(models.Model):
+        name = models.CharField(max_length=10)
+        dob = models.DateField()
+
+        class Meta:
+            app_label = "app"
+
+    calls = []
+    with (
+        django_db_blocker.unblock(),
+        unittest.mock.patch.object(
+            report, "forget_migration_modules", side_effect=lambda: calls.append("forget") or forget_migration_modules()
+        ),
+        unittest.mock.patch.object(
+            report, "measure_graph", side_effect=lambda: calls.append("measure") or measure_graph()
+        ),
+    ):
+        call_squash_migrations("--report")
+
+    # Both measurements import the migrations from scratch
+    assert calls == ["forget", "measure", "forget", "measure"]
+    assert "0004_squashed.py" in migration_app_dir.migration_files()
+    output = capsys.readouterr().out
+    assert re.search(r"^  app +3 -> 1 +\d+ -> \d+ +\d+\.\d{3} -> \d+\.\d{3}$", output, re.MULTILINE)
+    assert re.search(r"^  Total +\d+ -> \d+ ", output, re.MULTILINE)
+    assert re.search(r"^  MigrationLoader build time: \d+\.\d{3}s -> \d+\.\d{3}s$", output, re.MULTILINE)
+
+
+def test_squashing_migration_report_dry_run(call_squash_migrations):
+    with pytest.raises(CommandError) as error:
+        call_squash_migrations("--report", "--dry-run")
+    assert str(error.value) == "--report needs to write the squashed migrations, it cannot be used with --dry-run."
+
+
+@pytest.mark.temporary_migration_module(module="app.tests.migrations.simple", app_label="app")
+def test_squashing_migration_schema_snapshot(migration_app_dir, call_squash_migrations, django_db_blocker):
+    class Person(models.Model):
+        name = models.CharField(max_length=10)
+        dob = models.DateField()
+
+        class Meta:
+            app_label = "app"
+
+    with django_db_blocker.unblock(), report.in_memory_database():
+        call_squash_migrations("--schema-snapshot", "default")
+
+    expected = textwrap.dedent(
+        """\
+        import django_squash.db.migrations.operations
+        from django.db import migrations, models
+
+
+        class Migration(django_squash.db.migrations.operations.SnapshotMigration):
+
+            replaces = [("app", "0001_initial"), ("app", "0002_person_age"), ("app", "0003_auto_20190518_1524")]
+
+            initial = True
+
+            dependencies = []
+
+            operations = [
+                django_squash.db.migrations.operations.SchemaSnapshot(
+                    operations=[
+                        migrations.CreateModel(
+                            name="Person",
+                            fields=[
+                                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                                ("name", models.CharField(max_length=10)),
+                                ("dob", models.DateField()),
+                            ],
+                        )
+                    ],
+                    snapshots={"sqlite": ['CREATE TABLE "app_person" ("id" integer NOT NULL PRIMARY KEY AUTOINCREMENT, "name" varchar(10) NOT NULL, "dob" date NOT NULL);']},
+                    tables=["app_person"],
+                    versions={"sqlite": "%s"},
+                ),
+            ]
+        """  # noqa: E501
+    ) % database_version(connections[DEFAULT_DB_ALIAS])
+    assert migration_app_dir.migration_read("0004_squashed.py", "") == expected
+
+    report.forget_migration_modules()
+    with django_db_blocker.unblock(), report.in_memory_database() as connection:
+        executor = MigrationExecutor(connection)
+        migration = executor.loader.get_migration("app", "0004_squashed")
+        (snapshot,) = migration.snapshot_operations
+        assert isinstance(snapshot, SchemaSnapshot)
+        # Anything else reading the migration sees the operations unwrapped
+        assert [operation.describe() for operation in migration.operations] == ["Create model Person"]
+
+        # The operations are not run, the snapshot SQL creates the table
+        with unittest.mock.patch(
+            "django.db.migrations.operations.CreateModel.database_forwards", side_effect=AssertionError
+        ):
+            executor.migrate([("app", "0004_squashed")])
+        with connection.cursor() as cursor:
+            columns = {column.name for column in connection.introspection.get_table_description(cursor, "app_person")}
+        assert columns == {"id", "name", "dob"}
+
+        # The table exists now, the operations are the ones to run
+        state = executor.loader.project_state(("app", "0004_squashed"))
+        with connection.schema_editor() as schema_editor:
+            assert not snapshot.use_snapshot("app", schema_editor, ProjectState(), state)
+
+    # The table already exists (ie: created by the replaced migrations) but the migration was never recorded
+    with django_db_blocker.unblock(), report.in_memory_database() as connection:
+        with connection.schema_editor() as schema_editor:
+            schema_editor.create_model(state.apps.get_model("app", "Person"))
+        executor = MigrationExecutor(connection)
+        executor.migrate([("app", "0004_squashed")], fake_initial=True)
+        assert ("app", "0004_squashed") in executor.recorder.applied_migrations()
+
+    # The SQL came from another server version, or doesn't create the tables the operations would: the operations run
+    with django_db_blocker.unblock(), report.in_memory_database() as connection:
+        with connection.schema_editor() as schema_editor:
+            assert snapshot.use_snapshot("app", schema_editor, ProjectState(), state)
+    for changes in ({"versions": {"sqlite": "0.1"}}, {"tables": ["app_person", "app_other"]}):
+        mismatch = SchemaSnapshot(**{**snapshot.deconstruct()[2], **changes})
+        with django_db_blocker.unblock(), report.in_memory_database() as connection:
+            with connection.schema_editor() as schema_editor:
+                assert not mismatch.use_snapshot("app", schema_editor, ProjectState(), state)
+                (create_model,) = mismatch.operations
+                with unittest.mock.patch.object(
+                    create_model, "database_forwards", wraps=create_model.database_forwards
+                ) as database_forwards:
+                    mismatch.database_forwards("app", schema_editor, ProjectState(), state)
+            database_forwards.assert_called_once()
+            assert "app_person" in connection.introspection.table_names()
+
+    # Half migrated: another table of the app is already there
+    class Pet(models.Model):
+        class Meta:
+            app_label = "app"
+
+    with django_db_blocker.unblock(), report.in_memory_database() as connection:
+        with connection.schema_editor() as schema_editor:
+            schema_editor.create_model(Pet)
+            assert not snapshot.use_snapshot("app", schema_editor, ProjectState(), state)
+
+    # The snapshot is not used where the router does not allow the models
+    with (
+        django_db_blocker.unblock(),
+        report.in_memory_database() as connection,
+        override_settings(DATABASE_ROUTERS=[NoAppRouter()]),
+    ):
+        executor = MigrationExecutor(connection)
+        executor.migrate([("app", "0004_squashed")])
+        assert "app_person" not in connection.introspection.table_names()
+
+
+class NoAppRouter:
+    """Router keeping the models of "app" out of every database."""
+
+    def allow_migrate(self, db, app_label, **hints):
+        del db, hints
+        return app_label != "app"
+
+
+@pytest.mark.temporary_migration_module(module="app.tests.migrations.simple", app_label="app")
+def test_squashing_migration_schema_snapshot_vendors(
+    migration_app_dir, call_squash_migrations, django_db_blocker, tmp_path, monkeypatch
+):
+    del migration_app_dir
+
+    class Person(models.Model):
+        name = models.CharField(max_length=10)
+        dob = models.DateField()
+
+        class Meta:
+            app_label = "app"
+
+    settings_dict = {"ENGINE": "django.db.backends.sqlite3", "NAME": str(tmp_path / "other.sqlite3")}
+    settings_dict = connections.configure_settings({DEFAULT_DB_ALIAS: settings_dict})[DEFAULT_DB_ALIAS]
+    monkeypatch.setitem(connections.settings, "other", settings_dict)
+    try:
+        # Both SQLite, but the SQL differs
+        monkeypatch.setattr(connections["other"], "data_types", {**connections["other"].data_types, "CharField": "text"})
+        with pytest.raises(CommandError) as error, django_db_blocker.unblock(), report.in_memory_database():
+            call_squash_migrations("--schema-snapshot", "default", "other")
+    finally:
+        connections["other"].close()
+        del connections["other"]
+    assert str(error.value) == (
+        "The databases default and other generate a different schema or run a different version of the same vendor "
+        "(sqlite), only one of them can be given to --schema-snapshot."
+    )
+
+
+def test_squashing_migration_schema_snapshot_errors(call_squash_migrations):
+    with pytest.raises(CommandError) as error:
+        call_squash_migrations("--schema-snapshot", "default", "--dry-run")
+    assert str(error.value) == (
+        "--schema-snapshot needs to write the squashed migrations, it cannot be used with --dry-run."
+    )
+
+    with pytest.raises(CommandError) as error:
+        call_squash_migrations("--schema-snapshot", "default", "other", "missing")
+    assert str(error.value) == "The following databases are not valid: other, missing"
+
+
+@pytest.mark.temporary_migration_module(module="app.tests.migrations.backfill", app_label="app")
+def test_squashing_migration_elidable_candidates(migration_app_dir, call_squash_migrations, capsys):
+    call_squash_migrations("--elidable-candidates")
+
+    # Nothing is squashed
+    assert migration_app_dir.migration_files() == ["0001_initial.py", "0002_backfill.py", "__init__.py"]
+    output = capsys.readouterr().out
+    assert re.search(r"^  app: 5 operations, ~\d+\.\d{3}s per migrate$", output, re.MULTILINE)
+    candidates = re.findall(r"^    (\S+: .*)$", output, re.MULTILINE)
+    assert candidates == [
+        "0002_backfill: update_ages (update)",
+        "0002_backfill: rename_people (bulk_update, iterate)",
+        "0002_backfill: save_people (iterate, save)",
+        "0002_backfill: do_nothing (noop)",
+        "0002_backfill: RunPython.noop (noop)",
+    ]
+    assert re.search(r"^Total: 5 operations, ~\d+\.\d{3}s per migrate ", output, re.MULTILINE)
+
+
+@pytest.mark.temporary_migration_module(module="app.tests.migrations.backfill", app_label="app")
+def test_squashing_migration_elidable_candidates_squashed(migration_app_dir, call_squash_migrations, capsys):
+    """
+    Once squashed, the functions are only reported for the squashed migration, not for the ones it replaces.
+    """
+
+    class Person(models.Model):
+        name = models.CharField(max_length=10)
+        age = models.IntegerField(default=0)
+
+        class Meta:
+            app_label = "app"
+
+    call_squash_migrations()
+    report.forget_migration_modules()
+    capsys.readouterr()
+
+    call_squash_migrations("--elidable-candidates")
+
+    output = capsys.readouterr().out
+    candidates = re.findall(r"^    (\S+: .*)$", output, re.MULTILINE)
+    assert candidates == [
+        "0003_squashed: update_ages (update)",
+        "0003_squashed: rename_people (bulk_update, iterate)",
+        "0003_squashed: save_people (iterate, save)",
+        "0003_squashed: do_nothing (noop)",
+        "0003_squashed: RunPython.noop (noop)",
+    ]
+    assert re.search(r"^Total: 5 operations, ~\d+\.\d{3}s per migrate ", output, re.MULTILINE)
@@ -1,7 +1,15 @@
+from multiprocessing.reduction import ForkingPickler
+
 import pytest
+from django.apps import apps
+from django.conf import SettingsReference
+from django.db import migrations, models
 from django.db.migrations import Migration as OriginalMigration
+from django.db.migrations.state import ProjectState
 
 from django_squash.db.migrations import autodetector
+from django_squash.db.migrations.loader import SquashMigrationLoader
+from django_squash.db.migrations.questioner import NonInteractiveMigrationQuestioner
 
 
 def test_migration():
@@ -10,6 +18,12 @@ def test_migration():
     assert new.name == "0001_inital"
     assert new.app_label == "app"
     assert new._original_migration == original
+    # Nothing is copied, the original migration is read until something changes
+    assert new.operations is original.operations
+    assert "operations" not in new.__dict__
+    new.dependencies = [("app", "0000_fake")]
+    assert new.dependencies == [("app", "0000_fake")]
+    assert original.dependencies == []
 
     assert new[0] == "app"
     assert new[1] == "0001_inital"
@@ -17,6 +31,12 @@ def test_migration():
 
     assert not list(new.describe())
     assert not new.is_migration_level
+
+    # Only the attributes of a migration are read from the original one
+    original.custom_attribute = "original"
+    assert not hasattr(new, "custom_attribute")
+    with pytest.raises(AttributeError):
+        new.opertions  # noqa: B018
     new._deleted = True
     new._dependencies_change = True
     new._replaces_change = True
@@ -51,3 +71,158 @@ def test_migration_using_keywords():
             autodetector.Migration.from_migration(fake_migration)
 
         autodetector.Migration.from_migration(new_migration)
+
+
+@pytest.mark.temporary_migration_module(module="app.tests.migrations.simple", app_label="app")
+@pytest.mark.temporary_migration_module2(module="app2.tests.migrations.foreign_key", app_label="app2")
+def test_parallel_changes(migration_app_dir, migration_app2_dir, monkeypatch):
+    """
+    Autodetecting independent groups of apps in different processes gives the same result as doing it all at once.
+    """
+    del migration_app_dir, migration_app2_dir
+    reducers = {}
+    monkeypatch.setattr(ForkingPickler, "_extra_reducers", reducers)
+
+    class Person(models.Model):
+        name = models.CharField(max_length=10)
+
+        class Meta:
+            app_label = "app"
+
+    class Address(models.Model):
+        person = models.ForeignKey("app.Person", on_delete=models.deletion.CASCADE)
+
+        class Meta:
+            app_label = "app2"
+
+    class Profile(models.Model):
+        user = models.OneToOneField("auth.User", on_delete=models.deletion.CASCADE)
+
+        class Meta:
+            app_label = "app3"
+
+    def detect(jobs):
+        loader = SquashMigrationLoader(None, ignore_no_migrations=True)
+        squash_autodetector = autodetector.SquashMigrationAutodetector(
+            loader.squash_project_state(),
+            ProjectState.from_apps(apps),
+            NonInteractiveMigrationQuestioner(specified_apps=None, dry_run=False),
+        )
+        if jobs > 1:
+            groups, _ = squash_autodetector.independent_app_groups()
+            assert ["app", "app2"] in groups
+            assert len(groups) > 1
+        changes = squash_autodetector.parallel_changes(loader.squash_graph, jobs)
+        return {
+            app_label: [
+                (migration.name, sorted(migration.dependencies), [repr(o.deconstruct()) for o in migration.operations])
+                for migration in migrations
+            ]
+            for app_label, migrations in changes.items()
+        }
+
+    serial = detect(jobs=1)
+    assert set(serial) == {"app", "app2", "app3"}
+    assert detect(jobs=2) == serial
+    # The reducer needed by the pool is not left behind, a reducer set by someone else is kept
+    assert ForkingPickler._extra_reducers is reducers
+    assert reducers == {}
+    reducers[SettingsReference] = reducer = object()
+    assert detect(jobs=2) == serial
+    assert reducers == {SettingsReference: reducer}
+
+
+def test_optimize_operations():
+    def create_person():
+        return migrations.CreateModel(
+            name="Person",
+            fields=[("id", models.AutoField(primary_key=True)), ("name", models.CharField(max_length=10))],
+        )
+
+    run_sql = migrations.RunSQL("select 1", elidable=False)
+    migration = autodetector.Migration("0001_squashed", "app")
+    migration.operations = [
+        create_person(),
+        migrations.AddField("person", "age", models.IntegerField(default=0)),
+        migrations.AddIndex("person", models.Index(fields=["name"], name="person_name_idx")),
+        migrations.AddConstraint("person", models.UniqueConstraint(fields=["name"], name="unique_name")),
+        migrations.AlterUniqueTogether("person", {("name", "age")}),
+        run_sql,
+        migrations.AddIndex("person", models.Index(fields=["age"], name="person_age_idx")),
+    ]
+
+    questioner = NonInteractiveMigrationQuestioner(specified_apps=None, dry_run=True)
+    detector = autodetector.SquashMigrationAutodetector(ProjectState(), ProjectState(), questioner)
+    detector.optimize_operations({"app": [migration]})
+
+    create_model, sql, add_index = migration.operations
+    assert isinstance(create_model, migrations.CreateModel)
+    assert [name for name, _ in create_model.fields] == ["id", "name", "age"]
+    assert [index.name for index in create_model.options["indexes"]] == ["person_name_idx"]
+    assert [constraint.name for constraint in create_model.options["constraints"]] == ["unique_name"]
+    assert create_model.options["unique_together"] == {("name", "age")}
+    # Nothing is moved across the RunSQL
+    assert sql is run_sql
+    assert isinstance(add_index, migrations.AddIndex)
+
+
+def test_merge_sql_operations():
+    run_python = migrations.RunPython(migrations.RunPython.noop)
+    migration = autodetector.Migration("0001_squashed", "app")
+    migration.operations = [
+        migrations.RunSQL("select 1 -- one", "select -1"),
+        migrations.RunSQL("select 2;", "select -2;"),
+        migrations.RunSQL("select 3", migrations.RunSQL.noop),
+        run_python,
+        migrations.RunSQL(["select 4"], ["select -4"]),
+        migrations.RunSQL([("select %s", [5])]),
+        # A script and a list of statements are not run the same way
+        migrations.RunSQL("select 6"),
+        migrations.RunSQL("select 7", hints={"target": "other"}),
+        migrations.RunSQL("select 8", elidable=True),
+    ]
+
+    questioner = NonInteractiveMigrationQuestioner(specified_apps=None, dry_run=True)
+    detector = autodetector.SquashMigrationAutodetector(ProjectState(), ProjectState(), questioner)
+    detector.merge_sql_operations({"app": [migration]})
+
+    scripts, python, statements, script, hinted, elidable = migration.operations
+    assert scripts.sql == "select 1 -- one\n;\nselect 2;\nselect 3"
+    assert scripts.reverse_sql == "select -2;\nselect -1"
+    assert python is run_python
+    assert statements.sql == ["select 4", ("select %s", [5])]
+    # The second one is irreversible
+    assert statements.reverse_sql is None
+    assert not statements.reversible
+    assert script.sql == "select 6"
+    assert hinted.hints == {"target": "other"}
+    assert elidable.elidable
+
+
+def test_pack_migrations():
+    def migration(app_label, name, dependencies=()):
+        new_migration = autodetector.Migration(name, app_label)
+        new_migration.operations = [migrations.RunSQL("select '%s.%s'" % (app_label, name))]
+        new_migration.dependencies = list(dependencies)
+        return new_migration
+
+    # app -> app2 -> app is a cycle, "app" needs 2 migrations but app3 only needs one
+    app_1 = migration("app", "0001_initial")
+    app2_1 = migration("app2", "0001_initial", [app_1])
+    app_2 = migration("app", "0002_person_address", [app_1, app2_1])
+    app3_1 = migration("app3", "0001_initial", [("auth", "0012_alter_user_first_name_max_length")])
+    app3_2 = migration("app3", "0002_book_author", [app3_1, app_1])
+    app3_3 = migration("app3", "0003_book_address", [app3_2, app2_1, app_1])
+    changes = {"app": [app_1, app_2], "app2": [app2_1], "app3": [app3_1, app3_2, app3_3]}
+
+    questioner = NonInteractiveMigrationQuestioner(specified_apps=None, dry_run=True)
+    detector = autodetector.SquashMigrationAutodetector(ProjectState(), ProjectState(), questioner)
+    detector.pack_migrations(changes)
+
+    assert changes["app"] == [app_1, app_2]
+    assert changes["app2"] == [app2_1]
+    assert changes["app3"] == [app3_1]
+    assert len(app3_1.operations) == 3
+    # app2 already depends on app, no need to depend on both
+    assert app3_1.dependencies == [("auth", "0012_alter_user_first_name_max_length"), app2_1]
+    assert app_2.dependencies == [app_1, app2_1]
@@ -0,0 +1,214 @@
+from __future__ import annotations
+
+import contextlib
+import os
+import sqlite3
+import unittest.mock
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.migrations.executor import MigrationExecutor
+from django.db.utils import load_backend
+import pytest
+
+from django_squash.test import template
+from django_squash.test.runner import TemplateDatabaseRunner
+
+
+@contextlib.contextmanager
+def sqlite_database(path):
+    """Replace the default database with a file based SQLite database (and test database) inside `path`."""
+    settings_dict = connections.configure_settings(
+        {
+            DEFAULT_DB_ALIAS: {
+                "ENGINE": "django.db.backends.sqlite3",
+                "NAME": str(path / "db.sqlite3"),
+                "TEST": {"NAME": str(path / "test.sqlite3")},
+            }
+        }
+    )[DEFAULT_DB_ALIAS]
+    connection = load_backend(settings_dict["ENGINE"]).DatabaseWrapper(settings_dict, DEFAULT_DB_ALIAS)
+
+    original_connection = connections[DEFAULT_DB_ALIAS]
+    connections[DEFAULT_DB_ALIAS] = connection
+    try:
+        yield connection
+    finally:
+        connection.close()
+        connections[DEFAULT_DB_ALIAS] = original_connection
+
+
+@pytest.mark.temporary_migration_module(module="app.tests.migrations.simple", app_label="app")
+def test_migrations_hash(migration_app_dir):
+    connection = connections[DEFAULT_DB_ALIAS]
+    original = template.migrations_hash(connection)
+    assert template.migrations_hash(connection) == original
+
+    with (migration_app_dir / "0002_person_age.py").open("a") as f:
+        f.write("# changed\n")
+    changed = template.migrations_hash(connection)
+    assert changed != original
+
+    os.remove(migration_app_dir / "0003_auto_20190518_1524.py")
+    assert template.migrations_hash(connection) not in {original, changed}
+
+
+@pytest.mark.temporary_migration_module(module="app.tests.migrations.simple", app_label="app")
+def test_template_databases(migration_app_dir, tmp_path, django_db_blocker):
+    del migration_app_dir
+
+    def create_test_db():
+        with contextlib.ExitStack() as stack:
+            connection = stack.enter_context(sqlite_database(tmp_path))
+            stack.enter_context(template.template_databases(directory=str(tmp_path / "templates")))
+            apply_migration = stack.enter_context(
+                unittest.mock.patch.object(
+                    MigrationExecutor, "apply_migration", autospec=True, side_effect=MigrationExecutor.apply_migration
+                )
+            )
+            old_name = connection.settings_dict["NAME"]
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT COUNT(*) FROM django_migrations WHERE app = 'app'")
+                    assert cursor.fetchone() == (3,)
+                assert "app_person" in connection.introspection.table_names()
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+        return apply_migration.call_count
+
+    with django_db_blocker.unblock():
+        # First run migrates and saves the template
+        assert create_test_db() > 0
+        (template_file,) = os.listdir(tmp_path / "templates")
+        # Nothing changed, the test database is a copy of the template
+        assert create_test_db() == 0
+        assert os.listdir(tmp_path / "templates") == [template_file]
+
+
+@pytest.mark.temporary_migration_module(module="app.tests.migrations.simple", app_label="app")
+def test_template_databases_keepdb(migration_app_dir, tmp_path, django_db_blocker):
+    del migration_app_dir
+
+    with django_db_blocker.unblock(), sqlite_database(tmp_path) as connection:
+        old_name = connection.settings_dict["NAME"]
+        with template.template_databases(directory=str(tmp_path / "templates")):
+            # Saves the template
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False, keepdb=True)
+            with connection.cursor() as cursor:
+                cursor.execute("INSERT INTO app_person (name, dob) VALUES ('kept', '2000-01-01')")
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=True)
+
+            # The kept test database is not overwritten by the template
+            with unittest.mock.patch.object(template.SQLiteTemplate, "restore") as restore:
+                connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False, keepdb=True)
+            restore.assert_not_called()
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT name FROM app_person")
+                    assert cursor.fetchall() == [("kept",)]
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def test_template_directory(tmp_path, monkeypatch, settings):
+    settings.DJANGO_SQUASH_TEMPLATE_DATABASE_DIR = ""
+    directory = template.template_directory()
+    assert template.template_directory() == directory
+
+    # Another project on the same machine
+    monkeypatch.chdir(tmp_path)
+    assert template.template_directory() != directory
+
+    settings.DJANGO_SQUASH_TEMPLATE_DATABASE_DIR = str(tmp_path / "templates")
+    assert template.template_directory() == str(tmp_path / "templates")
+
+
+def test_sqlite_template_save(tmp_path, django_db_blocker):
+    directory = tmp_path / "templates"
+    directory.mkdir()
+    for name in ("default-0123456789abcdef.sqlite3", "default-replica-0123456789abcdef.sqlite3", "unrelated.txt"):
+        (directory / name).write_text("")
+
+    with django_db_blocker.unblock(), sqlite_database(tmp_path) as connection:
+        template.SQLiteTemplate(connection, "fedcba9876543210" * 4, directory).save()
+
+    # Only the previous template of the same alias is replaced
+    assert sorted(path.name for path in directory.iterdir()) == [
+        "default-fedcba9876543210.sqlite3",
+        "default-replica-0123456789abcdef.sqlite3",
+        "unrelated.txt",
+    ]
+
+
+@pytest.mark.temporary_migration_module(module="app.tests.migrations.simple", app_label="app")
+def test_template_database_runner(migration_app_dir, tmp_path, django_db_blocker, settings):
+    del migration_app_dir
+    settings.DJANGO_SQUASH_TEMPLATE_DATABASE_DIR = str(tmp_path / "templates")
+    runner = TemplateDatabaseRunner(verbosity=0, interactive=False)
+
+    def setup_databases():
+        with (
+            sqlite_database(tmp_path),
+            unittest.mock.patch.object(
+                MigrationExecutor, "apply_migration", autospec=True, side_effect=MigrationExecutor.apply_migration
+            ) as apply_migration,
+        ):
+            old_config = runner.setup_databases(aliases={DEFAULT_DB_ALIAS})
+            runner.teardown_databases(old_config)
+        return apply_migration.call_count
+
+    with django_db_blocker.unblock():
+        # First run migrates and saves the template
+        assert setup_databases() > 0
+        assert len(os.listdir(tmp_path / "templates")) == 1
+        # Nothing changed, the test database is cloned from the template
+        assert setup_databases() == 0
+
+
+def test_pytest_plugin(pytester):
+    pytester.makepyfile(
+        plugin_settings=f"""
+        SECRET_KEY = "secret"
+        INSTALLED_APPS = ["django.contrib.contenttypes", "django.contrib.auth"]
+        DATABASES = {{
+            "default": {{
+                "ENGINE": "django.db.backends.sqlite3",
+                "NAME": "db.sqlite3",
+                "TEST": {{"NAME": {str(pytester.path / "test.sqlite3")!r}}},
+            }}
+        }}
+        DJANGO_SQUASH_TEMPLATE_DATABASE_DIR = {str(pytester.path / "templates")!r}
+        """,
+        test_plugin="""
+        import pytest
+        from django.contrib.contenttypes.models import ContentType
+        from django.db.migrations.recorder import MigrationRecorder
+
+
+        @pytest.mark.django_db
+        def test_migrated():
+            assert MigrationRecorder.Migration.objects.filter(app="auth").exists()
+            ContentType.objects.get_or_create(app_label="from", model="template")
+        """,
+    )
+    args = ("-p", "django_squash.test.pytest_plugin", "--ds", "plugin_settings", "-p", "no:cacheprovider")
+
+    pytester.runpytest_subprocess(*args).assert_outcomes(passed=1)
+    (template_file,) = (pytester.path / "templates").iterdir()
+
+    # Only the template has this row, the test database of the next run is cloned from it
+    with contextlib.closing(sqlite3.connect(template_file)) as connection, connection:
+        connection.execute("INSERT INTO django_content_type (app_label, model) VALUES ('from', 'template')")
+    pytester.makepyfile(
+        test_plugin="""
+        import pytest
+        from django.contrib.contenttypes.models import ContentType
+
+
+        @pytest.mark.django_db
+        def test_cloned():
+            assert ContentType.objects.filter(app_label="from", model="template").exists()
+        """
+    )
+    pytester.runpytest_subprocess(*args).assert_outcomes(passed=1)
+    assert list((pytester.path / "templates").iterdir()) == [template_file]
@@ -1,6 +1,10 @@
 from __future__ import annotations
 
+import inspect
+import os
 import tempfile
+import textwrap
+import unittest.mock
 
 import django
 from django.db import migrations
@@ -67,6 +71,24 @@ def test_is_code_in_site_packages():
     assert not utils.is_code_in_site_packages("bad.path")
 
 
+def test_module_index():
+    index = utils.ModuleIndex()
+
+    with unittest.mock.patch("importlib.util.find_spec", wraps=utils.importlib.util.find_spec) as find_spec:
+        for _ in range(3):
+            assert index.is_installed("django.db.migrations")
+            assert not index.is_installed("django_squash.db.migrations.utils")
+            assert not index.is_installed("bad.path")
+            assert index.source_directory(utils) == os.path.dirname(os.path.abspath(utils.__file__))
+    # Modules already imported don't need to be looked up
+    assert find_spec.call_count == 1
+    assert index.origin("bad.path") is None
+
+    index.clear()
+    assert not index.origins
+    assert not index.directories
+
+
 def test_unique_names():
     names = utils.UniqueVariableName({}, lambda n, _: n)
     assert names("var") == "var"
@@ -160,6 +182,118 @@ def test_file_hash():
         assert utils.file_hash(f.name) == "9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08"
 
 
+def test_function_fingerprint():
+    def first(apps):
+        # comment
+        return apps.get_model("app", "Person")
+
+    def second(apps):
+        return apps.get_model(
+            "app",
+            "Person",
+        )
+
+    def third(apps):
+        return apps.get_model("app", "Other")
+
+    assert utils.function_fingerprint(first) == utils.function_fingerprint(second)
+    assert utils.function_fingerprint(first) != utils.function_fingerprint(third)
+
+
+def test_source_cache(tmp_path):
+    path = tmp_path / "module.py"
+    path.write_text("import os\n")
+    other_path = tmp_path / "other.py"
+    other_path.write_text("import sys\n")
+    cache = utils.SourceCache()
+
+    with unittest.mock.patch("tokenize.open", wraps=utils.tokenize.open) as tokenize_open:
+        cache.prefetch([str(path), str(other_path), str(path), str(tmp_path / "missing.py")])
+        assert tokenize_open.call_count == 2
+        assert cache.source(str(path)) == "import os\n"
+        assert cache.tree(str(path)) is cache.tree(str(path))
+        assert tokenize_open.call_count == 2
+
+        # A modified file is read again
+        path.write_text("import os\nimport re\n")
+        os.utime(path, ns=(0, 0))
+        assert len(cache.tree(str(path)).body) == 2
+        assert tokenize_open.call_count == 3
+
+    assert cache.function_source(func2) == inspect.getsource(func2)
+    assert cache.function_source(D.func) == inspect.getsource(D.func)
+
+    cache.clear()
+    assert not cache.sources
+    assert not cache.trees
+
+
+def test_replace_migration_attributes():
+    source = textwrap.dedent(
+        """\
+        from django.db import migrations
+
+
+        class Migration(migrations.Migration):
+
+            replaces = [
+                ("app", "0001_initial"),  # a comment with a bracket (
+                ("app", "0002_person_[age"),
+            ]
+
+            dependencies: list = [("app2", "0001_initial")]
+
+            operations = [
+                migrations.RunSQL("select ')'"),
+            ]
+        """
+    )
+    expected = textwrap.dedent(
+        """\
+        from django.db import migrations
+
+
+        class Migration(migrations.Migration):
+
+            replaces = []
+
+            dependencies = [('app2', '0002_squashed')]
+
+            operations = [
+                migrations.RunSQL("select ')'"),
+            ]
+        """
+    )
+    values = {"replaces": [], "dependencies": [("app2", "0002_squashed")]}
+    assert utils.replace_migration_attributes(source, values) == expected
+    # Nothing to replace
+    assert utils.replace_migration_attributes(source, {"initial": True}) == source
+    # Not a migration
+    assert utils.replace_migration_attributes("replaces = []\n", values) is None
+
+
+def test_prune_imports():
+    names = utils.used_names("def forwards(apps, schema_editor):\n    return datetime.date.today(), dt, os.path\n")
+    assert names == {"datetime", "dt", "os"}
+    assert utils.used_names("def broken(:") is None
+
+    imports = [
+        "import datetime",
+        "import itertools",
+        "import os.path",
+        "from datetime import date, datetime as dt",
+        "from random import randrange",
+        "from .models import *",
+    ]
+    assert utils.prune_imports(imports, names) == [
+        "import datetime",
+        "import os.path",
+        "from datetime import datetime as dt",
+        "from .models import *",
+    ]
+    assert utils.imported_names(imports) == {"datetime", "itertools", "os", "date", "dt", "randrange", "*"}
+
+
 def test_normalize_function_name():
     reassigned_func2 = func2
     reassigned_func2_impostor = func2_impostor
@@ -194,3 +328,34 @@ def test_get_custom_rename_function(monkeypatch):
     monkeypatch.setattr("django_squash.settings.DJANGO_SQUASH_CUSTOM_RENAME_FUNCTION", "does.not.exist")
     with pytest.raises(ModuleNotFoundError):
         utils.get_custom_rename_function()
+
+
+def test_replace_files(tmp_path):
+    first, second, deleted = tmp_path / "0001_first.py", tmp_path / "0002_second.py", tmp_path / "0003_deleted.py"
+    first.write_text("first")
+    second.write_text("second")
+    deleted.write_text("deleted")
+    new = tmp_path / "0004_new.py"
+
+    replace = os.replace
+
+    def failing_replace(src, dst):
+        if dst == str(second) and not src.endswith(".bak"):
+            raise OSError("disk full")
+        return replace(src, dst)
+
+    files = [(str(first), "new first"), (str(new), "new"), (str(second), "new second")]
+    with unittest.mock.patch.object(os, "replace", side_effect=failing_replace), pytest.raises(OSError, match="full"):
+        utils.replace_files(files, [str(deleted)])
+
+    # Nothing changed, no temporary files or backups are left behind
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["0001_first.py", "0002_second.py", "0003_deleted.py"]
+    assert first.read_text() == "first"
+    assert second.read_text() == "second"
+    assert deleted.read_text() == "deleted"
+
+    utils.replace_files(files, [str(deleted)])
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["0001_first.py", "0002_second.py", "0004_new.py"]
+    assert first.read_text() == "new first"
+    assert second.read_text() == "new second"
+    assert new.read_text() == "new"
@@ -1,10 +1,21 @@
 from __future__ import annotations
 
+import os
+import subprocess
+import sys
+
 import pytest
 
 from django_squash.db.migrations import writer
 
 
+@pytest.fixture
+def clear_django_migration_hash():
+    writer.django_migration_hash.cache_clear()
+    yield
+    writer.django_migration_hash.cache_clear()
+
+
 @pytest.mark.filterwarnings("error")
 @pytest.mark.parametrize(
     "response_hash, throws_warning",  # noqa: PT006
@@ -13,6 +24,7 @@ from django_squash.db.migrations import writer
         (writer.SUPPORTED_DJANGO_WRITER[0], False),
     ),
 )
+@pytest.mark.usefixtures("clear_django_migration_hash")
 def test_check_django_migration_hash(response_hash, throws_warning, monkeypatch):
     monkeypatch.setattr("django_squash.db.migrations.writer.utils.file_hash", lambda _: response_hash)
     if throws_warning:
@@ -20,3 +32,41 @@ def test_check_django_migration_hash(response_hash, throws_warning, monkeypatch)
             writer.check_django_migration_hash()
     else:
         writer.check_django_migration_hash()
+
+
+@pytest.mark.usefixtures("clear_django_migration_hash")
+def test_django_migration_hash_cached(monkeypatch):
+    calls = []
+
+    def file_hash(path):
+        calls.append(path)
+        return writer.SUPPORTED_DJANGO_WRITER[0]
+
+    monkeypatch.setattr("django_squash.db.migrations.writer.utils.file_hash", file_hash)
+    writer.check_django_migration_hash()
+    writer.check_django_migration_hash()
+    assert len(calls) == 1
+
+    # A modified file is hashed again
+    stat = os.stat(writer.dj_writer.__file__)
+    monkeypatch.setattr("django_squash.db.migrations.writer.os.stat", lambda _: os.stat_result((*stat[:8], 0, 0)))
+    writer.check_django_migration_hash()
+    assert len(calls) == 2
+
+
+def test_import_is_lightweight():
+    """Loading the app and the command (`manage.py help`) does not import the squash machinery nor hash files."""
+    code = (
+        "import sys; import django_squash, django_squash.apps, django_squash.management.commands.squash_migrations; "
+        "print(sorted(name for name in sys.modules if name.startswith('django_squash.')))"
+    )
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == str(
+        [
+            "django_squash.apps",
+            "django_squash.management",
+            "django_squash.management.commands",
+            "django_squash.management.commands.squash_migrations",
+            "django_squash.settings",
+        ]
+    )